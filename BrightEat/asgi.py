@@ -21,9 +21,11 @@ django_asgi_app = get_asgi_application()
 
 from orders import routing
 from orders.middleware import JWTAuthMiddlewareStack
+from orders.outbox import relay_lifespan
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": relay_lifespan,
     "websocket": AllowedHostsOriginValidator(
         JWTAuthMiddlewareStack(
             URLRouter(routing.websocket_urlpatterns)
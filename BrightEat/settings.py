@@ -150,13 +150,23 @@ AUTH_USER_MODEL = 'orders.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'orders.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # orjson with DRF's output format (see orders/fastjson.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'orders.fastjson.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'orders.fastjson.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # CSRF settings - Exempt API endpoints from CSRF
@@ -205,6 +215,52 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    # Repairs order totals left off by bulk deletes, cascades or races (see orders/models.py)
+    'verify-order-totals': {
+        'task': 'verify_order_totals',
+        'schedule': float(os.environ.get('ORDER_TOTALS_VERIFY_INTERVAL', 3600)),
+    },
+    # Deletes menu snapshots no order pins any more (see orders/menu_snapshots.py)
+    'compact-menu-snapshots': {
+        'task': 'compact_menu_snapshots',
+        'schedule': float(os.environ.get('MENU_SNAPSHOT_COMPACT_INTERVAL', 86400)),
+    },
+}
+
+# Cache (order snapshots and other shared caches)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', 6379)}/1",
+    },
+}
+# Seconds a serialized order snapshot stays cached; entries are keyed by order version
+ORDER_SNAPSHOT_CACHE_TIMEOUT = int(os.environ.get('ORDER_SNAPSHOT_CACHE_TIMEOUT', 600))
+# 'postgres' builds snapshots in one JSON-aggregating query (see orders/sql_snapshots.py);
+# 'serializer' uses CollectionOrderSerializer. Other databases always use the serializer
+ORDER_SNAPSHOT_BACKEND = os.environ.get('ORDER_SNAPSHOT_BACKEND', 'serializer')
+# Seconds compiled menu documents and their published versions stay cached (see orders/menu_documents.py)
+MENU_DOCUMENT_CACHE_TIMEOUT = int(os.environ.get('MENU_DOCUMENT_CACHE_TIMEOUT', 86400))
+# Seconds a published menu document version answers revalidations before the menu row is read
+# again; bounds how long a lost or out-of-order publish can serve a stale version
+MENU_VERSION_CACHE_TIMEOUT = int(os.environ.get('MENU_VERSION_CACHE_TIMEOUT', 60))
+# Seconds a full catalog bundle stays cached; bundles are keyed by catalog version (see orders/catalog.py)
+CATALOG_BUNDLE_CACHE_TIMEOUT = int(os.environ.get('CATALOG_BUNDLE_CACHE_TIMEOUT', 86400))
+# Menu snapshots pinned by orders (see orders/menu_snapshots.py): seconds their documents stay
+# cached, and days an unpinned snapshot is kept before compact_menu_snapshots deletes it
+MENU_SNAPSHOT_CACHE_TIMEOUT = int(os.environ.get('MENU_SNAPSHOT_CACHE_TIMEOUT', 86400))
+MENU_SNAPSHOT_RETENTION_DAYS = int(os.environ.get('MENU_SNAPSHOT_RETENTION_DAYS', 30))
+# Menu item search (see orders/search.py): seconds between catalog version checks of each
+# process's index, and the share of a query's trigrams a name needs to match with typos
+SEARCH_INDEX_CHECK_INTERVAL = float(os.environ.get('SEARCH_INDEX_CHECK_INTERVAL', '2'))
+SEARCH_MIN_SIMILARITY = float(os.environ.get('SEARCH_MIN_SIMILARITY', '0.5'))
+
+# Users behind JWTs: each process trusts its own copy for AUTH_USER_CACHE_TTL seconds
+# before revalidating against the shared cache (see orders/user_cache.py)
+AUTH_USER_CACHE_TTL = float(os.environ.get('AUTH_USER_CACHE_TTL', '30'))
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 3600))
 
 # Channels Configuration
 ASGI_APPLICATION = 'BrightEat.asgi.application'
@@ -216,3 +272,36 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Order broadcast coalescing (seconds): writes to the same order within the window
+# share one serialization and fan-out; no broadcast is delayed longer than the max
+ORDER_BROADCAST_COALESCE_WINDOW = float(os.environ.get('ORDER_BROADCAST_COALESCE_WINDOW', '0.15'))
+ORDER_BROADCAST_MAX_DELAY = float(os.environ.get('ORDER_BROADCAST_MAX_DELAY', '0.5'))
+
+# Order event outbox relay. By default it runs inside the ASGI server; set
+# ORDER_EVENT_RELAY_IN_PROCESS=False and run `manage.py relay_order_events` instead
+ORDER_EVENT_RELAY_IN_PROCESS = os.environ.get('ORDER_EVENT_RELAY_IN_PROCESS', 'True') == 'True'
+ORDER_EVENT_RELAY_BATCH_SIZE = int(os.environ.get('ORDER_EVENT_RELAY_BATCH_SIZE', 500))
+# Fallback poll (seconds) for events committed by other processes
+ORDER_EVENT_RELAY_POLL_INTERVAL = float(os.environ.get('ORDER_EVENT_RELAY_POLL_INTERVAL', '1.0'))
+# Published events are kept this long (seconds) before being pruned
+ORDER_EVENT_RETENTION = int(os.environ.get('ORDER_EVENT_RETENTION', 3600))
+
+# Replay buffer for WebSocket reconnects (`?since=<version>`): the last N frames
+# of each order, dropped after the order has been idle for the TTL (seconds)
+ORDER_REPLAY_REDIS_URL = os.environ.get(
+    'ORDER_REPLAY_REDIS_URL',
+    f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', 6379)}/2",
+)
+ORDER_REPLAY_BUFFER_SIZE = int(os.environ.get('ORDER_REPLAY_BUFFER_SIZE', 200))
+ORDER_REPLAY_BUFFER_TTL = int(os.environ.get('ORDER_REPLAY_BUFFER_TTL', 3600))
+
+# Slow WebSocket clients: frames queued per connection before pending order
+# updates collapse into a snapshot, and undelivered updates before disconnecting
+WS_OUTBOX_SIZE = int(os.environ.get('WS_OUTBOX_SIZE', 100))
+WS_SLOW_CONSUMER_MAX_DROPPED = int(os.environ.get('WS_SLOW_CONSUMER_MAX_DROPPED', 500))
+
+# HTTP fallbacks for order updates: seconds between SSE keepalive comments, and
+# how long a long-poll request waits for a new version before answering 204
+ORDER_SSE_KEEPALIVE = float(os.environ.get('ORDER_SSE_KEEPALIVE', '15'))
+ORDER_LONG_POLL_TIMEOUT = float(os.environ.get('ORDER_LONG_POLL_TIMEOUT', '25'))
@@ -0,0 +1,93 @@
+import { defineStore } from 'pinia'
+import { ref } from 'vue'
+
+// Live summary rows of active orders, pushed over ws/orders/board/
+export const useBoardStore = defineStore('board', () => {
+  const orders = ref([])
+  const connected = ref(false)
+  const socket = ref(null)
+  const reconnectDelay = 3000
+  let pingInterval = null
+  let closing = false
+
+  function getWebSocketUrl() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+    const token = localStorage.getItem('access_token')
+    let wsUrl = `${protocol}//${window.location.host}/ws/orders/board/`
+    if (token) {
+      wsUrl += `?token=${encodeURIComponent(token)}`
+    }
+    return wsUrl
+  }
+
+  function upsert(row) {
+    const index = orders.value.findIndex(order => order.id === row.id)
+    if (index >= 0) {
+      orders.value.splice(index, 1, row)
+    } else {
+      // Newest first, like the orders list
+      orders.value.unshift(row)
+    }
+  }
+
+  function connect() {
+    if (socket.value && socket.value.readyState !== WebSocket.CLOSED) {
+      return
+    }
+    closing = false
+
+    const ws = new WebSocket(getWebSocketUrl())
+
+    ws.onopen = () => {
+      connected.value = true
+    }
+
+    ws.onmessage = (event) => {
+      try {
+        const data = JSON.parse(event.data)
+        if (data.type === 'board_snapshot') {
+          orders.value = data.orders
+        } else if (data.type === 'board_update') {
+          upsert(data.order)
+        } else if (data.type === 'board_remove') {
+          orders.value = orders.value.filter(order => order.id !== data.order_id)
+        }
+      } catch (error) {
+        console.error('Error parsing board message:', error)
+      }
+    }
+
+    ws.onclose = () => {
+      connected.value = false
+      clearInterval(pingInterval)
+      if (!closing) {
+        // The server sends a fresh snapshot on reconnect
+        setTimeout(connect, reconnectDelay)
+      }
+    }
+
+    pingInterval = setInterval(() => {
+      if (ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'ping' }))
+      }
+    }, 30000)
+
+    socket.value = ws
+  }
+
+  function disconnect() {
+    closing = true
+    if (socket.value) {
+      socket.value.close(1000, 'Client disconnecting')
+      socket.value = null
+    }
+    connected.value = false
+  }
+
+  return {
+    orders,
+    connected,
+    connect,
+    disconnect
+  }
+})
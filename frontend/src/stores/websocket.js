@@ -1,5 +1,6 @@
 import { defineStore } from 'pinia'
 import { ref } from 'vue'
+import api from '../api'
 
 export const useWebSocketStore = defineStore('websocket', () => {
   const socket = ref(null)
@@ -7,6 +8,50 @@ export const useWebSocketStore = defineStore('websocket', () => {
   const reconnectAttempts = ref(0)
   const maxReconnectAttempts = 5
   const reconnectDelay = 3000
+  // Last full order received; delta patches are applied on top of it
+  let snapshot = null
+  // Server-Sent Events fallback once WebSockets keep failing (e.g. blocked by a proxy)
+  let eventSource = null
+
+  function applyPatch(order, patch) {
+    switch (patch.op) {
+      case 'item_added':
+      case 'item_updated': {
+        const items = order.items.filter(item => item.id !== patch.item.id)
+        // Items are ordered newest first
+        items.push(patch.item)
+        items.sort((a, b) => new Date(b.created_at) - new Date(a.created_at))
+        order.items = items
+        break
+      }
+      case 'item_removed':
+        order.items = order.items.filter(item => item.id !== patch.item_id)
+        break
+      case 'payment_changed': {
+        const index = order.payments.findIndex(payment => payment.id === patch.payment.id)
+        if (index >= 0) {
+          order.payments.splice(index, 1, patch.payment)
+        } else {
+          order.payments.unshift(patch.payment)
+        }
+        break
+      }
+      case 'fee_changed':
+        Object.assign(order, patch.fees)
+        break
+    }
+  }
+
+  function applyPatchMessage(data) {
+    const order = { ...snapshot, items: [...snapshot.items], payments: [...snapshot.payments] }
+    data.patches.forEach(patch => applyPatch(order, patch))
+    Object.assign(order, data.totals)
+    if (data.participants) {
+      order.participants = data.participants
+    }
+    order.version = data.version
+    return order
+  }
 
   function getWebSocketUrl(orderId) {
     // Use the same host and protocol as the current page
@@ -17,11 +62,17 @@ export const useWebSocketStore = defineStore('websocket', () => {
     const token = localStorage.getItem('access_token')
     
     // Build WebSocket URL - use same host as current page
-    let wsUrl = `${protocol}//${host}/ws/orders/${orderId}/`
+    // protocol=delta: receive small versioned patches instead of full orders
+    let wsUrl = `${protocol}//${host}/ws/orders/${orderId}/?protocol=delta`
+    
+    // When reconnecting, only ask for what we missed since our snapshot
+    if (snapshot && String(snapshot.id) === String(orderId)) {
+      wsUrl += `&since=${snapshot.version}`
+    }
     
     // Add token as query parameter for JWT authentication
     if (token) {
-      wsUrl += `?token=${encodeURIComponent(token)}`
+      wsUrl += `&token=${encodeURIComponent(token)}`
     } else {
       console.warn('No access token found for WebSocket authentication')
     }
@@ -55,7 +106,16 @@ export const useWebSocketStore = defineStore('websocket', () => {
         try {
           const data = JSON.parse(event.data)
           if (data.type === 'order_update' && data.order) {
+            snapshot = data.order
             onMessage(data.order)
+          } else if (data.type === 'order_patch') {
+            if (!snapshot || data.base_version !== snapshot.version) {
+              // Missed an update - ask the server for a fresh snapshot
+              ws.send(JSON.stringify({ type: 'resync' }))
+              return
+            }
+            snapshot = applyPatchMessage(data)
+            onMessage(snapshot)
           } else if (data.type === 'pong') {
             // Heartbeat response
           }
@@ -82,6 +142,8 @@ export const useWebSocketStore = defineStore('websocket', () => {
           }, reconnectDelay)
         } else if (event.code === 1000) {
           console.log('WebSocket closed normally for order', orderId)
+        } else if (onMessage) {
+          connectEvents(orderId, onMessage)
         }
       }
       
@@ -101,10 +163,34 @@ export const useWebSocketStore = defineStore('websocket', () => {
     }
   }
 
+  function connectEvents(orderId, onMessage) {
+    console.log('WebSocket unavailable, streaming order', orderId, 'over Server-Sent Events')
+    const token = localStorage.getItem('access_token')
+    eventSource = new EventSource(`${api.defaults.baseURL}/orders/${orderId}/events/?token=${encodeURIComponent(token)}`)
+    eventSource.addEventListener('order_update', (event) => {
+      snapshot = JSON.parse(event.data)
+      onMessage(snapshot)
+    })
+    eventSource.onopen = () => {
+      connected.value = true
+    }
+    // EventSource reconnects by itself, resuming with the last event id (order version)
+    eventSource.onerror = () => {
+      connected.value = false
+    }
+  }
+
   function disconnect() {
+    if (eventSource) {
+      eventSource.close()
+      eventSource = null
+      snapshot = null
+      connected.value = false
+    }
     if (socket.value) {
       socket.value.close(1000, 'Client disconnecting')
       socket.value = null
+      snapshot = null
       connected.value = false
     }
   }
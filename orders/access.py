@@ -0,0 +1,119 @@
+"""
+Access policy for collection orders.
+
+A user can view an order if they are a manager, its collector, assigned to
+it or have items in it, or if the order is public. Orders with assigned
+users can only be joined (found by code, items added) by those users, the
+collector and managers.
+
+Every check is answered with a single query: the membership tests are
+EXISTS subqueries on indexed foreign keys, annotated onto the order.
+"""
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from .async_db import aclose_old_connections
+from .models import CollectionOrder, OrderItem
+
+AssignedUser = CollectionOrder.assigned_users.through
+
+
+def annotate_access(queryset, user):
+    """Annotate orders with the membership flags OrderAccess needs"""
+    return queryset.annotate(
+        user_is_assigned=Exists(AssignedUser.objects.filter(collectionorder_id=OuterRef('pk'), user_id=user.id)),
+        has_assigned_users=Exists(AssignedUser.objects.filter(collectionorder_id=OuterRef('pk'))),
+        user_has_items=Exists(OrderItem.objects.filter(order_id=OuterRef('pk'), user_id=user.id)),
+    )
+
+
+def filter_visible(queryset, user):
+    """Restrict orders to the ones the user can view"""
+    if user.role == 'manager':
+        return queryset
+    return queryset.filter(
+        Q(is_private=False) |  # Public orders
+        Q(collector=user) |    # Orders I collected
+        Exists(OrderItem.objects.filter(order_id=OuterRef('pk'), user_id=user.id)) |  # Orders I'm participating in
+        Exists(AssignedUser.objects.filter(collectionorder_id=OuterRef('pk'), user_id=user.id))  # Orders I'm assigned to
+    )
+
+
+class OrderAccess:
+    """What one user may do with one order"""
+    
+    def __init__(self, user, collector_id, is_private, is_assigned, has_assigned_users, has_items):
+        self.is_manager = user.role == 'manager'
+        self.is_collector = collector_id == user.id
+        self.is_private = bool(is_private)
+        self.is_assigned = bool(is_assigned)
+        self.has_assigned_users = bool(has_assigned_users)
+        self.has_items = bool(has_items)
+    
+    @classmethod
+    def for_order(cls, user, order):
+        """Build from an order fetched through annotate_access()"""
+        return cls(
+            user, order.collector_id, order.is_private,
+            order.user_is_assigned, order.has_assigned_users, order.user_has_items,
+        )
+    
+    @property
+    def can_view(self):
+        return self.is_manager or self.is_collector or not self.is_private or self.is_assigned or self.has_items
+    
+    @property
+    def can_join(self):
+        """Whether the user may open the order by code and add items to it"""
+        return not self.has_assigned_users or self.is_assigned or self.is_manager or self.is_collector
+
+
+def _access_sql(count):
+    # Same query as annotate_access() on the given orders. Written out because on
+    # the WebSocket connect path building the ORM query costs more than running it
+    return f"""
+        SELECT o.id, o.collector_id, o.is_private,
+            EXISTS (SELECT 1 FROM {AssignedUser._meta.db_table} a WHERE a.collectionorder_id = o.id AND a.user_id = %s),
+            EXISTS (SELECT 1 FROM {AssignedUser._meta.db_table} a WHERE a.collectionorder_id = o.id),
+            EXISTS (SELECT 1 FROM {OrderItem._meta.db_table} i WHERE i.order_id = o.id AND i.user_id = %s)
+        FROM {CollectionOrder._meta.db_table} o
+        WHERE o.id IN ({', '.join(['%s'] * count)})
+    """
+
+
+def get_orders_access(user, order_ids):
+    """Return {order_id: OrderAccess} for the orders that exist, in one query"""
+    order_ids = sorted({int(order_id) for order_id in order_ids})
+    if not order_ids:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(_access_sql(len(order_ids)), [user.id, user.id, *order_ids])
+        rows = cursor.fetchall()
+    return {row[0]: OrderAccess(user, *row[1:]) for row in rows}
+
+
+def get_order_access(user, order_id, request=None):
+    """
+    Return the user's OrderAccess for an order, or None if it doesn't exist.
+    Results are memoized on `request` when given.
+    """
+    key = (user.id, int(order_id))
+    memo = request.__dict__.setdefault('_order_access', {}) if request is not None else {}
+    if key not in memo:
+        memo[key] = get_orders_access(user, [order_id]).get(int(order_id))
+    return memo[key]
+
+
+async def aget_orders_access(user, order_ids):
+    """
+    Async get_orders_access(). The raw query has no async cursor, so it runs the
+    way Django's async ORM runs every query: in the shared database thread,
+    after stale connections there are closed (see async_db).
+    """
+    await aclose_old_connections()
+    return await sync_to_async(get_orders_access)(user, order_ids)
+
+
+async def aget_order_access(user, order_id):
+    """Async get_order_access(), without request memoization"""
+    return (await aget_orders_access(user, [order_id])).get(int(order_id))
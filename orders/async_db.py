@@ -0,0 +1,31 @@
+"""
+Connection upkeep for the async ORM.
+
+Consumers read through Django's async ORM, which runs every query in the
+shared thread-sensitive database thread. Unlike database_sync_to_async it
+never calls close_old_connections, so a connection past CONN_MAX_AGE, or one
+the server dropped, would stay in use for the life of the process.
+`aclose_old_connections()` closes those before a read. It runs at most once
+per CHECK_INTERVAL, so a connect storm keeps using one healthy connection
+instead of reopening it for every read (with CONN_MAX_AGE=0 every check
+closes it).
+"""
+import time
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+# Seconds between checks of the database thread's connections
+CHECK_INTERVAL = 1.0
+
+_checked_at = None
+
+
+async def aclose_old_connections():
+    """Close the database thread's expired or broken connections, unless checked within CHECK_INTERVAL"""
+    global _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < CHECK_INTERVAL:
+        return
+    _checked_at = now
+    # Thread-sensitive, so it runs in the thread whose connections the async ORM uses
+    await sync_to_async(close_old_connections)()
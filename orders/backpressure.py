@@ -0,0 +1,179 @@
+"""
+Per-connection send queues for order WebSockets.
+
+Group messages are handed to the connection's outbox and written to the socket
+by a separate task, so a client that stops reading no longer stalls its
+consumer until channels_redis hits the channel capacity and silently drops its
+updates. Instead:
+
+- At most WS_OUTBOX_SIZE frames wait per connection. A full order update
+  replaces an unsent one for the same order.
+- When the outbox is full, the frames waiting for each order collapse into a
+  single snapshot, fetched when the client gets to it ("latest snapshot wins").
+  Updates to an order arriving while its snapshot waits are dropped.
+- A connection that has had WS_SLOW_CONSUMER_MAX_DROPPED updates collapsed or
+  dropped without its outbox draining is closed with code 4008. Clients
+  reconnect and resume with `since`.
+
+Each open connection's queue length and lag are listed at /api/metrics/.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+_lock = threading.Lock()
+_open = set()
+
+
+class Outbox:
+    """Frames waiting to be written to one WebSocket, drained by a writer task"""
+    
+    def __init__(self, write, snapshot, close, label):
+        self.write = write  # async (frame)
+        self.snapshot = snapshot  # async (order_id) -> frame, or None to skip
+        self.close = close  # async (code)
+        self.label = label
+        self.size = settings.WS_OUTBOX_SIZE
+        self.max_dropped = settings.WS_SLOW_CONSUMER_MAX_DROPPED
+        # [order_id (None for control frames), frame (None: fetch a snapshot), replaceable, queued_at]
+        self.entries = deque()
+        # Orders with a snapshot waiting
+        self.stale = set()
+        # Updates collapsed or dropped since the outbox was last empty
+        self.dropped = 0
+        self.closing = False
+        self.ready = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+        with _lock:
+            _open.add(self)
+    
+    def awaiting_snapshot(self, order_id):
+        """Whether updates to this order are superseded by a snapshot still to be sent"""
+        return order_id in self.stale
+    
+    def put(self, frame, order_id=None, replaceable=False):
+        """Queue a frame. `replaceable` frames carry the full order and supersede each other."""
+        if self.closing:
+            return
+        if order_id is not None and order_id in self.stale:
+            self.drop(1)
+            return
+        if replaceable:
+            for entry in self.entries:
+                if entry[0] == order_id and entry[2]:
+                    entry[1] = frame
+                    metrics.incr('ws_outbox_replaced')
+                    return
+        if len(self.entries) >= self.size:
+            self.collapse()
+            if order_id is not None and order_id in self.stale:
+                self.drop(1)
+                return
+        self.entries.append([order_id, frame, replaceable, time.monotonic()])
+        self.ready.set()
+    
+    def request_snapshot(self, order_id):
+        """Queue a fresh snapshot of an order in place of its unsent frames"""
+        if self.closing or order_id in self.stale:
+            return
+        queued_at = time.monotonic()
+        for entry in self.entries:
+            if entry[0] == order_id:
+                queued_at = min(queued_at, entry[3])
+        self.entries = deque(entry for entry in self.entries if entry[0] != order_id)
+        self.entries.append([order_id, None, False, queued_at])
+        self.stale.add(order_id)
+        self.ready.set()
+    
+    def collapse(self):
+        """Replace every order's waiting frames with one snapshot, keeping its place in the queue"""
+        entries = deque()
+        collapsed = 0
+        for entry in self.entries:
+            order_id, frame = entry[0], entry[1]
+            if order_id is None:
+                entries.append(entry)
+            elif order_id in self.stale:
+                collapsed += frame is not None
+            else:
+                self.stale.add(order_id)
+                entries.append([order_id, None, False, entry[3]])
+                collapsed += 1
+        self.entries = entries
+        self.drop(collapsed)
+    
+    def drop(self, count):
+        if not count:
+            return
+        metrics.incr('ws_outbox_dropped', count)
+        self.dropped += count
+        if self.dropped >= self.max_dropped and not self.closing:
+            self.closing = True
+            metrics.incr('ws_slow_consumer_closed')
+            logger.info('Closing slow WebSocket %s after %s undelivered updates', self.label, self.dropped)
+            asyncio.ensure_future(self.close_slow())
+    
+    async def close_slow(self):
+        self.stop()
+        await self.close(SLOW_CONSUMER_CLOSE_CODE)
+    
+    async def run(self):
+        try:
+            while True:
+                if not self.entries:
+                    self.dropped = 0
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                order_id, frame, _, _ = self.entries.popleft()
+                if frame is None:
+                    # Updates keep being dropped until the snapshot has been read
+                    frame = await self.snapshot(order_id)
+                    self.stale.discard(order_id)
+                    if frame is None:
+                        continue
+                await self.write(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning('WebSocket writer for %s stopped', self.label, exc_info=True)
+            self.stop()
+    
+    def stop(self):
+        """Stop writing; unsent frames are discarded"""
+        self.closing = True
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        with _lock:
+            _open.discard(self)
+    
+    def lag(self):
+        # Read from metrics requests on other threads; tolerate concurrent changes
+        try:
+            oldest = self.entries[0][3]
+        except IndexError:
+            oldest = None
+        return {
+            'connection': self.label,
+            'queued': len(self.entries),
+            'lag_ms': round((time.monotonic() - oldest) * 1000) if oldest is not None else 0,
+            'awaiting_snapshot': len(self.stale),
+            'dropped': self.dropped,
+        }
+
+
+def connection_lag(limit=50):
+    """Queue state of this process's open order WebSockets, most lagged first"""
+    with _lock:
+        outboxes = list(_open)
+    rows = [outbox.lag() for outbox in outboxes]
+    rows.sort(key=lambda row: (row['lag_ms'], row['queued']), reverse=True)
+    return {'open': len(rows), 'most_lagged': rows[:limit]}
@@ -0,0 +1,120 @@
+"""
+Live board of active (not closed) orders.
+
+Clients connected to `ws/orders/board/` get the summary rows of the orders
+they can see, then a `board_update` whenever a row changes (order created,
+status or totals changed) and a `board_remove` when an order is closed,
+deleted or no longer visible to them. Rows are derived from the order
+snapshot the relay already serializes for each broadcast, so the board adds
+no queries to the write path.
+"""
+import logging
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from rest_framework import serializers
+from .access import filter_visible
+from .models import CollectionOrder
+
+logger = logging.getLogger(__name__)
+
+BOARD_GROUP = 'orders_board'
+
+# Last row sent per order, so unchanged rows are not broadcast again
+ROW_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def row_cache_key(order_id):
+    return f'order_board_row:{order_id}'
+
+
+def board_row(order_data):
+    """Summary row for an order snapshot"""
+    return {
+        'id': order_data['id'],
+        'code': order_data['code'],
+        'restaurant': order_data['restaurant'],
+        'restaurant_name': order_data['restaurant_name'],
+        'collector': order_data['collector'],
+        'collector_name': order_data['collector_name'],
+        'status': order_data['status'],
+        'is_private': order_data['is_private'],
+        'participant_count': len(order_data['participants']),
+        'total_cost': order_data['total_cost'],
+        'cutoff_time': order_data['cutoff_time'],
+        'created_at': order_data['created_at'],
+    }
+
+
+def get_board(user, order_ids=None):
+    """Summary rows of the active orders the user can see (optionally only these), in one query"""
+    orders = (
+        filter_visible(CollectionOrder.objects.exclude(status='CLOSED'), user)
+        .select_related('restaurant', 'collector')
+    )
+    if order_ids is not None:
+        orders = orders.filter(id__in=order_ids)
+    datetime_field = serializers.DateTimeField()
+    return [
+        {
+            'id': order.id,
+            'code': order.code,
+            'restaurant': order.restaurant_id,
+            'restaurant_name': order.restaurant.name,
+            'collector': order.collector_id,
+            'collector_name': order.collector.username,
+            'status': order.status,
+            'is_private': order.is_private,
+            'participant_count': order.participant_count,
+            'total_cost': float(order.get_total_cost()),
+            'cutoff_time': datetime_field.to_representation(order.cutoff_time) if order.cutoff_time else None,
+            'created_at': datetime_field.to_representation(order.created_at),
+        }
+        for order in orders
+    ]
+
+
+def row_visible_to(user, visibility):
+    """Same rule as access.OrderAccess.can_view, evaluated on broadcast data"""
+    return (
+        user.role == 'manager'
+        or visibility['collector'] == user.id
+        or not visibility['is_private']
+        or user.id in visibility['assigned_user_ids']
+        or user.id in visibility['participant_ids']
+    )
+
+
+async def publish_board_row(order_data):
+    """Send an order's board row if it or who may see it changed since it was last sent"""
+    message = {
+        'type': 'board_update',
+        'row': board_row(order_data),
+        'visibility': {
+            'collector': order_data['collector'],
+            'is_private': order_data['is_private'],
+            'assigned_user_ids': order_data['assigned_users'],
+            'participant_ids': [participant['id'] for participant in order_data['participants']],
+        },
+    }
+    # Visibility is part of the key: a newly assigned user still gets an unchanged row
+    key = row_cache_key(order_data['id'])
+    try:
+        if await cache.aget(key) == message:
+            return
+        await cache.aset(key, message, ROW_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Board row cache unavailable', exc_info=True)
+    
+    await get_channel_layer().group_send(BOARD_GROUP, message)
+
+
+async def publish_board_removal(order_id):
+    """Remove a deleted order from every board"""
+    try:
+        await cache.adelete(row_cache_key(order_id))
+    except Exception:
+        logger.warning('Board row cache unavailable', exc_info=True)
+    await get_channel_layer().group_send(BOARD_GROUP, {
+        'type': 'board_remove',
+        'order_id': order_id,
+    })
@@ -0,0 +1,164 @@
+"""
+Offline catalog bundles for the mobile app.
+
+`GET /api/catalog/` returns every restaurant, its active menus and their
+available items in one compressed JSON document. Restaurants, menus and
+items carry the catalog version of their last change (see
+models.next_catalog_version): Talabat syncs and manual edits both allocate
+versions. With `?since=<catalog_version>` the bundle only holds what
+changed after that version, plus the ids removed since then - deleted rows
+(CatalogTombstone), inactive menus and unavailable items. Clients drop the
+menus and items of removed restaurants and menus along with them.
+
+Full bundles are cached per catalog version with their gzip and brotli
+variants and revalidated with a strong ETag. Deltas are small and built per
+request.
+"""
+import gzip
+import logging
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from . import fastjson, metrics
+from .menu_documents import ENCODINGS, accepted_encoding, encode_variants, if_none_match
+from .models import CatalogTombstone, CatalogVersion, Menu, MenuItem, Restaurant
+
+logger = logging.getLogger(__name__)
+
+# Columns read for each kind of row, in the order the _restaurant/_menu/_item builders unpack them
+RESTAURANT_COLUMNS = ('id', 'name', 'description', 'catalog_version')
+MENU_COLUMNS = ('id', 'restaurant_id', 'name', 'menu_hash', 'catalog_version')
+ITEM_COLUMNS = ('id', 'menu_id', 'name', 'description', 'price', 'section_name', 'catalog_version')
+
+
+def bundle_key(version):
+    return f'catalog_bundle:{version}'
+
+
+def etag(version, encoding=None):
+    return f'"catalog-{version}-{encoding}"' if encoding else f'"catalog-{version}"'
+
+
+def current_version():
+    """The latest committed catalog version"""
+    return CatalogVersion.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+
+def _restaurant(row):
+    restaurant_id, name, description, catalog_version = row
+    return {'id': restaurant_id, 'name': name, 'description': description, 'catalog_version': catalog_version}
+
+
+def _menu(row):
+    menu_id, restaurant_id, name, menu_hash, catalog_version = row
+    return {
+        'id': menu_id, 'restaurant': restaurant_id, 'name': name,
+        'menu_hash': menu_hash, 'catalog_version': catalog_version,
+    }
+
+
+def _item(row):
+    item_id, menu_id, name, description, price, section_name, catalog_version = row
+    return {
+        'id': item_id, 'menu': menu_id, 'name': name, 'description': description,
+        # Two-place strings, like MenuItemSerializer
+        'price': str(price), 'section_name': section_name, 'catalog_version': catalog_version,
+    }
+
+
+def full_bundle(version):
+    """Every restaurant, active menu and available item at `version`"""
+    items = MenuItem.objects.filter(menu__is_active=True, is_available=True).order_by('menu_id', 'section_name', 'name')
+    return {
+        'catalog_version': version,
+        'since': None,
+        'restaurants': [_restaurant(row) for row in Restaurant.objects.order_by('id').values_list(*RESTAURANT_COLUMNS)],
+        'menus': [_menu(row) for row in Menu.objects.filter(is_active=True).order_by('id').values_list(*MENU_COLUMNS)],
+        'items': [_item(row) for row in items.values_list(*ITEM_COLUMNS)],
+        'removed': {'restaurants': [], 'menus': [], 'items': []},
+    }
+
+
+def delta_bundle(version, since):
+    """What changed after `since`. Rows newer than `version` may be included; clients apply them idempotently."""
+    removed = {'restaurants': [], 'menus': [], 'items': []}
+    for kind, object_id in CatalogTombstone.objects.filter(catalog_version__gt=since).values_list('kind', 'object_id'):
+        removed[{'restaurant': 'restaurants', 'menu': 'menus', 'item': 'items'}[kind]].append(object_id)
+    
+    menus = []
+    for row in Menu.objects.filter(catalog_version__gt=since).order_by('id').values_list(*MENU_COLUMNS, 'is_active'):
+        if row[-1]:
+            menus.append(_menu(row[:-1]))
+        else:
+            removed['menus'].append(row[0])
+    
+    items = []
+    changed_items = MenuItem.objects.filter(catalog_version__gt=since).order_by('menu_id', 'section_name', 'name')
+    for row in changed_items.values_list(*ITEM_COLUMNS, 'is_available', 'menu__is_active'):
+        if row[-2] and row[-1]:
+            items.append(_item(row[:-2]))
+        else:
+            removed['items'].append(row[0])
+    
+    restaurants = Restaurant.objects.filter(catalog_version__gt=since).order_by('id')
+    return {
+        'catalog_version': version,
+        'since': since,
+        'restaurants': [_restaurant(row) for row in restaurants.values_list(*RESTAURANT_COLUMNS)],
+        'menus': menus,
+        'items': items,
+        'removed': removed,
+    }
+
+
+def get_full_bundle(version):
+    """The compiled full bundle of a version, from cache or built now"""
+    try:
+        variants = cache.get(bundle_key(version))
+    except Exception:
+        logger.warning('Catalog bundle cache unavailable', exc_info=True)
+        variants = None
+    if variants is not None:
+        metrics.incr('catalog_bundle_cache_hit')
+        return variants
+    
+    metrics.incr('catalog_bundle_compiled')
+    variants = encode_variants(fastjson.dumps(full_bundle(version)))
+    try:
+        cache.set(bundle_key(version), variants, settings.CATALOG_BUNDLE_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Catalog bundle cache unavailable', exc_info=True)
+    return variants
+
+
+def bundle_response(request):
+    """
+    The catalog for `?since=`: a delta when since is a version the catalog
+    has reached, otherwise the full bundle.
+    """
+    version = current_version()
+    since = request.GET.get('since', '')
+    encoding = accepted_encoding(request)
+    
+    if since.isdigit() and 0 < int(since) <= version:
+        metrics.incr('catalog_delta')
+        body = fastjson.dumps(delta_bundle(version, int(since)))
+        # Built per request, so compressed for speed rather than size
+        if encoding == 'br':
+            body = brotli.compress(body, quality=5)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        response = HttpResponse(body, content_type='application/json')
+    else:
+        if if_none_match(request, [etag(version, coding) for coding in (None, *ENCODINGS)]):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(get_full_bundle(version)[encoding or 'identity'], content_type='application/json')
+        response['ETag'] = etag(version, encoding)
+        response['Cache-Control'] = 'no-cache'
+    
+    if encoding and response.status_code == 200:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    return response
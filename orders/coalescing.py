@@ -0,0 +1,56 @@
+"""
+Per-order coalescing of WebSocket broadcasts.
+
+Bursts of writes to the same order (e.g. the pre-cutoff rush) each record an
+outbox event. The relay merges all pending events of an order into a single
+broadcast, so the order is serialized and fanned out once per burst. An order
+is flushed once no new event has arrived for the coalescing window, and never
+later than the maximum delay after its oldest pending event.
+"""
+from datetime import timedelta
+
+
+class PendingBroadcast:
+    """Changes accumulated for one order until its broadcast is flushed"""
+    
+    def __init__(self):
+        self.event_ids = []
+        self.full_snapshot = False
+        self.patches = []
+        self.include_participants = False
+        self.access_changed = False
+        self.removed = False
+        self.version = None
+        self.first_created_at = None
+        self.last_created_at = None
+    
+    def merge(self, event):
+        self.event_ids.append(event.id)
+        if event.kind == 'removed':
+            self.removed = True
+        elif event.kind == 'snapshot':
+            self.full_snapshot = True
+        elif event.patch is not None:
+            self.patches.append({**event.patch, 'version': event.version})
+        self.include_participants = self.include_participants or event.include_participants
+        self.access_changed = self.access_changed or event.access_changed
+        self.version = event.version if self.version is None else max(self.version, event.version)
+        if self.first_created_at is None or event.created_at < self.first_created_at:
+            self.first_created_at = event.created_at
+        if self.last_created_at is None or event.created_at > self.last_created_at:
+            self.last_created_at = event.created_at
+    
+    def due_at(self, window, max_delay):
+        """When this broadcast should go out"""
+        return min(
+            self.last_created_at + timedelta(seconds=window),
+            self.first_created_at + timedelta(seconds=max(max_delay, window)),
+        )
+
+
+def coalesce_events(events):
+    """Group outbox events by order, preserving version order"""
+    pending = {}
+    for event in sorted(events, key=lambda e: (e.order_id, e.version)):
+        pending.setdefault(event.order_id, PendingBroadcast()).merge(event)
+    return pending
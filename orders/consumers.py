@@ -1,17 +1,107 @@
-import json
+from abc import ABCMeta, abstractmethod
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from . import metrics, replay
+from .backpressure import Outbox
+from .access import aget_order_access, aget_orders_access
+from .board import BOARD_GROUP, get_board, row_visible_to
 from .models import CollectionOrder
-from .serializers import CollectionOrderSerializer
+from .projections import PARTICIPANT, VIEWER, audience_for, mentions_user, project_message, project_order
+from .snapshots import aget_order_snapshot
+from .websocket_utils import order_group_name, order_delta_group_name
+from .wire import decode_message, select_encoder
 
 User = get_user_model()
 
+# Orders one multiplexed connection may subscribe to
+MAX_SUBSCRIPTIONS = 200
 
-class OrderConsumer(AsyncWebsocketConsumer):
+
+def select_patches(version, patches):
+    """
+    Return the patches a client holding `version` still has to apply, or None if
+    they don't follow on from its version and it needs a snapshot instead.
+    """
+    if version is None:
+        return None
+    patches = [patch for patch in patches if patch['version'] > version]
+    versions = [patch['version'] for patch in patches]
+    if versions != list(range(version + 1, version + 1 + len(versions))):
+        return None
+    return patches
+
+
+def patch_frame(event, base_version, patches):
+    return {
+        'type': 'order_patch',
+        'base_version': base_version,
+        'version': patches[-1]['version'],
+        'patches': patches,
+        'totals': event['totals'],
+        **({'participants': event['participants']} if 'participants' in event else {}),
+    }
+
+
+def parse_order_ids(values):
+    """Order ids from a client message, ignoring anything that isn't an id"""
+    order_ids = []
+    for value in values if isinstance(values, list) else []:
+        try:
+            order_id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if order_id > 0 and order_id not in order_ids:
+            order_ids.append(order_id)
+    return order_ids
+
+
+class OrderFramesConsumer(AsyncWebsocketConsumer, metaclass=ABCMeta):
+    """
+    Base for order consumers: JSON frames by default, msgpack when negotiated
+    (see wire.py). Frames go out through a bounded outbox (see backpressure.py).
+    """
+    outbox = None
+    
+    async def accept_with_encoding(self):
+        self.encoder, subprotocol = select_encoder(self.scope)
+        await self.accept(subprotocol)
+        self.outbox = Outbox(self.write_frame, self.snapshot_frame, self.close, label=self.channel_name)
+    
+    async def websocket_disconnect(self, message):
+        if self.outbox is not None:
+            self.outbox.stop()
+        await super().websocket_disconnect(message)
+    
+    async def send_frame(self, frame, order_id=None, replaceable=False):
+        """Queue a frame; pass the order it belongs to for order frames"""
+        self.outbox.put(frame, order_id, replaceable)
+    
+    @abstractmethod
+    async def snapshot_frame(self, order_id):
+        """Build an order's snapshot frame when the outbox is ready to send it, or None to skip it"""
+    
+    async def write_frame(self, frame):
+        # Encoded at write time so msgpack interning follows what the client actually received
+        data = self.encoder.encode(frame)
+        if self.encoder.binary:
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
+
+class OrderConsumer(OrderFramesConsumer):
     async def connect(self):
         self.order_id = self.scope['url_route']['kwargs']['order_id']
-        self.room_group_name = f'order_{self.order_id}'
+        
+        # Clients opt into versioned delta patches with ?protocol=delta
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.use_deltas = query_params.get('protocol', [''])[0] == 'delta'
+        # Delta clients resuming after a reconnect pass the last version they applied
+        since = query_params.get('since', [None])[0]
+        self.version = None
+        self.room_group_name = None
         
         # Verify user is authenticated
         if not self.scope['user'].is_authenticated:
@@ -19,10 +109,13 @@ class OrderConsumer(AsyncWebsocketConsumer):
             return
         
         # Verify user has access to this order
-        has_access = await self.check_order_access(self.order_id, self.scope['user'])
-        if not has_access:
+        access = await self.check_order_access(self.order_id, self.scope['user'])
+        if access is None:
             await self.close()
             return
+        # Broadcasts come projected for the user's audience (see projections.py)
+        self.audience = audience_for(access)
+        self.room_group_name = self.group_name()
         
         # Join room group
         await self.channel_layer.group_add(
@@ -30,78 +123,349 @@ class OrderConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
+        await self.accept_with_encoding()
         
-        # Send current order state
-        order_data = await self.get_order_data(self.order_id)
-        if order_data:
-            await self.send(text_data=json.dumps({
-                'type': 'order_update',
-                'order': order_data
-            }))
+        # Replay what a resuming client missed, or send the current order state
+        if self.use_deltas and since is not None and await self.replay_since(since):
+            return
+        await self.send_snapshot()
     
     async def disconnect(self, close_code):
+        if self.room_group_name is None:
+            return  # Rejected before joining
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
     
+    def group_name(self):
+        if self.use_deltas:
+            return order_delta_group_name(self.order_id, self.audience)
+        return order_group_name(self.order_id, self.audience)
+    
+    async def change_audience(self, audience):
+        """Move to another audience's group; the next snapshot is projected for it"""
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        self.audience = audience
+        self.room_group_name = self.group_name()
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.send_snapshot()
+    
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = decode_message(text_data, bytes_data)
         message_type = text_data_json.get('type')
         
         if message_type == 'ping':
-            await self.send(text_data=json.dumps({'type': 'pong'}))
+            await self.send_frame({'type': 'pong'})
+        elif message_type == 'resync':
+            # Client detected a version gap on its side
+            await self.send_snapshot()
     
     # Receive message from room group
     async def order_update(self, event):
+        if self.outbox.awaiting_snapshot(self.order_id):
+            return  # The snapshot on its way is read when it is sent
+        if self.audience == VIEWER and mentions_user(event, self.scope['user'].id):
+            await self.change_audience(PARTICIPANT)  # Joined the order
+            return
+        self.version = event['order'].get('version')
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'order_update',
             'order': event['order']
-        }))
+        }, self.order_id, replaceable=True)
     
-    @database_sync_to_async
-    def check_order_access(self, order_id, user):
-        """Check if user has access to this order"""
+    async def order_access_changed(self, event):
+        """The collector, assignments or privacy changed: move to the user's audience, or close if they lost access"""
+        access = await self.check_order_access(self.order_id, self.scope['user'])
+        if access is None:
+            metrics.incr('order_access_revoked')
+            await self.close()
+            return
+        if audience_for(access) != self.audience:
+            await self.change_audience(audience_for(access))
+    
+    async def order_patch(self, event):
+        """Forward delta patches, falling back to a full snapshot on a version gap"""
+        if self.outbox.awaiting_snapshot(self.order_id):
+            return
+        if self.audience == VIEWER and mentions_user(event, self.scope['user'].id):
+            await self.change_audience(PARTICIPANT)
+            return
+        patches = select_patches(self.version, event['patches'])
+        if patches is None:
+            await self.send_snapshot()
+            return
+        if not patches:
+            return  # Already included in the snapshot this client holds
+        
+        base_version = self.version
+        self.version = patches[-1]['version']
+        await self.send_frame(patch_frame(event, base_version, patches), self.order_id)
+    
+    async def replay_since(self, since):
+        """Send the frames broadcast after `since`; returns False if a snapshot is needed"""
         try:
-            order = CollectionOrder.objects.get(id=order_id)
-            # Allow if:
-            # - User is manager
-            # - User is collector
-            # - Order is not private
-            # - User is assigned to the order
-            # - User has items in the order
-            if user.role == 'manager':
-                return True
-            if order.collector == user:
-                return True
-            if not order.is_private:
-                return True
-            if order.assigned_users.filter(id=user.id).exists():
-                return True
-            if order.items.filter(user=user).exists():
-                return True
+            since = int(since)
+        except ValueError:
             return False
-        except CollectionOrder.DoesNotExist:
+        messages = await replay.read_since(self.order_id, since)
+        if messages is None or any(message['type'] != 'order_patch' for message in messages):
+            metrics.incr('order_replay_snapshot')
             return False
+        
+        self.version = since
+        for message in messages:
+            await self.order_patch(project_message(message, self.audience))
+        metrics.incr('order_replay_resumed')
+        return True
     
-    @database_sync_to_async
-    def get_order_data(self, order_id):
+    async def send_snapshot(self):
+        self.outbox.request_snapshot(self.order_id)
+    
+    async def snapshot_frame(self, order_id):
+        order_data = await self.get_order_data(order_id)
+        if not order_data:
+            return None
+        self.version = order_data.get('version')
+        return {
+            'type': 'order_update',
+            'order': project_order(order_data, self.audience)
+        }
+    
+    async def check_order_access(self, order_id, user):
+        """Return the user's access to this order, or None if they can't view it"""
+        access = await aget_order_access(user, order_id)
+        return access if access is not None and access.can_view else None
+    
+    async def get_order_data(self, order_id):
         """Get serialized order data"""
         try:
-            from django.db.models import Prefetch
-            from .models import OrderItem, Payment
-            
-            order = CollectionOrder.objects.prefetch_related(
-                Prefetch('items', queryset=OrderItem.objects.select_related('user', 'menu_item').order_by('-created_at')),
-                Prefetch('payments', queryset=Payment.objects.select_related('user').order_by('-created_at')),
-                'assigned_users'
-            ).select_related('restaurant', 'menu', 'collector').get(id=order_id)
-            serializer = CollectionOrderSerializer(order)
-            return serializer.data
+            return await aget_order_snapshot(order_id)
+        except CollectionOrder.DoesNotExist:
+            return None
+
+
+class OrderStreamConsumer(OrderFramesConsumer):
+    """
+    One connection subscribed to many orders, using the delta protocol.
+    
+    Client messages:
+    - {"type": "subscribe", "order_ids": [1, 2], "since": {"1": 14}}
+    - {"type": "unsubscribe", "order_ids": [2]}
+    - {"type": "resync", "order_id": 1}
+    - {"type": "ping"}
+    
+    Every order frame carries the order_id it belongs to.
+    """
+    
+    async def connect(self):
+        # order_id -> version the client holds
+        self.versions = {}
+        # order_id -> audience whose group this connection is in
+        self.audiences = {}
+        
+        if not self.scope['user'].is_authenticated:
+            await self.close()
+            return
+        
+        await self.accept_with_encoding()
+    
+    async def disconnect(self, close_code):
+        for order_id, audience in list(self.audiences.items()):
+            await self.channel_layer.group_discard(order_delta_group_name(order_id, audience), self.channel_name)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        data = decode_message(text_data, bytes_data)
+        message_type = data.get('type')
+        
+        if message_type == 'ping':
+            await self.send_frame({'type': 'pong'})
+        elif message_type == 'subscribe':
+            since = data.get('since')
+            await self.subscribe(parse_order_ids(data.get('order_ids')), since if isinstance(since, dict) else {})
+        elif message_type == 'unsubscribe':
+            await self.unsubscribe(parse_order_ids(data.get('order_ids')))
+        elif message_type == 'resync':
+            order_id = parse_order_ids([data.get('order_id')])
+            if order_id and order_id[0] in self.versions:
+                await self.send_snapshot(order_id[0])
+    
+    async def subscribe(self, order_ids, since):
+        requested = [order_id for order_id in order_ids if order_id not in self.versions]
+        room = max(MAX_SUBSCRIPTIONS - len(self.versions), 0)
+        requested, over_limit = requested[:room], requested[room:]
+        
+        # One query for all requested orders
+        access = await aget_orders_access(self.scope['user'], requested)
+        allowed = [order_id for order_id in requested if order_id in access and access[order_id].can_view]
+        denied = [order_id for order_id in requested if order_id not in allowed] + over_limit
+        
+        for order_id in allowed:
+            self.audiences[order_id] = audience_for(access[order_id])
+            await self.channel_layer.group_add(order_delta_group_name(order_id, self.audiences[order_id]), self.channel_name)
+            self.versions[order_id] = None
+        await self.send_frame({
+            'type': 'subscribed',
+            'order_ids': allowed,
+            'denied': denied,
+        })
+        
+        for order_id in allowed:
+            client_version = since.get(str(order_id))
+            if client_version is None or not await self.replay_since(order_id, client_version):
+                await self.send_snapshot(order_id)
+    
+    async def unsubscribe(self, order_ids):
+        removed = [order_id for order_id in order_ids if order_id in self.versions]
+        for order_id in removed:
+            del self.versions[order_id]
+            audience = self.audiences.pop(order_id)
+            await self.channel_layer.group_discard(order_delta_group_name(order_id, audience), self.channel_name)
+        await self.send_frame({'type': 'unsubscribed', 'order_ids': removed})
+    
+    async def order_update(self, event):
+        order_id = event['order']['id']
+        if order_id not in self.versions:
+            return  # Unsubscribed while the message was in flight
+        if self.outbox.awaiting_snapshot(order_id):
+            return
+        if self.audiences[order_id] == VIEWER and mentions_user(event, self.scope['user'].id):
+            await self.change_audience(order_id, PARTICIPANT)
+            return
+        self.versions[order_id] = event['order'].get('version')
+        await self.send_frame({
+            'type': 'order_update',
+            'order_id': order_id,
+            'order': event['order'],
+        }, order_id, replaceable=True)
+    
+    async def order_access_changed(self, event):
+        """Re-check the user's access to one order: switch its audience, or unsubscribe if they lost access"""
+        order_id = event['order_id']
+        if order_id not in self.versions:
+            return
+        access = await aget_order_access(self.scope['user'], order_id)
+        if access is None or not access.can_view:
+            metrics.incr('order_access_revoked')
+            await self.unsubscribe([order_id])
+            return
+        if audience_for(access) != self.audiences[order_id]:
+            await self.change_audience(order_id, audience_for(access))
+    
+    async def order_patch(self, event):
+        order_id = event['order_id']
+        if order_id not in self.versions or self.outbox.awaiting_snapshot(order_id):
+            return
+        if self.audiences[order_id] == VIEWER and mentions_user(event, self.scope['user'].id):
+            await self.change_audience(order_id, PARTICIPANT)
+            return
+        
+        patches = select_patches(self.versions[order_id], event['patches'])
+        if patches is None:
+            await self.send_snapshot(order_id)
+            return
+        if not patches:
+            return
+        
+        base_version = self.versions[order_id]
+        self.versions[order_id] = patches[-1]['version']
+        await self.send_frame({
+            **patch_frame(event, base_version, patches),
+            'order_id': order_id,
+        }, order_id)
+    
+    async def replay_since(self, order_id, since):
+        """Send the frames of one order broadcast after `since`; returns False if a snapshot is needed"""
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            return False
+        messages = await replay.read_since(order_id, since)
+        if messages is None or any(message['type'] != 'order_patch' for message in messages):
+            metrics.incr('order_replay_snapshot')
+            return False
+        
+        self.versions[order_id] = since
+        for message in messages:
+            await self.order_patch(project_message(message, self.audiences[order_id]))
+        metrics.incr('order_replay_resumed')
+        return True
+    
+    async def send_snapshot(self, order_id):
+        self.outbox.request_snapshot(order_id)
+    
+    async def change_audience(self, order_id, audience):
+        """Move an order to another audience's group; its next snapshot is projected for it"""
+        await self.channel_layer.group_discard(order_delta_group_name(order_id, self.audiences[order_id]), self.channel_name)
+        self.audiences[order_id] = audience
+        await self.channel_layer.group_add(order_delta_group_name(order_id, audience), self.channel_name)
+        await self.send_snapshot(order_id)
+    
+    async def snapshot_frame(self, order_id):
+        if order_id not in self.versions:
+            return None  # Unsubscribed while the snapshot was queued
+        order_data = await self.get_order_data(order_id)
+        if order_data is None or order_id not in self.versions:
+            return None
+        self.versions[order_id] = order_data.get('version')
+        return {
+            'type': 'order_update',
+            'order_id': order_id,
+            'order': project_order(order_data, self.audiences[order_id]),
+        }
+    
+    async def get_order_data(self, order_id):
+        try:
+            return await aget_order_snapshot(order_id)
         except CollectionOrder.DoesNotExist:
             return None
 
+
+class OrderBoardConsumer(OrderFramesConsumer):
+    """Live summary rows of the active orders the user can see"""
+    
+    async def connect(self):
+        if not self.scope['user'].is_authenticated:
+            await self.close()
+            return
+        
+        await self.channel_layer.group_add(BOARD_GROUP, self.channel_name)
+        await self.accept_with_encoding()
+        await self.send_board()
+    
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(BOARD_GROUP, self.channel_name)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        message_type = decode_message(text_data, bytes_data).get('type')
+        
+        if message_type == 'ping':
+            await self.send_frame({'type': 'pong'})
+        elif message_type == 'resync':
+            await self.send_board()
+    
+    async def send_board(self):
+        rows = await database_sync_to_async(get_board)(self.scope['user'])
+        await self.send_frame({'type': 'board_snapshot', 'orders': rows})
+    
+    # A row and a removal both carry the order's whole board state, so either replaces an unsent one
+    async def board_update(self, event):
+        row = event['row']
+        if row['status'] == 'CLOSED' or not row_visible_to(self.scope['user'], event['visibility']):
+            # Clients drop rows they don't have
+            await self.board_remove({'order_id': row['id']})
+            return
+        await self.send_frame({'type': 'board_update', 'order': row}, row['id'], replaceable=True)
+    
+    async def board_remove(self, event):
+        frame = {'type': 'board_remove', 'order_id': event['order_id']}
+        await self.send_frame(frame, event['order_id'], replaceable=True)
+    
+    async def snapshot_frame(self, order_id):
+        rows = await database_sync_to_async(get_board)(self.scope['user'], [order_id])
+        if not rows:
+            return {'type': 'board_remove', 'order_id': order_id}
+        return {'type': 'board_update', 'order': rows[0]}
@@ -0,0 +1,77 @@
+"""
+orjson-backed JSON for the REST API and the WebSockets.
+
+`ORJSONRenderer` and `ORJSONParser` replace DRF's JSONRenderer and
+JSONParser (see REST_FRAMEWORK in settings). The renderer produces the same
+bytes as DRF's for the data this API returns: compact separators, UTF-8
+rather than \\u escapes, 'Z' for UTC datetimes, U+2028/U+2029 escaped, and
+anything orjson does not handle natively (Decimal, timedelta, lazy strings,
+querysets...) converted by DRF's own JSONEncoder. Pretty-printed responses
+(`; indent=N`, the browsable API) and non-default JSON settings fall back to
+DRF's renderer, and so does data orjson rejects (integers beyond 64 bits).
+
+Known differences from DRF, none of which occur in this API's data (money is
+rendered from Decimals as strings):
+- Floats in exponent form are written without a sign or zero padding in the
+  exponent: `1e16` and `1e-7` where DRF writes `1e+16` and `1e-07`. Both
+  parse to the same value.
+- NaN and infinities become `null`; DRF raises ValueError.
+
+`dumps` and `loads` are used for WebSocket frames, the replay buffer and
+cached snapshots.
+"""
+import json
+import orjson
+from django.conf import settings
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+_drf_default = JSONEncoder().default
+
+
+def dumps(data, default=_drf_default):
+    """Serialize to JSON bytes; types orjson lacks go through `default` (DRF's encoder)"""
+    try:
+        return orjson.dumps(data, default=default, option=_OPTIONS)
+    except orjson.JSONEncodeError as exc:
+        if 'Integer exceeds 64-bit range' not in str(exc):
+            raise
+    # Integers orjson cannot represent: encode like DRF's renderer instead
+    return json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'), allow_nan=False,
+    ).encode()
+
+
+def loads(data):
+    """Parse JSON from bytes or str. Errors are json.JSONDecodeError subclasses."""
+    return orjson.loads(data)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        # Same escaping as DRF: keeps the output a strict JavaScript subset
+        return dumps(data).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            # orjson rejects NaN and Infinity, like DRF's strict parsing
+            return loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
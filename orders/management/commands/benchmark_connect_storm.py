@@ -0,0 +1,100 @@
+import asyncio
+import statistics
+import time
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from orders.models import User, Restaurant, CollectionOrder, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many order WebSockets at once against the in-memory channel layer and report '
+        'connect latency (until the first frame). Creates its own users and order and deletes them afterwards.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=1000,
+            help='Simultaneous connects (default: 1000)',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100,
+            help='Distinct users among the connections (default: 100)',
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=2,
+            help='Storms to run; the first one starts with cold caches (default: 2)',
+        )
+    
+    def handle(self, *args, **options):
+        users, restaurant, order = self.create_data(options['users'])
+        try:
+            tokens = [str(AccessToken.for_user(user)) for user in users]
+            in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            with override_settings(CHANNEL_LAYERS=in_memory):
+                channel_layers.backends.clear()
+                for round_number in range(1, options['rounds'] + 1):
+                    latencies, failures, elapsed = asyncio.run(
+                        self.storm(order.id, tokens, options['connections'])
+                    )
+                    self.report(round_number, latencies, failures, elapsed)
+            channel_layers.backends.clear()
+        finally:
+            order.delete()
+            restaurant.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+    
+    async def storm(self, order_id, tokens, connections):
+        from BrightEat.asgi import application
+        
+        async def connect(index):
+            communicator = WebsocketCommunicator(
+                application,
+                f'/ws/orders/{order_id}/?protocol=delta&token={tokens[index % len(tokens)]}',
+                headers=[(b'origin', b'http://localhost')],
+            )
+            start = time.perf_counter()
+            try:
+                connected, _ = await communicator.connect(timeout=60)
+                if not connected:
+                    return None
+                await communicator.receive_from(timeout=60)
+                return (time.perf_counter() - start) * 1000
+            except Exception:
+                return None
+            finally:
+                await communicator.disconnect()
+        
+        start = time.perf_counter()
+        results = await asyncio.gather(*(connect(index) for index in range(connections)))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(result for result in results if result is not None)
+        return latencies, connections - len(latencies), elapsed
+    
+    def report(self, round_number, latencies, failures, elapsed):
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f'round {round_number}: every connect failed'))
+            return
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f'round {round_number}: {len(latencies)} connected, {failures} failed in {elapsed:.2f}s  '
+            f'p50 {statistics.median(latencies):.0f} ms  p99 {p99:.0f} ms  max {latencies[-1]:.0f} ms'
+        )
+    
+    def create_data(self, user_count):
+        users = [User.objects.create_user(f'bench_storm_{i}', password=None) for i in range(user_count)]
+        restaurant = Restaurant.objects.create(name='Benchmark')
+        order = CollectionOrder.objects.create(restaurant=restaurant, collector=users[0], is_private=True)
+        # Every user takes part, so the access check walks the whole policy
+        for user in users[1:]:
+            OrderItem.objects.create(order=order, user=user, custom_name=f'Item {user.id}', unit_price=10, quantity=1)
+        return users, restaurant, order
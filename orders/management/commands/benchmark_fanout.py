@@ -0,0 +1,189 @@
+import asyncio
+import json
+import statistics
+import time
+from collections import defaultdict
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from orders import metrics
+from orders.models import User, Restaurant, CollectionOrder, OrderItem
+from orders.outbox import relay
+from orders.websocket_utils import broadcast_order_patch, item_added_patch
+
+
+class Command(BaseCommand):
+    help = (
+        'Connect N delta WebSocket clients spread over M orders to the ASGI application, add items and '
+        'report broadcast latency (commit to client), frames per second and CPU per broadcast. '
+        'Creates its own users and orders and deletes them afterwards.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Client counts to run (default: 10 100 1000)',
+        )
+        parser.add_argument(
+            '--orders',
+            type=int,
+            default=10,
+            help='Orders the clients are spread over (default: 10)',
+        )
+        parser.add_argument(
+            '--adds',
+            type=int,
+            default=100,
+            help='Items added per run, round-robin over the orders (default: 100)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.01,
+            help='Seconds between item adds (default: 0.01)',
+        )
+        parser.add_argument(
+            '--window',
+            type=float,
+            default=0,
+            help='Broadcast coalescing window in seconds (default: 0, one broadcast per add)',
+        )
+        parser.add_argument(
+            '--layer',
+            choices=['memory', 'configured'],
+            default='memory',
+            help='In-memory channel layer, or the one in CHANNEL_LAYERS, e.g. local Redis (default: memory)',
+        )
+    
+    def handle(self, *args, **options):
+        users, restaurant, orders = self.create_data(min(max(options['clients']), 100), options['orders'])
+        try:
+            tokens = [str(AccessToken.for_user(user)) for user in users]
+            layers = (
+                {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+                if options['layer'] == 'memory' else None
+            )
+            with override_settings(**({'CHANNEL_LAYERS': layers} if layers else {})):
+                channel_layers.backends.clear()
+                self.stdout.write(
+                    f'{"clients":>8}{"frames":>9}{"frames/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+                    f'{"broadcasts":>12}{"cpu ms/bc":>11}'
+                )
+                for clients in options['clients']:
+                    result = asyncio.run(self.run(
+                        [order.id for order in orders], users, tokens, clients,
+                        options['adds'], options['interval'], options['window'],
+                    ))
+                    self.report(clients, *result)
+            channel_layers.backends.clear()
+        finally:
+            for order in orders:
+                order.delete()
+            restaurant.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+    
+    async def run(self, order_ids, users, tokens, clients, adds, interval, window):
+        from BrightEat.asgi import application
+        
+        relay.window = window
+        relay.start()
+        # (order_id, version) -> commit time, and arrival times at clients
+        committed = {}
+        arrivals = defaultdict(list)
+        frames = []
+        
+        async def connect(index):
+            order_id = order_ids[index % len(order_ids)]
+            communicator = WebsocketCommunicator(
+                application,
+                f'/ws/orders/{order_id}/?protocol=delta&token={tokens[index % len(tokens)]}',
+                headers=[(b'origin', b'http://localhost')],
+            )
+            connected, _ = await communicator.connect(timeout=60)
+            if not connected:
+                raise RuntimeError(f'Client {index} could not connect')
+            await communicator.receive_from(timeout=60)  # Initial snapshot
+            return order_id, communicator
+        
+        async def read(order_id, communicator):
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=3600))
+                now = time.perf_counter()
+                frames.append(now)
+                for patch in frame.get('patches', []):
+                    arrivals[(order_id, patch['version'])].append(now)
+        
+        connections = await asyncio.gather(*(connect(index) for index in range(clients)))
+        readers = [asyncio.ensure_future(read(order_id, communicator)) for order_id, communicator in connections]
+        clients_per_order = defaultdict(int)
+        for order_id, _ in connections:
+            clients_per_order[order_id] += 1
+        
+        broadcasts_before = metrics.get_counters().get('order_broadcast_sent', 0)
+        cpu_before = time.process_time()
+        start = time.perf_counter()
+        for n in range(adds):
+            order_id = order_ids[n % len(order_ids)]
+            version, committed_at = await database_sync_to_async(self.add_item)(order_id, users[n % len(users)], n)
+            committed[(order_id, version)] = committed_at
+            await asyncio.sleep(interval)
+        
+        # Wait for every client to get every add, or for delivery to stall
+        expected = sum(clients_per_order[order_id] for order_id, _ in committed)
+        last_count, stalled_since = -1, time.perf_counter()
+        while sum(len(arrivals[key]) for key in committed) < expected and time.perf_counter() - stalled_since < 5:
+            count = len(frames)
+            if count != last_count:
+                last_count, stalled_since = count, time.perf_counter()
+            await asyncio.sleep(0.05)
+        elapsed = (max(frames) if frames else time.perf_counter()) - start
+        cpu = time.process_time() - cpu_before
+        broadcasts = metrics.get_counters().get('order_broadcast_sent', 0) - broadcasts_before
+        
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(communicator.disconnect() for _, communicator in connections))
+        await relay.stop()
+        
+        latencies = sorted(
+            (arrived - committed_at) * 1000
+            for key, committed_at in committed.items()
+            for arrived in arrivals[key]
+        )
+        return latencies, expected, len(frames), elapsed, broadcasts, cpu
+    
+    def report(self, clients, latencies, expected, frame_count, elapsed, broadcasts, cpu):
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f'{clients:>8}  no patches delivered'))
+            return
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f'{clients:>8}{frame_count:>9}{frame_count / elapsed:>10.0f}{statistics.median(latencies):>9.1f}'
+            f'{p99:>9.1f}{latencies[-1]:>9.1f}{broadcasts:>12}{cpu * 1000 / max(broadcasts, 1):>11.2f}'
+        )
+        if len(latencies) < expected:
+            self.stdout.write(self.style.WARNING(f'{"":>8}{expected - len(latencies)} of {expected} patch deliveries missing'))
+    
+    def add_item(self, order_id, user, n):
+        with transaction.atomic():
+            order = CollectionOrder.objects.get(id=order_id)
+            item = OrderItem.objects.create(order=order, user=user, custom_name=f'Item {n}', unit_price=10, quantity=1)
+            broadcast_order_patch(order, item_added_patch(item), include_participants=True)
+        return order.version, time.perf_counter()
+    
+    def create_data(self, user_count, order_count):
+        users = [User.objects.create_user(f'bench_fanout_{i}', password=None) for i in range(user_count)]
+        restaurant = Restaurant.objects.create(name='Benchmark')
+        # Public orders, so every user may watch every order
+        orders = [
+            CollectionOrder.objects.create(restaurant=restaurant, collector=users[i % len(users)])
+            for i in range(order_count)
+        ]
+        return users, restaurant, orders
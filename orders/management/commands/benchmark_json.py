@@ -0,0 +1,107 @@
+import io
+import json
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from orders.fastjson import ORJSONParser, ORJSONRenderer
+from orders.models import User, Restaurant, Menu, MenuItem, CollectionOrder, OrderItem, Payment
+from orders.serializers import MenuItemSerializer, RestaurantSerializer, UserSerializer
+from orders.snapshots import serializer_snapshot
+from orders.wire import JSONFrameEncoder
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF's JSON renderer and parser with the orjson ones on order, menu and user payloads, "
+        'check that both render the same bytes, and time WebSocket frame encoding. '
+        'Runs on throwaway data that is rolled back.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=50,
+            help='Items in the sample order (default: 50)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=500,
+            help='Renders per measurement (default: 500)',
+        )
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            order, restaurant, users = self.create_data(options['items'])
+            payloads = {
+                'order': serializer_snapshot(order.id),
+                'menu items': MenuItemSerializer(MenuItem.objects.filter(menu__restaurant=restaurant), many=True).data,
+                'restaurant': RestaurantSerializer(restaurant).data,
+                'users': UserSerializer(users, many=True).data,
+            }
+            transaction.set_rollback(True)
+        
+        iterations = options['iterations']
+        drf_renderer, fast_renderer = JSONRenderer(), ORJSONRenderer()
+        drf_parser, fast_parser = JSONParser(), ORJSONParser()
+        self.stdout.write(f'{"payload":<14}{"bytes":>8}{"render drf":>12}{"orjson":>9}{"parse drf":>11}{"orjson":>9}   us')
+        for name, data in payloads.items():
+            rendered = drf_renderer.render(data)
+            if fast_renderer.render(data) != rendered:
+                raise CommandError(f'{name}: orjson output differs from DRF')
+            if fast_parser.parse(io.BytesIO(rendered)) != drf_parser.parse(io.BytesIO(rendered)):
+                raise CommandError(f'{name}: orjson parse differs from DRF')
+            self.stdout.write(
+                f'{name:<14}{len(rendered):>8}'
+                f'{self.time(lambda: drf_renderer.render(data), iterations):>12.1f}'
+                f'{self.time(lambda: fast_renderer.render(data), iterations):>9.1f}'
+                f'{self.time(lambda: drf_parser.parse(io.BytesIO(rendered)), iterations):>11.1f}'
+                f'{self.time(lambda: fast_parser.parse(io.BytesIO(rendered)), iterations):>9.1f}'
+            )
+        
+        frame = {'type': 'order_update', 'order': payloads['order']}
+        encoder = JSONFrameEncoder()
+        if json.loads(encoder.encode(frame)) != json.loads(json.dumps(frame)):
+            raise CommandError('WebSocket frame differs from json.dumps')
+        self.stdout.write(
+            f'{"ws frame":<14}{len(encoder.encode(frame).encode()):>8}'
+            f'{self.time(lambda: json.dumps(frame), iterations):>12.1f}'
+            f'{self.time(lambda: encoder.encode(frame), iterations):>9.1f}'
+            '   (json.dumps vs JSONFrameEncoder)'
+        )
+        self.stdout.write(self.style.SUCCESS('orjson output matches DRF'))
+    
+    def time(self, fn, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) * 1_000_000 / iterations
+    
+    def create_data(self, item_count):
+        users = [
+            User.objects.create_user(
+                f'bench_json_{i}', email=f'bench_json_{i}@example.com', password=None,
+                first_name='Mostafa', last_name='Ğüç', phone='01000000000',
+            )
+            for i in range(20)
+        ]
+        restaurant = Restaurant.objects.create(name='Benchmark', description='Koshary   and more')
+        menu = Menu.objects.create(restaurant=restaurant, name='Benchmark menu')
+        menu_items = [
+            MenuItem.objects.create(menu=menu, name=f'Menu item número {i}', description='With tahini', price=Decimal('25.50') + i)
+            for i in range(100)
+        ]
+        order = CollectionOrder.objects.create(restaurant=restaurant, menu=menu, collector=users[0], delivery_fee=30, tip=30)
+        for i in range(item_count):
+            menu_item = menu_items[i % len(menu_items)]
+            OrderItem.objects.create(
+                order=order, user=users[(i + i // len(menu_items)) % len(users)], menu_item=menu_item,
+                quantity=1 + i % 3, unit_price=menu_item.price,
+            )
+        for user in users[:10]:
+            Payment.objects.create(order=order, user=user, amount=Decimal('106.00'))
+        return order, restaurant, users
@@ -0,0 +1,82 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from orders.access import get_order_access
+from orders.models import User, Restaurant, CollectionOrder, OrderItem
+
+
+def legacy_check_order_access(order_id, user):
+    """The access check OrderConsumer ran before orders.access existed"""
+    try:
+        order = CollectionOrder.objects.get(id=order_id)
+        if user.role == 'manager':
+            return True
+        if order.collector == user:
+            return True
+        if not order.is_private:
+            return True
+        if order.assigned_users.filter(id=user.id).exists():
+            return True
+        if order.items.filter(user=user).exists():
+            return True
+        return False
+    except CollectionOrder.DoesNotExist:
+        return False
+
+
+def check_order_access(order_id, user):
+    access = get_order_access(user, order_id)
+    return access is not None and access.can_view
+
+
+class Command(BaseCommand):
+    help = 'Compare queries and time per WebSocket access check before and after the single-query access policy. Runs on throwaway data that is rolled back.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Access checks per scenario (default: 200)',
+        )
+    
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        
+        with transaction.atomic():
+            scenarios = self.create_scenarios()
+            self.stdout.write(f'{"scenario":<22}{"impl":<8}{"queries":>8}{"ms/check":>10}')
+            for name, order, user, expected in scenarios:
+                for label, check in (('before', legacy_check_order_access), ('after', check_order_access)):
+                    with CaptureQueriesContext(connection) as queries:
+                        allowed = check(order.id, user)
+                    if allowed != expected:
+                        self.stdout.write(self.style.ERROR(f'{name}: {label} returned {allowed}, expected {expected}'))
+                    
+                    start = time.perf_counter()
+                    for _ in range(iterations):
+                        check(order.id, user)
+                    elapsed = (time.perf_counter() - start) * 1000 / iterations
+                    self.stdout.write(f'{name:<22}{label:<8}{len(queries):>8}{elapsed:>10.3f}')
+            transaction.set_rollback(True)
+    
+    def create_scenarios(self):
+        collector = User.objects.create_user('bench_collector', password=None)
+        outsider = User.objects.create_user('bench_outsider', password=None)
+        assignee = User.objects.create_user('bench_assignee', password=None)
+        participant = User.objects.create_user('bench_participant', password=None)
+        restaurant = Restaurant.objects.create(name='Benchmark')
+        
+        public = CollectionOrder.objects.create(restaurant=restaurant, collector=collector)
+        private = CollectionOrder.objects.create(restaurant=restaurant, collector=collector, is_private=True)
+        private.assigned_users.add(assignee)
+        OrderItem.objects.create(order=private, user=participant, custom_name='Item', unit_price=10, quantity=1)
+        
+        return [
+            ('public', public, outsider, True),
+            ('collector', private, collector, True),
+            ('private assigned', private, assignee, True),
+            ('private participant', private, participant, True),
+            ('private outsider', private, outsider, False),
+        ]
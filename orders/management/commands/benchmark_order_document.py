@@ -0,0 +1,119 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from orders.models import User, Restaurant, Menu, MenuItem, CollectionOrder, OrderItem, Payment
+from orders.snapshots import serializer_snapshot
+from orders.sql_snapshots import order_document
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that the Postgres order document matches CollectionOrderSerializer on a sample order, '
+        'then compare queries and time per snapshot. Runs on throwaway data that is rolled back.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=50,
+            help='Items in the sample order (default: 50)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Snapshots per measurement (default: 200)',
+        )
+    
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The order document is built by Postgres; run this against a Postgres database.')
+        
+        with transaction.atomic():
+            order = self.create_order(options['items'])
+            expected = serializer_snapshot(order.id)
+            actual = json.loads(order_document(order.id))
+            mismatched = self.compare(expected, actual)
+            
+            self.stdout.write(f'{"snapshot":<32}{"queries":>8}{"bytes":>8}{"ms":>9}')
+            iterations = options['iterations']
+            self.report(
+                'serializer (dict)', lambda: serializer_snapshot(order.id), iterations,
+            )
+            self.report(
+                'serializer (bytes)',
+                lambda: json.dumps(serializer_snapshot(order.id), cls=DjangoJSONEncoder).encode(), iterations,
+            )
+            self.report('postgres (bytes)', lambda: order_document(order.id), iterations)
+            self.report('postgres (dict)', lambda: json.loads(order_document(order.id)), iterations)
+            transaction.set_rollback(True)
+        
+        if mismatched:
+            for key in mismatched:
+                self.stdout.write(self.style.ERROR(
+                    f'{key}: serializer {expected.get(key)!r} != postgres {actual.get(key)!r}'
+                ))
+            raise CommandError(f'Order document differs from the serializer in {len(mismatched)} fields')
+        self.stdout.write(self.style.SUCCESS('Order document matches the serializer'))
+    
+    def compare(self, expected, actual):
+        """Keys whose values differ. Participants and assigned users are compared in id order."""
+        for data in (expected, actual):
+            data['assigned_users'] = sorted(data['assigned_users'])
+            for key in ('participants', 'assigned_users_details'):
+                data[key] = sorted(data[key], key=lambda user: user['id'])
+        return [key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key)]
+    
+    def report(self, name, build, iterations):
+        with CaptureQueriesContext(connection) as queries:
+            data = build()
+        size = len(data) if isinstance(data, bytes) else len(json.dumps(data).encode())
+        start = time.perf_counter()
+        for _ in range(iterations):
+            build()
+        elapsed = (time.perf_counter() - start) * 1000 / iterations
+        self.stdout.write(f'{name:<32}{len(queries):>8}{size:>8}{elapsed:>9.2f}')
+    
+    def create_order(self, item_count):
+        users = [
+            User.objects.create_user(f'bench_document_{i}', email=f'bench_document_{i}@example.com', password=None)
+            for i in range(10)
+        ]
+        users[0].instapay_link = 'https://ipn.eg/S/bench'
+        users[0].instapay_qr_code = 'qr_codes/bench.png'
+        users[0].save()
+        restaurant = Restaurant.objects.create(name='Benchmark')
+        menu = Menu.objects.create(restaurant=restaurant, name='Benchmark menu')
+        menu_items = [
+            MenuItem.objects.create(menu=menu, name=f'Menu item number {i}', price=Decimal('25.50') + i)
+            for i in range(20)
+        ]
+        now = timezone.now()
+        order = CollectionOrder.objects.create(
+            restaurant=restaurant, menu=menu, collector=users[0], delivery_fee=30, tip=Decimal('12.50'),
+            cutoff_time=now.replace(microsecond=0) + timedelta(hours=1), locked_at=now, is_private=True,
+        )
+        order.assigned_users.set(users[:3])
+        for i in range(item_count):
+            menu_item = menu_items[i % len(menu_items)]
+            # Every fifth item is a custom one; users shift each round so items stay unique
+            OrderItem.objects.create(
+                order=order, user=users[(i + i // len(menu_items)) % len(users)],
+                menu_item=None if i % 5 == 4 else menu_item,
+                custom_name=f'Custom item {i}' if i % 5 == 4 else '',
+                custom_price=Decimal('17.25') if i % 5 == 4 else None,
+                quantity=1 + i % 3, unit_price=menu_item.price, note='No onions' if i % 7 == 0 else '',
+            )
+        for i, user in enumerate(users):
+            Payment.objects.create(
+                order=order, user=user, amount=Decimal('106.35'),
+                is_paid=i % 2 == 0, paid_at=now if i % 2 == 0 else None,
+            )
+        return order
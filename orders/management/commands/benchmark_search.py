@@ -0,0 +1,96 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from orders.search import SearchIndex
+
+# Words menu item names are made of, English and Arabic
+WORDS = [
+    'chicken', 'beef', 'burger', 'cheese', 'pizza', 'margherita', 'pepperoni', 'shawarma', 'falafel', 'koshary',
+    'fries', 'salad', 'caesar', 'greek', 'rice', 'pasta', 'alfredo', 'spicy', 'grilled', 'crispy', 'double',
+    'mushroom', 'kofta', 'liver', 'sausage', 'hawawshi', 'feteer', 'molokhia', 'tahini', 'hummus', 'soup',
+    'juice', 'mango', 'orange', 'lemon', 'mint', 'coffee', 'latte', 'mocha', 'cake', 'chocolate', 'waffle',
+    'فراخ', 'لحمة', 'برجر', 'جبنة', 'بيتزا', 'شاورما', 'طعمية', 'كشري', 'بطاطس', 'سلطة', 'أرز', 'مكرونة',
+    'حار', 'مشوي', 'كبدة', 'سجق', 'حواوشي', 'فطير', 'ملوخية', 'طحينة', 'حمص', 'شوربة', 'عصير', 'مانجو',
+    'ليمون', 'نعناع', 'قهوة', 'كيكة', 'شوكولاتة', 'وافل',
+]
+
+
+def typo(word, rng):
+    """The word with one character dropped, doubled or swapped"""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return rng.choice([
+        word[:i] + word[i + 1:],
+        word[:i] + word[i] + word[i:],
+        word[:i - 1] + word[i] + word[i - 1] + word[i + 1:],
+    ])
+
+
+class Command(BaseCommand):
+    help = (
+        'Time menu item searches (prefix, multi-word and typo queries) against an in-memory index '
+        'of generated items, globally and per restaurant. No database access.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=50000,
+            help='Generated menu items (default: 50000)',
+        )
+        parser.add_argument(
+            '--restaurants',
+            type=int,
+            default=500,
+            help='Restaurants the items are spread over (default: 500)',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=2000,
+            help='Queries per kind (default: 2000)',
+        )
+    
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        restaurants = options['restaurants']
+        menus = [{'id': menu_id, 'restaurant': menu_id % restaurants + 1} for menu_id in range(1, restaurants * 2 + 1)]
+        items = [
+            {
+                'id': item_id, 'menu': rng.choice(menus)['id'],
+                'name': ' '.join(rng.sample(WORDS, rng.randint(1, 4))).title(),
+                'description': '', 'price': '50.00', 'section_name': '', 'catalog_version': 1,
+            }
+            for item_id in range(1, options['items'] + 1)
+        ]
+        
+        index = SearchIndex()
+        start = time.perf_counter()
+        index.apply({
+            'catalog_version': 1, 'menus': menus, 'items': items,
+            'removed': {'restaurants': [], 'menus': [], 'items': []},
+        })
+        self.stdout.write(f'Indexed {len(items)} items in {(time.perf_counter() - start) * 1000:.0f} ms')
+        
+        count = options['queries']
+        kinds = {
+            'prefix': [rng.choice(WORDS)[:rng.randint(2, 4)] for _ in range(count)],
+            'two words': [' '.join(word[:rng.randint(3, 6)] for word in rng.sample(WORDS, 2)) for _ in range(count)],
+            'typo': [typo(rng.choice(WORDS), rng) for _ in range(count)],
+        }
+        self.stdout.write(f'{"queries":<24}{"results":>8}{"p50 ms":>9}{"p99 ms":>9}')
+        for kind, queries in kinds.items():
+            for scope in ('all', 'restaurant'):
+                timings, found = [], 0
+                for query in queries:
+                    restaurant_id = rng.randint(1, restaurants) if scope == 'restaurant' else None
+                    start = time.perf_counter()
+                    found += len(index.search(query, restaurant_id))
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{kind + " / " + scope:<24}{found / len(queries):>8.1f}'
+                    f'{timings[len(timings) // 2]:>9.2f}{timings[int(len(timings) * 0.99)]:>9.2f}'
+                )
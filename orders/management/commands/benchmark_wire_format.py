@@ -0,0 +1,86 @@
+import time
+import zlib
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from orders.models import User, Restaurant, Menu, MenuItem, CollectionOrder, OrderItem, Payment
+from orders.snapshots import serialize_order
+from orders.websocket_utils import item_added_patch
+from orders.wire import JSONFrameEncoder, MsgpackFrameEncoder
+
+
+class Command(BaseCommand):
+    help = 'Measure WebSocket frame size and encode time for JSON and msgpack on a sample order. Runs on throwaway data that is rolled back.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=50,
+            help='Items in the sample order (default: 50)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=500,
+            help='Encodes per measurement (default: 500)',
+        )
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            order, item = self.create_order(options['items'])
+            snapshot_frame = {'type': 'order_update', 'order': serialize_order(order.id)}
+            patch_frame = {
+                'type': 'order_patch',
+                'base_version': 1,
+                'version': 2,
+                'patches': [{**item_added_patch(item), 'version': 2}],
+                'totals': {'total_items_cost': 1000.0, 'total_cost': 1060.0},
+            }
+            transaction.set_rollback(True)
+        
+        self.stdout.write(f'{"frame":<28}{"bytes":>8}{"deflated":>10}{"us/encode":>11}')
+        iterations = options['iterations']
+        
+        json_encoder = JSONFrameEncoder()
+        self.report('snapshot json', lambda: json_encoder.encode(snapshot_frame), iterations)
+        # First frame on a connection carries the interned tables
+        self.report('snapshot msgpack (first)', lambda: MsgpackFrameEncoder().encode(snapshot_frame), iterations)
+        warm_encoder = MsgpackFrameEncoder()
+        warm_encoder.encode(snapshot_frame)
+        self.report('snapshot msgpack (repeat)', lambda: warm_encoder.encode(snapshot_frame), iterations)
+        self.report('patch json', lambda: json_encoder.encode(patch_frame), iterations)
+        self.report('patch msgpack', lambda: warm_encoder.encode(patch_frame), iterations)
+    
+    def report(self, name, encode, iterations):
+        data = encode()
+        raw = data.encode() if isinstance(data, str) else data
+        start = time.perf_counter()
+        for _ in range(iterations):
+            encode()
+        elapsed = (time.perf_counter() - start) * 1_000_000 / iterations
+        self.stdout.write(f'{name:<28}{len(raw):>8}{len(zlib.compress(raw)):>10}{elapsed:>11.1f}')
+    
+    def create_order(self, item_count):
+        users = [
+            User.objects.create_user(f'bench_wire_{i}', email=f'bench_wire_{i}@example.com', password=None)
+            for i in range(10)
+        ]
+        restaurant = Restaurant.objects.create(name='Benchmark')
+        menu = Menu.objects.create(restaurant=restaurant, name='Benchmark menu')
+        menu_items = [
+            MenuItem.objects.create(menu=menu, name=f'Menu item number {i}', price=Decimal('25.50') + i)
+            for i in range(20)
+        ]
+        order = CollectionOrder.objects.create(restaurant=restaurant, menu=menu, collector=users[0], delivery_fee=30, tip=30)
+        item = None
+        for i in range(item_count):
+            menu_item = menu_items[i % len(menu_items)]
+            # Shift users each round through the menu so (user, menu item) stays unique
+            item = OrderItem.objects.create(
+                order=order, user=users[(i + i // len(menu_items)) % len(users)], menu_item=menu_item,
+                quantity=1 + i % 3, unit_price=menu_item.price,
+            )
+        for user in users:
+            Payment.objects.create(order=order, user=user, amount=Decimal('106.00'))
+        return order, item
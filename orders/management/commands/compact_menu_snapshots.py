@@ -0,0 +1,27 @@
+"""
+Django management command to delete menu snapshots no order needs.
+
+Orders pin an immutable MenuSnapshot of their menu (see
+orders/menu_snapshots.py). Every menu change made between two orders leaves
+one behind; this command deletes those that no order pins once they are
+older than the retention period, keeping each menu's newest snapshot.
+Scheduled through Celery Beat as the `compact_menu_snapshots` task.
+"""
+from django.core.management.base import BaseCommand
+from orders.menu_snapshots import compact
+
+
+class Command(BaseCommand):
+    help = 'Delete old menu snapshots that no order pins'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Keep unpinned snapshots younger than N days (default: MENU_SNAPSHOT_RETENTION_DAYS)',
+        )
+    
+    def handle(self, *args, **options):
+        deleted = compact(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Compacted menu snapshots: {deleted} deleted'))
@@ -0,0 +1,18 @@
+"""
+Django management command to pin menu snapshots on orders that have none.
+
+Orders created before menu snapshots existed (see orders/menu_snapshots.py)
+reference their menu but no MenuSnapshot. This command pins the menu's
+current version on each of them and bumps their version so cached order
+snapshots are refreshed. Run it once after deploying; it is safe to re-run.
+"""
+from django.core.management.base import BaseCommand
+from orders.menu_snapshots import pin_unpinned_orders
+
+
+class Command(BaseCommand):
+    help = 'Pin the current menu version on orders without a menu snapshot'
+    
+    def handle(self, *args, **options):
+        pinned = pin_unpinned_orders()
+        self.stdout.write(self.style.SUCCESS(f'Pinned menu snapshots: {pinned} orders'))
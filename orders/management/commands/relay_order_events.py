@@ -0,0 +1,21 @@
+"""
+Django management command to publish committed order events to WebSocket clients.
+
+Only needed when the relay is not running inside the ASGI server
+(ORDER_EVENT_RELAY_IN_PROCESS=False), e.g. when serving the API over WSGI.
+"""
+import asyncio
+from django.core.management.base import BaseCommand
+
+from orders.outbox import relay
+
+
+class Command(BaseCommand):
+    help = 'Relay order events from the outbox table to the channel layer'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Relaying order events (Ctrl+C to stop)...'))
+        try:
+            asyncio.run(relay.serve())
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
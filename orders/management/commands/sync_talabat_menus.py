@@ -16,7 +16,9 @@ from django.utils import timezone
 from django.db import transaction
 from django.conf import settings
 
-from orders.models import Restaurant, Menu, MenuItem
+from orders.models import Restaurant, Menu, MenuItem, next_catalog_version, orders_with_menu_items
+from orders.utils import normalize_item_name
+from orders.websocket_utils import broadcast_related_change
 
 # Import scraper functions
 # Add scripts directory to path using Django's BASE_DIR
@@ -264,6 +266,9 @@ class Command(BaseCommand):
         self.stdout.write(f'  Menu changed or new (hash: {menu_hash[:16]}...)')
         
         with transaction.atomic():
+            # Bulk writes below bypass MenuItem.save(), so they are stamped with one catalog version
+            catalog_version = next_catalog_version()
+            
             # Get existing items by hash
             existing_hashes = set(
                 MenuItem.objects.filter(menu=menu, item_hash__isnull=False)
@@ -272,6 +277,7 @@ class Command(BaseCommand):
             
             new_items = []
             updated_items = []
+            renamed_item_ids = []
             current_hashes = set()
             
             for talabat_item in items:
@@ -296,15 +302,23 @@ class Command(BaseCommand):
                 ).first()
                 
                 if existing_item:
-                    # Update existing item
+                    # Update existing item, if anything changed; saved in bulk below
+                    if all(getattr(existing_item, key) == value for key, value in item_data.items()):
+                        continue
+                    if existing_item.name != talabat_item.name:
+                        renamed_item_ids.append(existing_item.id)
                     for key, value in item_data.items():
                         if key != 'menu':  # Don't update the menu FK
                             setattr(existing_item, key, value)
-                    existing_item.save()
+                    existing_item.normalized_name = normalize_item_name(talabat_item.name)
+                    existing_item.catalog_version = catalog_version
                     updated_items.append(existing_item)
                 else:
                     # Create new item
-                    new_item = MenuItem(menu=menu, **item_data)
+                    new_item = MenuItem(
+                        menu=menu, catalog_version=catalog_version,
+                        normalized_name=normalize_item_name(talabat_item.name), **item_data
+                    )
                     new_items.append(new_item)
             
             # Bulk create new items
@@ -312,17 +326,28 @@ class Command(BaseCommand):
                 MenuItem.objects.bulk_create(new_items)
                 self.stdout.write(self.style.SUCCESS(f'  Created {len(new_items)} new items'))
             
-            # Report updated items
+            # Bulk update changed items with the sync's catalog version, instead of
+            # allocating one (and touching the menu) per item
             if updated_items:
+                MenuItem.objects.bulk_update(
+                    updated_items,
+                    ['name', 'description', 'price', 'is_available', 'talabat_id', 'item_hash',
+                     'section_name', 'normalized_name', 'catalog_version'],
+                    batch_size=500,
+                )
                 self.stdout.write(f'  Updated {len(updated_items)} existing items')
             
+            # Orders showing renamed items refresh their snapshots
+            if renamed_item_ids:
+                broadcast_related_change(orders_with_menu_items(renamed_item_ids))
+            
             # Mark items as unavailable if they're no longer in the menu
             removed_hashes = existing_hashes - current_hashes
             if removed_hashes:
                 removed_count = MenuItem.objects.filter(
                     menu=menu,
                     item_hash__in=removed_hashes
-                ).update(is_available=False)
+                ).update(is_available=False, catalog_version=catalog_version)
                 self.stdout.write(f'  Marked {removed_count} items as unavailable')
             
             # Update menu metadata
@@ -0,0 +1,54 @@
+"""
+Django management command to reconcile the running totals on orders.
+
+OrderItem.save()/delete() keep CollectionOrder.items_total, item_count and
+participant_count up to date with F() updates. Bulk deletes, cascades and
+races between two users' first items can leave them off; this command finds
+orders whose stored totals differ from their items and recounts them.
+Scheduled through Celery Beat as the `verify_order_totals` task.
+"""
+import logging
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from orders.models import CollectionOrder
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Find orders whose running totals differ from their items and recount them'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Only check orders created in the last N days (default: all orders)',
+        )
+    
+    def handle(self, *args, **options):
+        orders = CollectionOrder.objects.all()
+        if options['days'] is not None:
+            orders = orders.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        
+        # One aggregating query finds candidates; each is recounted under the order's row lock
+        mismatched = orders.annotate(
+            actual_total=Coalesce(Sum('items__total_price'), Value(0), output_field=DecimalField()),
+            actual_count=Count('items'),
+            actual_participants=Count('items__user', distinct=True),
+        ).filter(
+            ~Q(items_total=F('actual_total'))
+            | ~Q(item_count=F('actual_count'))
+            | ~Q(participant_count=F('actual_participants'))
+        ).order_by()
+        
+        corrected = 0
+        for order in mismatched:
+            if order.recount_totals():
+                corrected += 1
+                logger.warning('Corrected running totals of order %s', order.id)
+        
+        self.stdout.write(self.style.SUCCESS(f'Checked order totals: {corrected} corrected'))
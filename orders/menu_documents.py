@@ -0,0 +1,189 @@
+"""
+Compiled menu documents.
+
+A menu and its items, grouped by section, are rendered once per document
+version - (menu_hash, edit_version) - and cached as JSON bytes together with
+gzip and brotli variants. Talabat syncs change menu_hash and every save of
+the menu or one of its items bumps edit_version (see models.touch_menu), so
+a cached document is never stale and old versions simply expire.
+
+Each menu's current version is published in the shared cache under
+`menu_document_version:{menu_id}` when the change commits. The ETag is
+derived from that version alone, so `If-None-Match` is answered with a 304
+from one cache read, before any database access. Only when the version is
+unknown is the menu row read; when its document is missing it is compiled.
+Published versions expire after MENU_VERSION_CACHE_TIMEOUT, so one whose
+publish failed or was overtaken by an older one is corrected from the
+database within that time.
+"""
+import gzip
+import logging
+from itertools import groupby
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import serializers
+from . import fastjson, metrics
+from .models import MenuItem
+from .serializers import MenuItemSerializer
+
+logger = logging.getLogger(__name__)
+
+# Bump when the document layout changes so clients holding old ETags refetch
+FORMAT = 1
+
+# Preferred content codings, best first
+ENCODINGS = ('br', 'gzip')
+
+
+def version_key(menu_id):
+    return f'menu_document_version:{menu_id}'
+
+
+def document_key(menu_id, version):
+    menu_hash, edit_version = version
+    return f'menu_document:{menu_id}:{menu_hash}:{edit_version}'
+
+
+def etag(menu_id, version, encoding=None):
+    """Strong ETag of a document version in one content coding"""
+    menu_hash, edit_version = version
+    tag = f'{menu_id}-{edit_version}-{(menu_hash or "local")[:16]}-{FORMAT}'
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def publish_version(menu_id, version):
+    """Make a committed change's document version the current one"""
+    try:
+        cache.set(version_key(menu_id), version, settings.MENU_VERSION_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+
+
+def forget_menu(menu_id):
+    """Drop a deleted menu's current version"""
+    try:
+        cache.delete(version_key(menu_id))
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+
+
+def cached_version(menu_id):
+    """The menu's published document version, or None. Never touches the database."""
+    try:
+        return cache.get(version_key(menu_id))
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+        return None
+
+
+def remember_version(menu_id, version):
+    """Publish a version read from the database, unless a change published a newer one"""
+    try:
+        # add(), not set(): never overwrite a version published by a concurrent change
+        cache.add(version_key(menu_id), version, settings.MENU_VERSION_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+
+
+def compile_document(menu):
+    """Render a menu's document and its compressed variants: {coding or 'identity': bytes}"""
+    items = list(MenuItem.objects.filter(menu=menu).select_related('menu').order_by('section_name', 'name'))
+    rows = MenuItemSerializer(items, many=True).data
+    sections = [
+        {'name': section, 'items': [row for _, row in group]}
+        for section, group in groupby(zip((item.section_name for item in items), rows), key=lambda pair: pair[0])
+    ]
+    body = fastjson.dumps({
+        'id': menu.id,
+        'restaurant': menu.restaurant_id,
+        'name': menu.name,
+        'is_active': menu.is_active,
+        'menu_hash': menu.menu_hash,
+        'edit_version': menu.edit_version,
+        'last_synced_at': serializers.DateTimeField().to_representation(menu.last_synced_at) if menu.last_synced_at else None,
+        'sections': sections,
+    })
+    return encode_variants(body)
+
+
+def encode_variants(body):
+    """JSON bytes with their gzip and brotli variants, compressed once to serve many times"""
+    return {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        'br': brotli.compress(body, quality=11),
+    }
+
+
+def cached_document(menu_id, version):
+    """The compiled document of a version if it is cached, else None"""
+    try:
+        document = cache.get(document_key(menu_id, version))
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+        return None
+    if document is not None:
+        metrics.incr('menu_document_cache_hit')
+    return document
+
+
+def get_document(menu):
+    """The compiled document of the menu's current version, from cache or compiled now"""
+    version = (menu.menu_hash, menu.edit_version)
+    document = cached_document(menu.id, version)
+    if document is not None:
+        return document
+    
+    metrics.incr('menu_document_compiled')
+    document = compile_document(menu)
+    try:
+        cache.set(document_key(menu.id, version), document, settings.MENU_DOCUMENT_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Menu document cache unavailable', exc_info=True)
+    return document
+
+
+def accepted_encoding(request):
+    """The best of ENCODINGS the client accepts, or None for identity"""
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    return next((coding for coding in ENCODINGS if coding in accepted), None)
+
+
+def _set_headers(response, menu_id, version, encoding):
+    response['ETag'] = etag(menu_id, version, encoding)
+    response['Vary'] = 'Accept-Encoding'
+    # Clients keep the document and revalidate it on every use
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def if_none_match(request, current):
+    """Whether the request's If-None-Match names one of the `current` ETags"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match uses weak comparison
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return '*' in tags or bool(tags & set(current))
+
+
+def not_modified(request, menu_id, version):
+    """A 304 when If-None-Match names this version (in any coding), else None"""
+    if not if_none_match(request, [etag(menu_id, version, coding) for coding in (None, *ENCODINGS)]):
+        return None
+    metrics.incr('menu_document_not_modified')
+    return _set_headers(HttpResponseNotModified(), menu_id, version, accepted_encoding(request))
+
+
+def document_response(request, menu_id, version, document):
+    encoding = accepted_encoding(request)
+    response = HttpResponse(document[encoding or 'identity'], content_type='application/json')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _set_headers(response, menu_id, version, encoding)
@@ -0,0 +1,147 @@
+"""
+Immutable menu snapshots pinned by orders.
+
+When an order is created with a menu (or moved to another one) it pins a
+MenuSnapshot: the compiled menu document (see menu_documents) of the menu's
+version at that moment - (menu_hash, edit_version) - stored brotli-compressed.
+Snapshots are append-only, one per menu version, so a Talabat sync rewriting
+items or flipping `is_available` never changes the menu an open order was
+created against, and deleting the menu leaves its snapshots in place.
+
+`GET /api/orders/{id}/menu/` serves the pinned snapshot. A snapshot never
+changes, so its compressed variants are cached under its id alone and
+revalidated with a strong ETag: reading an order's menu is one cache lookup.
+
+Snapshots no order references are removed by the `compact_menu_snapshots`
+command once older than MENU_SNAPSHOT_RETENTION_DAYS, keeping each menu's
+newest one so the next order on an unchanged menu reuses it. Orders created
+before snapshots existed are pinned by the `pin_menu_snapshots` command.
+"""
+import gzip
+import logging
+from datetime import timedelta
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from . import metrics
+from .menu_documents import ENCODINGS, accepted_encoding, get_document, if_none_match
+from .models import CollectionOrder, Menu, MenuSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_key(snapshot_id):
+    return f'menu_snapshot:{snapshot_id}'
+
+
+def etag(snapshot_id, encoding=None):
+    return f'"menu-snapshot-{snapshot_id}-{encoding}"' if encoding else f'"menu-snapshot-{snapshot_id}"'
+
+
+def take_snapshot(menu_id):
+    """Id of the snapshot of the menu's current version, stored now if it is new. None for a missing menu."""
+    menu = Menu.objects.filter(id=menu_id).first()
+    if menu is None:
+        return None
+    existing = MenuSnapshot.objects.filter(menu_id=menu_id, edit_version=menu.edit_version).values_list('id', flat=True).first()
+    if existing is not None:
+        return existing
+    
+    # The menu's compiled document is usually cached already; its brotli variant is the stored form
+    document = get_document(menu)
+    try:
+        with transaction.atomic():
+            snapshot = MenuSnapshot.objects.create(
+                menu=menu, menu_hash=menu.menu_hash, edit_version=menu.edit_version, document=document['br'],
+            )
+    except IntegrityError:
+        # A concurrent order stored this version first
+        return MenuSnapshot.objects.filter(menu_id=menu_id, edit_version=menu.edit_version).values_list('id', flat=True).get()
+    metrics.incr('menu_snapshot_created')
+    return snapshot.id
+
+
+def pin_unpinned_orders():
+    """
+    Pin the current version of their menu on orders that have a menu but no
+    snapshot (orders created before snapshots). Their version is bumped so
+    cached order snapshots and connected clients pick up the pinned snapshot.
+    Returns the number of orders pinned.
+    """
+    from .websocket_utils import broadcast_related_change
+    unpinned = CollectionOrder.objects.filter(menu__isnull=False, menu_snapshot__isnull=True)
+    pinned = 0
+    for menu_id in unpinned.order_by().values_list('menu_id', flat=True).distinct():
+        snapshot_id = take_snapshot(menu_id)
+        with transaction.atomic():
+            order_ids = list(unpinned.filter(menu_id=menu_id).select_for_update().values_list('id', flat=True))
+            CollectionOrder.objects.filter(id__in=order_ids).update(menu_snapshot_id=snapshot_id)
+            broadcast_related_change(CollectionOrder.objects.filter(id__in=order_ids))
+        pinned += len(order_ids)
+    return pinned
+
+
+def get_variants(snapshot_id):
+    """The snapshot's document and its compressed variants: {coding or 'identity': bytes}, or None if it is gone"""
+    try:
+        variants = cache.get(snapshot_key(snapshot_id))
+    except Exception:
+        logger.warning('Menu snapshot cache unavailable', exc_info=True)
+        variants = None
+    if variants is not None:
+        metrics.incr('menu_snapshot_cache_hit')
+        return variants
+    
+    stored = MenuSnapshot.objects.filter(id=snapshot_id).values_list('document', flat=True).first()
+    if stored is None:
+        return None
+    body = brotli.decompress(bytes(stored))
+    variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0), 'br': bytes(stored)}
+    try:
+        cache.set(snapshot_key(snapshot_id), variants, settings.MENU_SNAPSHOT_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Menu snapshot cache unavailable', exc_info=True)
+    return variants
+
+
+def snapshot_response(request, snapshot_id):
+    """The snapshot in the best coding the client accepts, or a 304 when If-None-Match names it"""
+    encoding = accepted_encoding(request)
+    if if_none_match(request, [etag(snapshot_id, coding) for coding in (None, *ENCODINGS)]):
+        response = HttpResponseNotModified()
+    else:
+        variants = get_variants(snapshot_id)
+        if variants is None:
+            return None
+        response = HttpResponse(variants[encoding or 'identity'], content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag(snapshot_id, encoding)
+    response['Vary'] = 'Accept-Encoding'
+    # The order may be moved to another menu, so clients still revalidate
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def compact(days=None):
+    """
+    Delete snapshots no order pins that are older than `days` (default
+    MENU_SNAPSHOT_RETENTION_DAYS), except each menu's newest. Returns the number deleted.
+    """
+    days = settings.MENU_SNAPSHOT_RETENTION_DAYS if days is None else days
+    newest = MenuSnapshot.objects.filter(menu__isnull=False).order_by().values('menu_id').annotate(newest=Max('id')).values('newest')
+    pinned = Exists(CollectionOrder.objects.filter(menu_snapshot=OuterRef('pk')))
+    stale = list(MenuSnapshot.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=days),
+    ).exclude(pinned).exclude(id__in=newest).values_list('id', flat=True))
+    
+    deleted = 0
+    for start in range(0, len(stale), 1000):
+        # Checked again in case an order pinned one meanwhile; the PROTECT foreign key backs this up
+        batch = MenuSnapshot.objects.filter(id__in=stale[start:start + 1000]).exclude(pinned)
+        deleted += batch.only('id').delete()[0]
+    return deleted
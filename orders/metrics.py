@@ -0,0 +1,23 @@
+"""
+In-process counters for the realtime and caching layers.
+
+Counters are per worker process and reset on restart; they are exposed to
+managers at /api/metrics/.
+"""
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def incr(name, amount=1):
+    """Increment a named counter"""
+    with _lock:
+        _counters[name] += amount
+
+
+def get_counters():
+    """Return a copy of all counters"""
+    with _lock:
+        return dict(_counters)
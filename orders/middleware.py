@@ -3,11 +3,11 @@ Custom middleware for WebSocket JWT authentication
 """
 from urllib.parse import parse_qs
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from .user_cache import aget_user
 
 User = get_user_model()
 
@@ -49,16 +49,22 @@ class JWTAuthMiddleware(BaseMiddleware):
         
         return await super().__call__(scope, receive, send)
     
-    @database_sync_to_async
-    def get_user_from_token(self, token):
+    async def get_user_from_token(self, token):
         """Validate JWT token and return user"""
-        try:
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            user = User.objects.get(id=user_id)
-            return user
-        except (InvalidToken, TokenError, User.DoesNotExist):
-            raise InvalidToken("Invalid token")
+        return await user_from_token(token)
+
+
+async def user_from_token(token):
+    """Return the active user an access token belongs to; raises InvalidToken otherwise"""
+    try:
+        access_token = AccessToken(token)
+        user_id = access_token['user_id']
+        user = await aget_user(user_id)
+        if not user.is_active:
+            raise InvalidToken("User is inactive")
+        return user
+    except (InvalidToken, TokenError, User.DoesNotExist):
+        raise InvalidToken("Invalid token")
 
 
 def JWTAuthMiddlewareStack(inner):
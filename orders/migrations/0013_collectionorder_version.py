@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_add_admin_role'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectionorder',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented on every broadcast change to this order'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_collectionorder_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('snapshot', 'Full Snapshot'), ('patch', 'Delta Patch')], max_length=10)),
+                ('patch', models.JSONField(blank=True, null=True)),
+                ('include_participants', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, help_text='Set while a relay is publishing this event', null=True)),
+                ('published_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.collectionorder')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['published_at', 'id'], name='orders_orde_publish_246797_idx')],
+            },
+        ),
+    ]
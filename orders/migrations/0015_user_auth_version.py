@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_orderevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='auth_version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped when role, password or active status change; invalidates cached authentication'),
+        ),
+    ]
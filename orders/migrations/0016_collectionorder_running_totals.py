@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    CollectionOrder = apps.get_model('orders', 'CollectionOrder')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    CollectionOrder.objects.update(
+        items_total=Coalesce(
+            Subquery(items.annotate(total=Sum('total_price')).values('total')),
+            Value(0), output_field=models.DecimalField(),
+        ),
+        item_count=Coalesce(Subquery(items.annotate(count=Count('id')).values('count')), Value(0)),
+        participant_count=Coalesce(
+            Subquery(items.annotate(count=Count('user_id', distinct=True)).values('count')), Value(0)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0015_user_auth_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectionorder',
+            name='items_total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, help_text="Sum of the items' total prices", max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='collectionorder',
+            name='item_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='collectionorder',
+            name='participant_count',
+            field=models.IntegerField(default=0, help_text='Users with items in this order'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
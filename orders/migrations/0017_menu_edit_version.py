@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0016_collectionorder_running_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='edit_version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped on every change to the menu or its items; with menu_hash it identifies the compiled menu document'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+
+def create_counter(apps, schema_editor):
+    # Existing rows keep catalog_version 0 and reach clients through their first full bundle
+    apps.get_model('orders', 'CatalogVersion').objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_menu_edit_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('restaurant', 'Restaurant'), ('menu', 'Menu'), ('item', 'Menu Item')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('catalog_version', models.PositiveBigIntegerField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['catalog_version'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='catalog_version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, help_text='Catalog version of the last change'),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='catalog_version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, help_text='Catalog version of the last change'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='catalog_version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, help_text='Catalog version of the last change'),
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+    ]
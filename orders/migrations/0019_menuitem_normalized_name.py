@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def backfill_normalized_names(apps, schema_editor):
+    MenuItem = apps.get_model('orders', 'MenuItem')
+    batch = []
+    for item in MenuItem.objects.only('id', 'name').iterator(chunk_size=2000):
+        # Same rules as orders.utils.normalize_item_name at the time of this migration
+        item.normalized_name = ' '.join(item.name.split()).casefold()
+        batch.append(item)
+        if len(batch) == 2000:
+            MenuItem.objects.bulk_update(batch, ['normalized_name'])
+            batch = []
+    MenuItem.objects.bulk_update(batch, ['normalized_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0018_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='normalized_name',
+            field=models.CharField(blank=True, editable=False, help_text='normalize_item_name(name), for exact name lookups', max_length=600),
+        ),
+        migrations.RunPython(backfill_normalized_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['menu', 'normalized_name'], name='orders_menu_menu_id_f1dcd2_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0019_menuitem_normalized_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('menu_hash', models.CharField(blank=True, max_length=64, null=True)),
+                ('edit_version', models.PositiveIntegerField()),
+                ('document', models.BinaryField(help_text='Brotli-compressed menu document JSON')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('menu', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshots', to='orders.menu')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='collectionorder',
+            name='menu_snapshot',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Version of the menu pinned when the order was created or moved to it', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='orders.menusnapshot'),
+        ),
+        migrations.AddConstraint(
+            model_name='menusnapshot',
+            constraint=models.UniqueConstraint(fields=('menu', 'edit_version'), name='unique_menu_snapshot_version'),
+        ),
+    ]
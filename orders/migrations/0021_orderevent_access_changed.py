@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0020_menusnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderevent',
+            name='access_changed',
+            field=models.BooleanField(default=False, help_text='The change can alter who may see the order; connected clients re-check their access'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0021_orderevent_access_changed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderevent',
+            name='kind',
+            field=models.CharField(choices=[('snapshot', 'Full Snapshot'), ('patch', 'Delta Patch'), ('removed', 'Order Deleted')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='orderevent',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='orders.collectionorder'),
+        ),
+    ]
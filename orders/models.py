@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 import secrets
 import string
+from .utils import normalize_item_name
 
 
 class User(AbstractUser):
@@ -17,9 +20,67 @@ class User(AbstractUser):
     phone = models.CharField(max_length=20, blank=True)
     instapay_link = models.URLField(max_length=500, blank=True, help_text="Instapay payment link for this user")
     instapay_qr_code = models.ImageField(upload_to='qr_codes/', blank=True, null=True, help_text="QR code image for Instapay")
+    auth_version = models.PositiveIntegerField(default=0, help_text="Bumped when role, password or active status change; invalidates cached authentication")
+    
+    # Changes to these fields bump auth_version
+    AUTH_FIELDS = ('role', 'password', 'is_active')
+    # Shown in order snapshots; changes refresh the user's orders
+    SNAPSHOT_FIELDS = ('username', 'email', 'instapay_link', 'instapay_qr_code')
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_auth_state = instance._auth_state()
+        instance._loaded_snapshot_state = instance._snapshot_state()
+        return instance
+    
+    def _auth_state(self):
+        # Read from __dict__ so deferred fields are not loaded
+        return tuple(self.__dict__.get(name) for name in self.AUTH_FIELDS)
+    
+    def _snapshot_state(self):
+        # Files compare by name
+        return tuple(getattr(self.__dict__.get(name), 'name', self.__dict__.get(name)) for name in self.SNAPSHOT_FIELDS)
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        
+        auth_changed = self._auth_state() != getattr(self, '_loaded_auth_state', None)
+        snapshot_changed = self._snapshot_state() != getattr(self, '_loaded_snapshot_state', None)
+        # auth_version is only advanced by the update below, never written back
+        if kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'auth_version' and f.attname not in deferred
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if auth_changed:
+                User.objects.filter(id=self.id).update(auth_version=models.F('auth_version') + 1)
+                self.auth_version = User.objects.filter(id=self.id).values_list('auth_version', flat=True).get()
+                self._loaded_auth_state = self._auth_state()
+            if snapshot_changed:
+                from .websocket_utils import broadcast_related_change
+                broadcast_related_change(orders_showing_user(self.id))
+                self._loaded_snapshot_state = self._snapshot_state()
+            
+            from .user_cache import invalidate_user
+            user_id, auth_version = self.id, self.auth_version if auth_changed else None
+            transaction.on_commit(lambda: invalidate_user(user_id, auth_version))
+    
+    def delete(self, *args, **kwargs):
+        from .user_cache import invalidate_user
+        user_id = self.id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            transaction.on_commit(lambda: invalidate_user(user_id))
+        return result
 
 
 class Restaurant(models.Model):
@@ -28,12 +89,36 @@ class Restaurant(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_restaurants')
+    catalog_version = models.PositiveBigIntegerField(default=0, db_index=True, help_text="Catalog version of the last change")
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Order snapshots show the restaurant's name
+        renamed = not self._state.adding and self.name != getattr(self, '_loaded_name', None)
+        with transaction.atomic():
+            self.catalog_version = next_catalog_version()
+            super().save(*args, **kwargs)
+            if renamed:
+                from .websocket_utils import broadcast_related_change
+                broadcast_related_change(self.orders.all())
+            self._loaded_name = self.name
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # Its menus and items go with it; clients drop them with the restaurant
+            remove_from_catalog(CatalogTombstone.RESTAURANT, self.id)
+            return super().delete(*args, **kwargs)
 
 
 class Menu(models.Model):
@@ -47,18 +132,69 @@ class Menu(models.Model):
     talabat_url = models.URLField(max_length=500, blank=True, null=True, help_text="Talabat URL for this menu")
     menu_hash = models.CharField(max_length=64, blank=True, null=True, help_text="SHA256 hash of menu items for change detection")
     last_synced_at = models.DateTimeField(null=True, blank=True, help_text="Last time menu was synced from Talabat")
+    edit_version = models.PositiveIntegerField(default=0, help_text="Bumped on every change to the menu or its items; with menu_hash it identifies the compiled menu document")
+    catalog_version = models.PositiveBigIntegerField(default=0, db_index=True, help_text="Catalog version of the last change")
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return f"{self.restaurant.name} - {self.name}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            with transaction.atomic():
+                self.catalog_version = next_catalog_version()
+                super().save(*args, **kwargs)
+            return
+        # edit_version is only advanced by touch_menu(), never written back
+        if kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'edit_version'
+            ]
+        with transaction.atomic():
+            self.catalog_version = next_catalog_version()
+            super().save(*args, **kwargs)
+            self.edit_version = touch_menu(self.id)
+            # Catalog clients dropped the items of an inactive menu; a reactivated menu resends them
+            if self.is_active and getattr(self, '_loaded_is_active', True) is False:
+                self.items.update(catalog_version=self.catalog_version)
+            self._loaded_is_active = self.is_active
+            # Order snapshots show the menu's name
+            if self.name != getattr(self, '_loaded_name', None):
+                from .websocket_utils import broadcast_related_change
+                broadcast_related_change(self.orders.all())
+            self._loaded_name = self.name
+    
+    def delete(self, *args, **kwargs):
+        from .menu_documents import forget_menu
+        from .websocket_utils import broadcast_related_change
+        menu_id = self.id
+        with transaction.atomic():
+            # Their menu and its items' names leave the orders' snapshots
+            broadcast_related_change(CollectionOrder.objects.filter(
+                Q(menu_id=menu_id) | Exists(OrderItem.objects.filter(order_id=OuterRef('pk'), menu_item__menu_id=menu_id))
+            ))
+            remove_from_catalog(CatalogTombstone.MENU, menu_id)
+            result = super().delete(*args, **kwargs)
+            transaction.on_commit(lambda: forget_menu(menu_id))
+        return result
 
 
 class MenuItem(models.Model):
     """Menu item model"""
     menu = models.ForeignKey(Menu, on_delete=models.CASCADE, related_name='items')
     name = models.CharField(max_length=200)
+    # Case folding can triple a name's length ('ΐ' folds to three code points)
+    normalized_name = models.CharField(max_length=600, blank=True, editable=False, help_text="normalize_item_name(name), for exact name lookups")
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     is_available = models.BooleanField(default=True)
@@ -68,15 +204,150 @@ class MenuItem(models.Model):
     talabat_id = models.BigIntegerField(null=True, blank=True, help_text="Original Talabat item ID")
     item_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True, help_text="SHA256 hash for change detection")
     section_name = models.CharField(max_length=200, blank=True, help_text="Section/category name from Talabat")
+    catalog_version = models.PositiveBigIntegerField(default=0, db_index=True, help_text="Catalog version of the last change")
     
     class Meta:
         ordering = ['name']
         indexes = [
             models.Index(fields=['item_hash']),
+            models.Index(fields=['menu', 'normalized_name']),
         ]
     
     def __str__(self):
         return f"{self.menu.restaurant.name} - {self.name}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_name = instance.__dict__.get('name')
+        instance._loaded_menu_id = instance.__dict__.get('menu_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Bulk creates set it themselves (see sync_talabat_menus)
+        self.normalized_name = normalize_item_name(self.name)
+        # Order snapshots show the item's name
+        renamed = not self._state.adding and self.name != getattr(self, '_loaded_name', None)
+        previous_menu_id = None if self._state.adding else getattr(self, '_loaded_menu_id', None)
+        with transaction.atomic():
+            self.catalog_version = next_catalog_version()
+            super().save(*args, **kwargs)
+            touch_menu(self.menu_id)
+            # An item moved to another menu leaves the previous menu's document too
+            if previous_menu_id is not None and previous_menu_id != self.menu_id:
+                touch_menu(previous_menu_id)
+            self._loaded_menu_id = self.menu_id
+            if renamed:
+                from .websocket_utils import broadcast_related_change
+                broadcast_related_change(orders_with_menu_items([self.id]))
+            self._loaded_name = self.name
+    
+    def delete(self, *args, **kwargs):
+        from .websocket_utils import broadcast_related_change
+        with transaction.atomic():
+            # Their items lose the menu item's name
+            broadcast_related_change(orders_with_menu_items([self.id]))
+            remove_from_catalog(CatalogTombstone.ITEM, self.id)
+            result = super().delete(*args, **kwargs)
+            touch_menu(self.menu_id)
+        return result
+
+
+def touch_menu(menu_id):
+    """
+    Bump a menu's edit_version after a change to it or its items and return the new value.
+    The new document version is published on commit (see menu_documents).
+    Bulk creates and updates bypass this; the Talabat sync saves the menu after them.
+    """
+    from .menu_documents import publish_version
+    Menu.objects.filter(id=menu_id).update(edit_version=models.F('edit_version') + 1)
+    version = Menu.objects.filter(id=menu_id).values_list('menu_hash', 'edit_version').first()
+    if version is None:
+        return None
+    transaction.on_commit(lambda: publish_version(menu_id, version))
+    return version[1]
+
+
+def orders_with_menu_items(menu_item_ids):
+    """Orders with items of these menu items"""
+    return CollectionOrder.objects.filter(
+        Exists(OrderItem.objects.filter(order_id=OuterRef('pk'), menu_item_id__in=menu_item_ids))
+    )
+
+
+def orders_showing_user(user_id):
+    """Orders whose snapshot shows the user: as collector, participant, payer or assigned user"""
+    return CollectionOrder.objects.filter(
+        Q(collector_id=user_id)
+        | Exists(OrderItem.objects.filter(order_id=OuterRef('pk'), user_id=user_id))
+        | Exists(Payment.objects.filter(order_id=OuterRef('pk'), user_id=user_id))
+        | Exists(CollectionOrder.assigned_users.through.objects.filter(collectionorder_id=OuterRef('pk'), user_id=user_id))
+    )
+
+
+class MenuSnapshot(models.Model):
+    """A menu version's compiled document, pinned by the orders created against it (see orders/menu_snapshots.py)"""
+    menu = models.ForeignKey(Menu, on_delete=models.SET_NULL, null=True, blank=True, related_name='snapshots')
+    menu_hash = models.CharField(max_length=64, blank=True, null=True)
+    edit_version = models.PositiveIntegerField()
+    document = models.BinaryField(help_text="Brotli-compressed menu document JSON")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['menu', 'edit_version'], name='unique_menu_snapshot_version'),
+        ]
+    
+    def __str__(self):
+        return f"Menu {self.menu_id} v{self.edit_version}"
+
+
+class CatalogVersion(models.Model):
+    """Single row counting changes to restaurants, menus and menu items (see next_catalog_version)"""
+    version = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+
+class CatalogTombstone(models.Model):
+    """A restaurant, menu or menu item deleted from the catalog, for delta bundles"""
+    RESTAURANT = 'restaurant'
+    MENU = 'menu'
+    ITEM = 'item'
+    KIND_CHOICES = [
+        (RESTAURANT, 'Restaurant'),
+        (MENU, 'Menu'),
+        (ITEM, 'Menu Item'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    catalog_version = models.PositiveBigIntegerField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['catalog_version']
+    
+    def __str__(self):
+        return f"{self.kind} {self.object_id} removed in v{self.catalog_version}"
+
+
+def next_catalog_version():
+    """
+    Allocate the next catalog version for a change to a restaurant, menu or item.
+    The counter row stays locked until the transaction ends, so versions
+    become visible in order and a client syncing `since` a version misses nothing.
+    """
+    if not CatalogVersion.objects.filter(id=1).update(version=models.F('version') + 1):
+        CatalogVersion.objects.get_or_create(id=1)
+        CatalogVersion.objects.filter(id=1).update(version=models.F('version') + 1)
+    return CatalogVersion.objects.filter(id=1).values_list('version', flat=True).get()
+
+
+def remove_from_catalog(kind, object_id):
+    CatalogTombstone.objects.create(kind=kind, object_id=object_id, catalog_version=next_catalog_version())
 
 
 class FeePreset(models.Model):
@@ -110,6 +381,7 @@ class CollectionOrder(models.Model):
     code = models.CharField(max_length=10, unique=True, db_index=True)
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='orders')
     menu = models.ForeignKey(Menu, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders', help_text="Optional menu for this order")
+    menu_snapshot = models.ForeignKey(MenuSnapshot, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='orders', help_text="Version of the menu pinned when the order was created or moved to it")
     collector = models.ForeignKey(User, on_delete=models.CASCADE, related_name='collected_orders')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='OPEN')
     cutoff_time = models.DateTimeField(null=True, blank=True)
@@ -130,6 +402,17 @@ class CollectionOrder(models.Model):
     ordered_at = models.DateTimeField(null=True, blank=True)
     closed_at = models.DateTimeField(null=True, blank=True)
     
+    # Monotonic change counter used by WebSocket clients to apply delta patches in order
+    version = models.PositiveIntegerField(default=0, help_text="Incremented on every broadcast change to this order")
+    
+    # Running totals of the order's items, kept by OrderItem.save()/delete() and checked by recount_totals()
+    items_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True, help_text="Sum of the items' total prices")
+    item_count = models.IntegerField(default=0, db_index=True)
+    participant_count = models.IntegerField(default=0, help_text="Users with items in this order")
+    
+    # Only changed through F() updates; never written back from a possibly stale instance
+    MAINTAINED_FIELDS = ('version', 'items_total', 'item_count', 'participant_count')
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -143,14 +426,45 @@ class CollectionOrder(models.Model):
             if not CollectionOrder.objects.filter(code=code).exists():
                 return code
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'menu_id' in instance.__dict__:
+            instance._loaded_menu_id = instance.menu_id
+        return instance
+    
     def save(self, *args, **kwargs):
+        from .menu_snapshots import take_snapshot
         if not self.code:
             self.code = self.generate_code()
+        # Pin the menu's current version; later menu changes don't reach this order.
+        # Fields deferred when the order was loaded are left alone.
+        menu_id = self.__dict__.get('menu_id')
+        loaded_menu_id = getattr(self, '_loaded_menu_id', None if self._state.adding else menu_id)
+        pin = menu_id != loaded_menu_id or (menu_id and 'menu_snapshot_id' in self.__dict__ and not self.menu_snapshot_id)
+        if pin:
+            self.menu_snapshot_id = take_snapshot(self.menu_id) if self.menu_id else None
+            self._loaded_menu_id = self.menu_id
+        # Never write back a stale in-memory version or totals - they are only changed with F() updates
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.MAINTAINED_FIELDS
+            ]
+        elif pin and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'menu_snapshot'}
         super().save(*args, **kwargs)
     
+    def bump_version(self):
+        """Atomically increment the order version and return the new value"""
+        with transaction.atomic():
+            CollectionOrder.objects.filter(id=self.id).update(version=models.F('version') + 1)
+            self.version = CollectionOrder.objects.filter(id=self.id).values_list('version', flat=True).get()
+        return self.version
+    
     def get_total_items_cost(self):
-        """Calculate total cost of all items"""
-        return sum(item.total_price for item in self.items.all())
+        """Total cost of all items"""
+        return self.items_total
     
     def get_total_cost(self):
         """Calculate total cost including fees"""
@@ -159,6 +473,32 @@ class CollectionOrder(models.Model):
     def get_participants(self):
         """Get all users who have items in this order"""
         return User.objects.filter(order_items__order=self).distinct()
+    
+    def recount_totals(self):
+        """
+        Recompute items_total, item_count and participant_count from the items.
+        Returns True if the stored values were wrong and have been corrected.
+        """
+        with transaction.atomic():
+            # Item writers update the order row after changing an item, so holding
+            # its lock means every committed change is counted and none is lost
+            stored = CollectionOrder.objects.select_for_update().filter(id=self.id).values_list(
+                'items_total', 'item_count', 'participant_count'
+            ).first()
+            if stored is None:
+                return False
+            actual = self.items.aggregate(
+                items_total=Coalesce(Sum('total_price'), Value(0), output_field=models.DecimalField()),
+                item_count=Count('id'),
+                participant_count=Count('user', distinct=True),
+            )
+            self.items_total, self.item_count, self.participant_count = (
+                actual['items_total'], actual['item_count'], actual['participant_count']
+            )
+            if stored == (self.items_total, self.item_count, self.participant_count):
+                return False
+            CollectionOrder.objects.filter(id=self.id).update(**actual)
+        return True
 
 
 class OrderItem(models.Model):
@@ -189,7 +529,45 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         if not self.total_price:
             self.total_price = self.unit_price * self.quantity
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = OrderItem.objects.select_for_update().filter(id=self.id).values_list(
+                    'order_id', 'user_id', 'total_price'
+                ).first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                count_item(self.order_id, self.user_id, self.id, self.total_price, 1)
+            elif previous[:2] != (self.order_id, self.user_id):
+                count_item(*previous[:2], self.id, previous[2], -1)
+                count_item(self.order_id, self.user_id, self.id, self.total_price, 1)
+            elif previous[2] != self.total_price:
+                CollectionOrder.objects.filter(id=self.order_id).update(
+                    items_total=models.F('items_total') + self.total_price - previous[2]
+                )
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            item_id = self.id
+            result = super().delete(*args, **kwargs)
+            count_item(self.order_id, self.user_id, item_id, self.total_price, -1)
+        return result
+
+
+def count_item(order_id, user_id, item_id, total_price, sign):
+    """
+    Add (sign=1) or remove (sign=-1) an item in its order's running totals.
+    The user joins or leaves the participants if they have no other item there.
+    Bulk deletes and cascades bypass this; CollectionOrder.recount_totals() repairs them.
+    """
+    others = OrderItem.objects.filter(order_id=order_id, user_id=user_id).exclude(id=item_id)
+    CollectionOrder.objects.filter(id=order_id).update(
+        item_count=models.F('item_count') + sign,
+        items_total=models.F('items_total') + sign * total_price,
+        participant_count=models.F('participant_count') + Case(
+            When(Exists(others), then=Value(0)), default=Value(sign)
+        ),
+    )
 
 
 class Payment(models.Model):
@@ -209,6 +587,35 @@ class Payment(models.Model):
         return f"{self.user.username} - {self.amount} EGP ({status})"
 
 
+class OrderEvent(models.Model):
+    """Transactional outbox of order changes, published to WebSocket clients by the relay"""
+    KIND_CHOICES = [
+        ('snapshot', 'Full Snapshot'),
+        ('patch', 'Delta Patch'),
+        ('removed', 'Order Deleted'),
+    ]
+    
+    # Outlives the order, so the relay still publishes its removal
+    order = models.ForeignKey(CollectionOrder, on_delete=models.DO_NOTHING, db_constraint=False, related_name='events')
+    version = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    patch = models.JSONField(null=True, blank=True)
+    include_participants = models.BooleanField(default=False)
+    access_changed = models.BooleanField(default=False, help_text="The change can alter who may see the order; connected clients re-check their access")
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True, help_text="Set while a relay is publishing this event")
+    published_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['published_at', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.order_id} v{self.version} ({self.kind})"
+
+
 class AuditLog(models.Model):
     """Audit log for order changes"""
     ACTION_CHOICES = [
@@ -0,0 +1,194 @@
+"""
+Relay for the order event outbox.
+
+Write endpoints record OrderEvent rows in the same transaction as the change
+(see websocket_utils.record_order_event), so a rolled-back change is never
+broadcast and requests don't wait on the channel layer. The relay publishes
+committed events in batches, coalescing each order's pending events into a
+single fan-out.
+
+The relay runs as an asyncio task inside the ASGI server (started through the
+lifespan protocol) or standalone via `python manage.py relay_order_events`.
+Several relays can run at once; events are claimed with SKIP LOCKED.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import metrics
+from .coalescing import coalesce_events
+from .models import OrderEvent
+from .websocket_utils import publish_order_broadcast
+
+logger = logging.getLogger(__name__)
+
+# A claim older than this is considered abandoned by a crashed relay
+CLAIM_TIMEOUT = timedelta(seconds=30)
+
+
+class OrderEventRelay:
+    """Publish committed order events to the channel layer"""
+    
+    def __init__(self, batch_size, poll_interval, window, max_delay, retention):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.window = window
+        self.max_delay = max_delay
+        self.retention = timedelta(seconds=retention)
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._last_pruned_at = None
+    
+    def start(self):
+        """Start relaying on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self.run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def serve(self):
+        """Run until cancelled (standalone mode)"""
+        self.start()
+        await self._task
+    
+    def wake(self):
+        """Signal that new events were committed; safe to call from any thread"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                next_due = await self.relay_once()
+            except Exception:
+                logger.exception('Order event relay failed')
+                next_due = None
+            
+            timeout = self.poll_interval if next_due is None else min(self.poll_interval, next_due)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def relay_once(self):
+        """
+        Publish every order whose coalescing window has elapsed.
+        Returns the number of seconds until the next pending order is due, or None.
+        """
+        # On its own timer, so a steady backlog doesn't keep published events forever
+        await self.prune()
+        events = await self.fetch_pending()
+        if not events:
+            return None
+        
+        now = timezone.now()
+        due_order_ids = []
+        next_due = None
+        for order_id, pending in coalesce_events(events).items():
+            due_at = pending.due_at(self.window, self.max_delay)
+            if due_at <= now:
+                due_order_ids.append(order_id)
+            else:
+                wait = (due_at - now).total_seconds()
+                next_due = wait if next_due is None else min(next_due, wait)
+        
+        if due_order_ids:
+            claimed = await self.claim(due_order_ids)
+            for order_id, pending in coalesce_events(claimed).items():
+                await self.publish(order_id, pending)
+        
+        return next_due
+    
+    async def publish(self, order_id, pending):
+        try:
+            await publish_order_broadcast(order_id, pending)
+        except Exception:
+            metrics.incr('order_broadcast_failed')
+            logger.exception('Failed to broadcast update for order %s', order_id)
+            await self.release(pending.event_ids)
+            return
+        
+        await self.mark_published(pending.event_ids)
+        metrics.incr('order_events_relayed', len(pending.event_ids))
+        metrics.incr('order_broadcast_sent')
+        metrics.incr('order_broadcast_saved', len(pending.event_ids) - 1)
+    
+    @database_sync_to_async
+    def fetch_pending(self):
+        return list(
+            self._claimable(OrderEvent.objects.all()).order_by('id')[:self.batch_size]
+        )
+    
+    @database_sync_to_async
+    def claim(self, order_ids):
+        with transaction.atomic():
+            events = list(
+                self._claimable(OrderEvent.objects.select_for_update(skip_locked=True))
+                .filter(order_id__in=order_ids)
+                .order_by('id')[:self.batch_size]
+            )
+            OrderEvent.objects.filter(id__in=[e.id for e in events]).update(claimed_at=timezone.now())
+        return events
+    
+    @database_sync_to_async
+    def release(self, event_ids):
+        OrderEvent.objects.filter(id__in=event_ids).update(claimed_at=None)
+    
+    @database_sync_to_async
+    def mark_published(self, event_ids):
+        OrderEvent.objects.filter(id__in=event_ids).update(published_at=timezone.now())
+    
+    async def prune(self):
+        """Delete published events past the retention period, at most once a minute"""
+        now = timezone.now()
+        if self._last_pruned_at and now - self._last_pruned_at < timedelta(minutes=1):
+            return
+        self._last_pruned_at = now
+        await database_sync_to_async(
+            OrderEvent.objects.filter(published_at__lt=now - self.retention).delete
+        )()
+    
+    def _claimable(self, queryset):
+        return queryset.filter(published_at__isnull=True).filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=timezone.now() - CLAIM_TIMEOUT)
+        )
+
+
+relay = OrderEventRelay(
+    batch_size=settings.ORDER_EVENT_RELAY_BATCH_SIZE,
+    poll_interval=settings.ORDER_EVENT_RELAY_POLL_INTERVAL,
+    window=settings.ORDER_BROADCAST_COALESCE_WINDOW,
+    max_delay=settings.ORDER_BROADCAST_MAX_DELAY,
+    retention=settings.ORDER_EVENT_RETENTION,
+)
+
+
+async def relay_lifespan(scope, receive, send):
+    """ASGI lifespan handler running the relay alongside the server"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if settings.ORDER_EVENT_RELAY_IN_PROCESS:
+                relay.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await relay.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
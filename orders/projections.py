@@ -0,0 +1,83 @@
+"""
+Audience projections of order broadcasts.
+
+Each broadcast is serialized once and then trimmed once per audience, and
+every audience has its own groups per order. A broadcast therefore costs one
+projection per audience however many sockets are listening:
+
+- collector: the order's collector and managers get the full snapshot.
+- participant: users with items in the order or assigned to it. Other users'
+  email addresses are blanked.
+- viewer: anyone else who can see a public order. Payments and the Instapay
+  details are blanked as well, and payment patches become `noop` patches so
+  patch versions stay contiguous.
+
+Blanked fields keep their keys so clients can treat every projection alike.
+"""
+COLLECTOR = 'collector'
+PARTICIPANT = 'participant'
+VIEWER = 'viewer'
+
+AUDIENCES = (COLLECTOR, PARTICIPANT, VIEWER)
+
+
+def audience_for(access):
+    """The audience of a user's OrderAccess"""
+    if access.is_manager or access.is_collector:
+        return COLLECTOR
+    if access.is_assigned or access.has_items:
+        return PARTICIPANT
+    return VIEWER
+
+
+def project_order(order_data, audience):
+    """Trim a serialized order for an audience"""
+    if audience == COLLECTOR:
+        return order_data
+    order_data = dict(order_data)
+    # REST reads may have dropped fields with ?fields= / ?omit=
+    for key in ('participants', 'assigned_users_details'):
+        if key in order_data:
+            order_data[key] = _without_emails(order_data[key])
+    if audience == VIEWER:
+        blanks = {
+            'payments': [],
+            'instapay_link': '',
+            'collector_instapay_link': '',
+            'collector_instapay_qr_code_url': None,
+        }
+        order_data.update({key: blank for key, blank in blanks.items() if key in order_data})
+    return order_data
+
+
+def project_message(message, audience):
+    """Trim an order_update or order_patch group message for an audience"""
+    if audience == COLLECTOR:
+        return message
+    message = dict(message)
+    if 'order' in message:
+        message['order'] = project_order(message['order'], audience)
+    if 'participants' in message:
+        message['participants'] = _without_emails(message['participants'])
+    if 'patches' in message and audience == VIEWER:
+        message['patches'] = [
+            {'op': 'noop', 'version': patch['version']} if patch['op'] == 'payment_changed' else patch
+            for patch in message['patches']
+        ]
+    return message
+
+
+def mentions_user(message, user_id):
+    """Whether a group message shows the user taking part in the order"""
+    order_data = message.get('order')
+    if order_data is not None:
+        return user_id in order_data['assigned_users'] or any(
+            participant['id'] == user_id for participant in order_data['participants']
+        )
+    return any(
+        patch.get('item', {}).get('user') == user_id for patch in message.get('patches', [])
+    ) or any(participant['id'] == user_id for participant in message.get('participants', []))
+
+
+def _without_emails(users):
+    return [{**user, 'email': ''} for user in users]
@@ -0,0 +1,81 @@
+"""
+Per-order replay buffer for WebSocket reconnects.
+
+Every broadcast sent to delta clients is also appended to a capped Redis
+stream per order, with the order version as the entry ID. A client that
+reconnects with `?since=<version>` is sent only the frames it missed. The
+consumer falls back to a full snapshot when the stream has been trimmed or
+expired past that point, or when a full snapshot was broadcast in between.
+"""
+import asyncio
+import logging
+import weakref
+import redis.asyncio as redis
+from django.conf import settings
+from . import fastjson, metrics
+
+logger = logging.getLogger(__name__)
+
+# redis.asyncio connections are bound to the event loop that opened them
+_clients = weakref.WeakKeyDictionary()
+
+
+def replay_key(order_id):
+    return f'order_replay:{order_id}'
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = redis.Redis.from_url(settings.ORDER_REPLAY_REDIS_URL)
+    return client
+
+
+async def append(order_id, version, message):
+    """Record a broadcast message; failures only cost reconnecting clients a snapshot"""
+    key = replay_key(order_id)
+    try:
+        async with get_client().pipeline(transaction=False) as pipe:
+            pipe.xadd(
+                key,
+                {'message': fastjson.dumps(message)},
+                id=f'{version}-0',
+                maxlen=settings.ORDER_REPLAY_BUFFER_SIZE,
+                approximate=True,
+            )
+            pipe.expire(key, settings.ORDER_REPLAY_BUFFER_TTL)
+            await pipe.execute()
+    except redis.RedisError:
+        metrics.incr('order_replay_append_failed')
+        logger.warning('Could not append order %s version %s to replay buffer', order_id, version, exc_info=True)
+
+
+async def read_since(order_id, since):
+    """
+    Return the messages broadcast after version `since`, oldest first.
+    Returns None if the buffer no longer covers every version after `since`.
+    """
+    key = replay_key(order_id)
+    try:
+        async with get_client().pipeline(transaction=False) as pipe:
+            pipe.xrange(key, min=f'{since + 1}-0', max='+')
+            pipe.xrevrange(key, count=1)
+            entries, last = await pipe.execute()
+    except redis.RedisError:
+        logger.warning('Replay buffer unavailable for order %s', order_id, exc_info=True)
+        return None
+    
+    if not last:
+        return None  # Nothing buffered (expired, or never broadcast)
+    if not entries:
+        # Up to date if the newest buffered version is the one the client has
+        last_version = int(last[0][0].split(b'-')[0])
+        return [] if last_version == since else None
+    
+    messages = [fastjson.loads(fields[b'message']) for _, fields in entries]
+    first = messages[0]
+    first_version = first['patches'][0]['version'] if first['type'] == 'order_patch' else first['version']
+    if first_version > since + 1:
+        return None  # Trimmed past the client's version
+    return messages
@@ -3,5 +3,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/orders/(?P<order_id>\d+)/$', consumers.OrderConsumer.as_asgi()),
+    re_path(r'ws/orders/$', consumers.OrderStreamConsumer.as_asgi()),
+    re_path(r'ws/orders/board/$', consumers.OrderBoardConsumer.as_asgi()),
 ]
 
@@ -0,0 +1,211 @@
+"""
+Menu item search.
+
+Each process keeps an in-memory index of the catalog - the available items
+of active menus - that answers `/api/menu-items/search/?q=` without
+scanning the items table:
+
+- Names are normalized for matching: case-folded, accents and Arabic
+  diacritics removed, alef/yeh/teh marbuta variants and Arabic-Indic digits
+  unified, punctuation dropped and whitespace collapsed.
+- Word prefixes: every query word must start a word of the name, so
+  "chick bur" finds "Chicken Burger".
+- Typos: names containing at least SEARCH_MIN_SIMILARITY of the query's
+  character trigrams match too, so "chiken" finds "Chicken Burger".
+
+Results are ranked exact name, name prefix, word prefixes, then trigram
+similarity, and can be restricted to one restaurant.
+
+At most every SEARCH_INDEX_CHECK_INTERVAL seconds a search reads the catalog
+version (one query) and applies the catalog delta since the indexed version
+(see catalog.delta_bundle), so Talabat syncs and manual edits show up
+without rebuilding the index.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from django.conf import settings
+from . import catalog, metrics
+
+# Arabic letters with several written forms, and Arabic-Indic digits
+_FOLD = str.maketrans({
+    'ى': 'ي', 'ئ': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ـ': None,
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+})
+
+
+def normalize(text):
+    """Matching form of a name or query: see the module docstring"""
+    # NFKD splits accents and hamza/madda off their letters (أ -> ا + hamza) so they can be dropped
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    letters = ''.join(
+        char if char.isalnum() else ' '
+        for char in decomposed if not unicodedata.category(char).startswith('M')
+    )
+    return ' '.join(letters.translate(_FOLD).split())
+
+
+def trigrams(normalized):
+    """Character trigrams of each word, padded so word starts and ends count"""
+    grams = set()
+    for word in normalized.split():
+        padded = f' {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """Word-prefix and trigram postings over catalog items, updated from catalog bundles"""
+    
+    def __init__(self):
+        self.version = 0
+        self.items = {}  # item id -> (item row, normalized name)
+        self.order = {}  # item id -> sort key among equally good matches: shorter names first
+        self.menus = {}  # menu id -> restaurant id
+        self.menu_items = {}  # menu id -> item ids
+        self.words = {}  # word -> item ids
+        self.sorted_words = []
+        self.sorted_names = []  # (normalized name, item id)
+        self.trigrams = {}  # trigram -> item ids
+    
+    def apply(self, bundle):
+        """Apply a full or delta catalog bundle"""
+        removed = bundle['removed']
+        for menu in bundle['menus']:
+            self.menus[menu['id']] = menu['restaurant']
+        for restaurant_id in removed['restaurants']:
+            removed['menus'].extend(menu_id for menu_id, owner in self.menus.items() if owner == restaurant_id)
+        for menu_id in removed['menus']:
+            for item_id in list(self.menu_items.get(menu_id, ())):
+                self._remove(item_id)
+            self.menus.pop(menu_id, None)
+        for item_id in removed['items']:
+            self._remove(item_id)
+        for item in bundle['items']:
+            self._remove(item['id'])
+            self._add(item)
+        self.sorted_words = sorted(self.words)
+        self.sorted_names = sorted((name, item_id) for item_id, (_, name) in self.items.items())
+        self.version = bundle['catalog_version']
+    
+    def _add(self, item):
+        normalized = normalize(item['name'])
+        grams = trigrams(normalized)
+        self.items[item['id']] = (item, normalized)
+        self.order[item['id']] = (len(normalized), item['name'])
+        self.menu_items.setdefault(item['menu'], set()).add(item['id'])
+        for word in set(normalized.split()):
+            self.words.setdefault(word, set()).add(item['id'])
+        for gram in grams:
+            self.trigrams.setdefault(gram, set()).add(item['id'])
+    
+    def _remove(self, item_id):
+        entry = self.items.pop(item_id, None)
+        if entry is None:
+            return
+        item, normalized = entry
+        del self.order[item_id]
+        self.menu_items.get(item['menu'], set()).discard(item_id)
+        for postings, keys in ((self.words, set(normalized.split())), (self.trigrams, trigrams(normalized))):
+            for key in keys:
+                ids = postings.get(key)
+                if ids is not None:
+                    ids.discard(item_id)
+                    if not ids:
+                        del postings[key]
+    
+    def _prefixed(self, word):
+        """Ids of items with a word starting with `word`"""
+        matched = set()
+        index = bisect_left(self.sorted_words, word)
+        while index < len(self.sorted_words) and self.sorted_words[index].startswith(word):
+            matched.update(self.words.get(self.sorted_words[index], ()))
+            index += 1
+        return matched
+    
+    def _name_prefixed(self, normalized):
+        """Ids of items whose whole name starts with `normalized`"""
+        matched = set()
+        index = bisect_left(self.sorted_names, (normalized,))
+        while index < len(self.sorted_names) and self.sorted_names[index][0].startswith(normalized):
+            matched.add(self.sorted_names[index][1])
+            index += 1
+        return matched
+    
+    def search(self, query, restaurant_id=None, limit=20):
+        """Best matches as (score, item) pairs; see the module docstring for the ranking"""
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        
+        scope = None
+        if restaurant_id is not None:
+            scope = set().union(*(
+                self.menu_items.get(menu_id, ()) for menu_id, owner in self.menus.items() if owner == restaurant_id
+            ))
+        
+        # Tiers best first; within a tier shorter names rank higher, so an exact name leads the name prefixes
+        name_prefixed = self._name_prefixed(normalized)
+        prefixed = scope
+        for word in normalized.split():
+            matched = self._prefixed(word)
+            prefixed = matched if prefixed is None else prefixed & matched
+            if not prefixed:
+                break
+        if scope is not None:
+            name_prefixed &= scope
+        
+        found = []
+        for tier_ids in (name_prefixed, prefixed - name_prefixed):
+            for item_id in heapq.nsmallest(limit - len(found), tier_ids, key=self.order.__getitem__):
+                item, name = self.items[item_id]
+                found.append((3 if name == normalized else 2 if item_id in name_prefixed else 1, item))
+            if len(found) >= limit:
+                return found
+        
+        # Typos: share of the query's trigrams each remaining item contains
+        query_grams = trigrams(normalized)
+        if len(normalized) < 3:
+            return found
+        counts = Counter(chain.from_iterable(self.trigrams.get(gram, ()) for gram in query_grams))
+        minimum = settings.SEARCH_MIN_SIMILARITY * len(query_grams)
+        similar = [
+            (count, item_id) for item_id, count in counts.items()
+            if count >= minimum and item_id not in prefixed and (scope is None or item_id in scope)
+        ]
+        for count, item_id in heapq.nsmallest(
+            limit - len(found), similar, key=lambda entry: (-entry[0], self.order[entry[1]])
+        ):
+            found.append((round(count / len(query_grams), 3), self.items[item_id][0]))
+        return found
+
+
+_lock = threading.Lock()
+_index = None
+_checked_at = 0.0
+
+
+def search(query, restaurant_id=None, limit=20):
+    """Search this process's index, bringing it up to the current catalog version first"""
+    global _index, _checked_at
+    with _lock:
+        if _index is None or time.monotonic() - _checked_at >= settings.SEARCH_INDEX_CHECK_INTERVAL:
+            version = catalog.current_version()
+            if _index is None:
+                metrics.incr('search_index_built')
+                _index = SearchIndex()
+                _index.apply(catalog.full_bundle(version))
+            elif version != _index.version:
+                metrics.incr('search_index_updated')
+                _index.apply(catalog.delta_bundle(version, _index.version))
+            _checked_at = time.monotonic()
+        # Searches hold the lock too, so they never see a half-applied delta
+        return [
+            {**item, 'restaurant': _index.menus.get(item['menu']), 'score': score}
+            for score, item in _index.search(query, restaurant_id, limit)
+        ]
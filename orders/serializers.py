@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import authenticate
 from django.conf import settings
@@ -26,7 +27,39 @@ class OptionalUserField(serializers.PrimaryKeyRelatedField):
         return super().validate_empty_values(data)
 
 
-class UserSerializer(serializers.ModelSerializer):
+def sparse_fieldset(request, names):
+    """
+    The field names a read request keeps: `names` narrowed by ?fields=a,b
+    and/or ?omit=c,d. Unknown names are ignored; writes keep every field.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return list(names)
+    # DRF requests, or the plain Django requests of the SSE and long-poll views
+    params = getattr(request, 'query_params', request.GET)
+    only = {name.strip() for name in params['fields'].split(',')} if params.get('fields') else None
+    omit = {name.strip() for name in params.get('omit', '').split(',')}
+    return [name for name in names if (only is None or name in only) and name not in omit]
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin for ?fields= and ?omit= on GET requests. Fields are
+    dropped before serialization, so omitted method fields and nested
+    serializers never run. Only the top-level serializer (or each row of a
+    list) is trimmed; nested serializers keep all their fields.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        kept = sparse_fieldset(self.context.get('request'), fields)
+        return {name: field for name, field in fields.items() if name in kept}
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     instapay_qr_code_url = serializers.SerializerMethodField()
     
     class Meta:
@@ -150,7 +183,7 @@ class MenuSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     menu_name = serializers.CharField(source='menu.name', read_only=True)
     
     class Meta:
@@ -166,7 +199,7 @@ class FeePresetSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     item_name = serializers.SerializerMethodField()
     menu_item = serializers.PrimaryKeyRelatedField(queryset=MenuItem.objects.all(), required=False, allow_null=True)
@@ -296,7 +329,79 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class CollectionOrderSerializer(serializers.ModelSerializer):
+def build_join_url(code, request=None):
+    """Frontend link for joining an order"""
+    # Prefer request host over FRONTEND_URL to get actual host
+    if request:
+        scheme = request.scheme
+        host = request.get_host()
+        # Replace backend port with frontend port if needed
+        if ':19992' in host:
+            host = host.replace(':19992', ':19991')
+        elif ':8000' in host:
+            host = host.replace(':8000', ':19991')
+        # Always use request host, even if it's localhost (for development)
+        # In production, this will be the actual domain
+        if host:
+            return f"{scheme}://{host}/join/{code}"
+    
+    # Fallback to FRONTEND_URL if no request available
+    frontend_url = getattr(settings, 'FRONTEND_URL', None)
+    if frontend_url:
+        return f"{frontend_url}/join/{code}"
+    
+    return f'/join/{code}'
+
+
+def build_share_message(restaurant_name, code, cutoff_time, join_url, collector_name, assigned_names):
+    """WhatsApp/Teams message for sharing an order"""
+    # Format cutoff time in GMT+2 (Egypt timezone)
+    if cutoff_time:
+        utc_time = cutoff_time
+        if tz.is_aware(utc_time):
+            # Convert to Egypt timezone (GMT+2)
+            try:
+                import pytz
+                egypt_tz = pytz.timezone('Africa/Cairo')
+                cutoff_local = utc_time.astimezone(egypt_tz)
+                cutoff_str = cutoff_local.strftime('%I:%M %p')
+            except (ImportError, Exception):
+                # Fallback: add 2 hours manually if pytz not available
+                cutoff_local = utc_time + timedelta(hours=2)
+                cutoff_str = cutoff_local.strftime('%I:%M %p')
+        else:
+            # If naive, assume it's UTC and add 2 hours
+            cutoff_local = utc_time + timedelta(hours=2)
+            cutoff_str = cutoff_local.strftime('%I:%M %p')
+    else:
+        cutoff_str = 'N/A'
+    
+    message = (f"🍽️ OrderQ: Order from {restaurant_name}\n"
+              f"📋 Join code: {code}\n"
+              f"⏰ Cutoff: {cutoff_str}\n"
+              f"🔗 Add your items here: {join_url}\n"
+              f"👤 Collector: {collector_name}")
+    
+    # Add assigned users info if any
+    if assigned_names:
+        message += f"\n👥 Assigned to: {', '.join(assigned_names)}"
+    
+    return message
+
+
+def payment_summary(payment):
+    """Compact payment representation embedded in order payloads"""
+    return {
+        'id': payment.id,
+        'user': payment.user.id,
+        'user_name': payment.user.username,
+        'amount': float(payment.amount),
+        'is_paid': payment.is_paid,
+        'paid_at': payment.paid_at.isoformat() if payment.paid_at else None
+    }
+
+
+class CollectionOrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     restaurant_name = serializers.CharField(source='restaurant.name', read_only=True)
     menu_name = serializers.CharField(source='menu.name', read_only=True, allow_null=True)
     collector_name = serializers.CharField(source='collector.username', read_only=True)
@@ -321,12 +426,12 @@ class CollectionOrderSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CollectionOrder
-        fields = ['id', 'code', 'restaurant', 'restaurant_name', 'menu', 'menu_name', 'collector', 'collector_name', 'collector_instapay_link', 'collector_instapay_qr_code_url',
+        fields = ['id', 'code', 'restaurant', 'restaurant_name', 'menu', 'menu_name', 'menu_snapshot', 'collector', 'collector_name', 'collector_instapay_link', 'collector_instapay_qr_code_url',
                   'status', 'cutoff_time', 'instapay_link', 'is_private', 'assigned_users', 'assigned_users_details',
                   'delivery_fee', 'tip', 'service_fee', 'fee_split_rule', 'created_at', 'locked_at', 'ordered_at', 'closed_at',
                   'items', 'participants', 'payments', 'total_items_cost', 'total_cost', 
-                  'share_message', 'join_url']
-        read_only_fields = ['id', 'code', 'collector', 'created_at', 'locked_at', 'ordered_at', 'closed_at', 'assigned_users_details']
+                  'share_message', 'join_url', 'version']
+        read_only_fields = ['id', 'code', 'collector', 'menu_snapshot', 'created_at', 'locked_at', 'ordered_at', 'closed_at', 'assigned_users_details', 'version']
     
     def get_assigned_users_details(self, obj):
         return [{'id': u.id, 'username': u.username, 'email': u.email} for u in obj.assigned_users.all()]
@@ -344,15 +449,7 @@ class CollectionOrderSerializer(serializers.ModelSerializer):
         return [{'id': p.id, 'username': p.username, 'email': p.email} for p in participants]
     
     def get_payments(self, obj):
-        payments = obj.payments.all()
-        return [{
-            'id': p.id,
-            'user': p.user.id,
-            'user_name': p.user.username,
-            'amount': float(p.amount),
-            'is_paid': p.is_paid,
-            'paid_at': p.paid_at.isoformat() if p.paid_at else None
-        } for p in payments]
+        return [payment_summary(p) for p in obj.payments.all()]
     
     def get_total_items_cost(self, obj):
         return float(obj.get_total_items_cost())
@@ -361,64 +458,68 @@ class CollectionOrderSerializer(serializers.ModelSerializer):
         return float(obj.get_total_cost())
     
     def get_join_url(self, obj):
-        request = self.context.get('request')
-        # Prefer request host over FRONTEND_URL to get actual host
-        if request:
-            scheme = request.scheme
-            host = request.get_host()
-            # Replace backend port with frontend port if needed
-            if ':19992' in host:
-                host = host.replace(':19992', ':19991')
-            elif ':8000' in host:
-                host = host.replace(':8000', ':19991')
-            # Always use request host, even if it's localhost (for development)
-            # In production, this will be the actual domain
-            if host:
-                return f"{scheme}://{host}/join/{obj.code}"
-        
-        # Fallback to FRONTEND_URL if no request available
-        frontend_url = getattr(settings, 'FRONTEND_URL', None)
-        if frontend_url:
-            return f"{frontend_url}/join/{obj.code}"
-        
-        return f'/join/{obj.code}'
+        return build_join_url(obj.code, self.context.get('request'))
     
     def get_share_message(self, obj):
-        request = self.context.get('request')
-        # Format cutoff time in GMT+2 (Egypt timezone)
-        if obj.cutoff_time:
-            utc_time = obj.cutoff_time
-            if tz.is_aware(utc_time):
-                # Convert to Egypt timezone (GMT+2)
-                try:
-                    import pytz
-                    egypt_tz = pytz.timezone('Africa/Cairo')
-                    cutoff_local = utc_time.astimezone(egypt_tz)
-                    cutoff_str = cutoff_local.strftime('%I:%M %p')
-                except (ImportError, Exception):
-                    # Fallback: add 2 hours manually if pytz not available
-                    cutoff_local = utc_time + timedelta(hours=2)
-                    cutoff_str = cutoff_local.strftime('%I:%M %p')
-            else:
-                # If naive, assume it's UTC and add 2 hours
-                cutoff_local = utc_time + timedelta(hours=2)
-                cutoff_str = cutoff_local.strftime('%I:%M %p')
-        else:
-            cutoff_str = 'N/A'
-        
-        join_url = self.get_join_url(obj)
-        message = (f"🍽️ OrderQ: Order from {obj.restaurant.name}\n"
-                  f"📋 Join code: {obj.code}\n"
-                  f"⏰ Cutoff: {cutoff_str}\n"
-                  f"🔗 Add your items here: {join_url}\n"
-                  f"👤 Collector: {obj.collector.username}")
-        
-        # Add assigned users info if any
-        if obj.assigned_users.exists():
-            assigned_names = ', '.join([u.username for u in obj.assigned_users.all()])
-            message += f"\n👥 Assigned to: {assigned_names}"
-        
-        return message
+        return build_share_message(
+            restaurant_name=obj.restaurant.name,
+            code=obj.code,
+            cutoff_time=obj.cutoff_time,
+            join_url=self.get_join_url(obj),
+            collector_name=obj.collector.username,
+            assigned_names=[u.username for u in obj.assigned_users.all()],
+        )
+
+
+def annotate_order_summary(queryset, fields=None):
+    """
+    Add what CollectionOrderSummarySerializer reads, so a page of orders takes
+    a fixed number of queries: the page and its assigned users. With `fields`
+    (see sparse_fieldset) only the joins those fields need are added.
+    """
+    if fields is None:
+        fields = CollectionOrderSummarySerializer.Meta.fields
+    related = [
+        relation for name, relation in (
+            ('restaurant_name', 'restaurant'), ('menu_name', 'menu'), ('collector_name', 'collector'),
+        ) if name in fields
+    ]
+    if related:
+        queryset = queryset.select_related(*related)
+    if 'assigned_users' in fields:
+        queryset = queryset.prefetch_related('assigned_users')
+    return queryset
+
+
+class CollectionOrderSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Order list rows. Counts and totals are the order's running totals;
+    items, participants, payments and the share message are left to the
+    detail endpoint.
+    """
+    restaurant_name = serializers.CharField(source='restaurant.name', read_only=True)
+    menu_name = serializers.CharField(source='menu.name', read_only=True, allow_null=True)
+    collector_name = serializers.CharField(source='collector.username', read_only=True)
+    total_items_cost = serializers.SerializerMethodField()
+    total_cost = serializers.SerializerMethodField()
+    join_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = CollectionOrder
+        fields = ['id', 'code', 'restaurant', 'restaurant_name', 'menu', 'menu_name', 'collector', 'collector_name',
+                  'status', 'cutoff_time', 'is_private', 'assigned_users',
+                  'delivery_fee', 'tip', 'service_fee', 'fee_split_rule', 'created_at', 'locked_at', 'ordered_at', 'closed_at',
+                  'item_count', 'participant_count', 'total_items_cost', 'total_cost', 'join_url', 'version']
+        read_only_fields = fields
+    
+    def get_total_items_cost(self, obj):
+        return float(obj.get_total_items_cost())
+    
+    def get_total_cost(self, obj):
+        return float(obj.get_total_cost())
+    
+    def get_join_url(self, obj):
+        return build_join_url(obj.code, self.context.get('request'))
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -444,7 +545,7 @@ class AuditLogSerializer(serializers.ModelSerializer):
 class RecommendationSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     category_display = serializers.CharField(source='get_category_display', read_only=True)
-
+    
     class Meta:
         model = Recommendation
         fields = ['id', 'user', 'user_name', 'category', 'category_display', 'title', 'text', 'created_at']
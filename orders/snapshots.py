@@ -0,0 +1,152 @@
+"""
+Versioned cache of serialized order snapshots.
+
+The full CollectionOrderSerializer payload is cached under (order_id, version).
+Every write that changes an order bumps its version, so stale entries are never
+read again and simply expire. One serialization then serves the WebSocket
+broadcast, every WebSocket connect and every REST read of that version.
+
+Cached snapshots are request-independent; `apply_request_fields` fills in the
+few fields that depend on the request host and applies ?fields= / ?omit=.
+"""
+import asyncio
+import logging
+from datetime import timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_datetime
+from . import fastjson, metrics, sql_snapshots
+from .async_db import aclose_old_connections
+from .models import CollectionOrder, OrderItem, Payment, User
+from .serializers import CollectionOrderSerializer, build_join_url, build_share_message, sparse_fieldset
+
+logger = logging.getLogger(__name__)
+
+# (order_id, version) -> task serializing it for aget_order_snapshot()
+_serializing = {}
+
+
+def snapshot_cache_key(order_id, version):
+    return f'order_snapshot:{order_id}:{version}'
+
+
+def serialize_order(order_id):
+    """Fetch the order with all related data and return the full snapshot payload"""
+    if sql_snapshots.available():
+        return fastjson.loads(sql_snapshots.order_document(order_id))
+    return serializer_snapshot(order_id)
+
+
+def serializer_snapshot(order_id):
+    """The snapshot payload from CollectionOrderSerializer"""
+    order = CollectionOrder.objects.prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('user', 'menu_item').order_by('-created_at')),
+        Prefetch('payments', queryset=Payment.objects.select_related('user').order_by('-created_at')),
+        Prefetch('assigned_users', queryset=User.objects.order_by('id'))
+    ).select_related('restaurant', 'menu', 'collector').get(id=order_id)
+    
+    # Serialized without request context; see apply_request_fields
+    data = CollectionOrderSerializer(order).data
+    # Plain JSON types so the snapshot can be cached and sent as-is
+    return fastjson.loads(fastjson.dumps(data, default=DjangoJSONEncoder().default))
+
+
+def get_order_snapshot(order_id, version=None):
+    """
+    Return the serialized order, from cache when this version was already serialized.
+    Raises CollectionOrder.DoesNotExist if the order is gone.
+    """
+    if version is None:
+        version = CollectionOrder.objects.filter(id=order_id).values_list('version', flat=True).get()
+    
+    try:
+        data = cache.get(snapshot_cache_key(order_id, version))
+    except Exception:
+        logger.warning('Order snapshot cache unavailable', exc_info=True)
+        data = None
+    if data is not None:
+        metrics.incr('order_snapshot_cache_hit')
+        return data
+    
+    metrics.incr('order_snapshot_cache_miss')
+    data = serialize_order(order_id)
+    # The order may have moved on while we were reading it; cache under what we actually read
+    key = snapshot_cache_key(order_id, data['version'])
+    
+    def store():
+        try:
+            cache.set(key, data, settings.ORDER_SNAPSHOT_CACHE_TIMEOUT)
+        except Exception:
+            logger.warning('Order snapshot cache unavailable', exc_info=True)
+    
+    # A version read inside an open transaction may still be rolled back and reused
+    transaction.on_commit(store)
+    return data
+
+
+async def aget_order_snapshot(order_id, version=None):
+    """
+    Async get_order_snapshot() for consumers, on Django's async ORM and cache APIs.
+    Only a cache miss runs the (synchronous) serializer. Stale connections are
+    closed before database reads (see async_db).
+    Raises CollectionOrder.DoesNotExist if the order is gone.
+    """
+    if version is None:
+        await aclose_old_connections()
+        version = await CollectionOrder.objects.filter(id=order_id).values_list('version', flat=True).aget()
+    
+    try:
+        data = await cache.aget(snapshot_cache_key(order_id, version))
+    except Exception:
+        logger.warning('Order snapshot cache unavailable', exc_info=True)
+        data = None
+    if data is not None:
+        metrics.incr('order_snapshot_cache_hit')
+        return data
+    
+    metrics.incr('order_snapshot_cache_miss')
+    # Connects that miss the same version together share one serialization
+    task = _serializing.get((order_id, version))
+    if task is None:
+        task = asyncio.ensure_future(_aserialize_order(order_id))
+        _serializing[(order_id, version)] = task
+        task.add_done_callback(lambda _: _serializing.pop((order_id, version), None))
+    return await asyncio.shield(task)
+
+
+async def _aserialize_order(order_id):
+    await aclose_old_connections()
+    data = await sync_to_async(serialize_order)(order_id)
+    # Consumers never hold a transaction open, so the version read is committed
+    try:
+        await cache.aset(snapshot_cache_key(order_id, data['version']), data, settings.ORDER_SNAPSHOT_CACHE_TIMEOUT)
+    except Exception:
+        logger.warning('Order snapshot cache unavailable', exc_info=True)
+    return data
+
+
+def apply_request_fields(snapshot, request):
+    """
+    Return a copy of a cached snapshot with the request-dependent fields filled in,
+    trimmed to the request's ?fields= / ?omit= (see serializers.sparse_fieldset)
+    """
+    data = {name: snapshot[name] for name in sparse_fieldset(request, snapshot)}
+    if data.get('collector_instapay_qr_code_url'):
+        data['collector_instapay_qr_code_url'] = request.build_absolute_uri(data['collector_instapay_qr_code_url'])
+    join_url = build_join_url(snapshot['code'], request)
+    if 'join_url' in data:
+        data['join_url'] = join_url
+    if 'share_message' in data:
+        data['share_message'] = build_share_message(
+            restaurant_name=snapshot['restaurant_name'],
+            code=snapshot['code'],
+            cutoff_time=parse_datetime(snapshot['cutoff_time']).astimezone(timezone.utc) if snapshot['cutoff_time'] else None,
+            join_url=join_url,
+            collector_name=snapshot['collector_name'],
+            assigned_names=[u['username'] for u in snapshot['assigned_users_details']],
+        )
+    return data
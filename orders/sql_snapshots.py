@@ -0,0 +1,174 @@
+"""
+Order snapshots built by Postgres.
+
+`order_document(order_id)` returns the same JSON document as
+CollectionOrderSerializer, as bytes, from a single query: the order row is
+joined to its restaurant, menu and collector, and the items, payments,
+participants and assigned users are nested with json_agg() subqueries. This
+replaces five queries and DRF's field-by-field serialization on snapshot
+cache misses when ORDER_SNAPSHOT_BACKEND is 'postgres'.
+
+Formatting follows the serializer: decimals as two-place strings, totals as
+numbers, datetimes in ISO 8601 in the current time zone ('Z' for UTC) and
+payment times in UTC. The share message and join URL are built in Python
+and appended to the document. Participants and assigned users are ordered
+by id, as serializer_snapshot() prefetches them. The QR code URL assumes
+media is served from MEDIA_URL (FileSystemStorage).
+"""
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from . import fastjson
+from .models import CollectionOrder, Menu, MenuItem, OrderItem, Payment, Restaurant, User
+from .serializers import build_join_url, build_share_message
+
+AssignedUser = CollectionOrder.assigned_users.through
+
+
+def available():
+    """Whether snapshots should be built by order_document()"""
+    return settings.ORDER_SNAPSHOT_BACKEND == 'postgres' and connection.vendor == 'postgresql'
+
+
+def _iso(column, utc=False):
+    """SQL formatting a timestamptz like DRF's DateTimeField, or like datetime.isoformat() in UTC"""
+    if utc:
+        local, offset = f"({column} AT TIME ZONE 'UTC')", "'+00:00'"
+    else:
+        local = f"({column} AT TIME ZONE %(tz)s)"
+        shift = f"({local} - ({column} AT TIME ZONE 'UTC'))"
+        offset = f"""CASE WHEN {shift} = interval '0' THEN 'Z'
+            WHEN {shift} < interval '0' THEN '-' || to_char(-{shift}, 'HH24:MI')
+            ELSE '+' || to_char({shift}, 'HH24:MI') END"""
+    return f"""CASE WHEN {column} IS NULL THEN NULL ELSE
+        to_char({local}, 'YYYY-MM-DD"T"HH24:MI:SS')
+        || CASE WHEN to_char({local}, 'US') = '000000' THEN '' ELSE to_char({local}, '.US') END
+        || {offset} END"""
+
+
+def _user(alias):
+    return f"json_build_object('id', {alias}.id, 'username', {alias}.username, 'email', {alias}.email)"
+
+
+def _document_sql():
+    return f"""
+        SELECT json_build_object(
+            'id', o.id,
+            'code', o.code,
+            'restaurant', o.restaurant_id,
+            'restaurant_name', r.name,
+            'menu', o.menu_id,
+            'menu_name', m.name,
+            'menu_snapshot', o.menu_snapshot_id,
+            'collector', o.collector_id,
+            'collector_name', c.username,
+            'collector_instapay_link', c.instapay_link,
+            'collector_instapay_qr_code_url', CASE WHEN c.instapay_qr_code <> '' THEN %(media_url)s || c.instapay_qr_code END,
+            'status', o.status,
+            'cutoff_time', {_iso('o.cutoff_time')},
+            'instapay_link', o.instapay_link,
+            'is_private', o.is_private,
+            'assigned_users', COALESCE((
+                SELECT json_agg(a.user_id ORDER BY a.user_id)
+                FROM {AssignedUser._meta.db_table} a WHERE a.collectionorder_id = o.id
+            ), '[]'),
+            'assigned_users_details', COALESCE((
+                SELECT json_agg({_user('u')} ORDER BY u.id)
+                FROM {AssignedUser._meta.db_table} a JOIN {User._meta.db_table} u ON u.id = a.user_id
+                WHERE a.collectionorder_id = o.id
+            ), '[]'),
+            'delivery_fee', o.delivery_fee::text,
+            'tip', o.tip::text,
+            'service_fee', o.service_fee::text,
+            'fee_split_rule', o.fee_split_rule,
+            'created_at', {_iso('o.created_at')},
+            'locked_at', {_iso('o.locked_at')},
+            'ordered_at', {_iso('o.ordered_at')},
+            'closed_at', {_iso('o.closed_at')},
+            'items', COALESCE((
+                SELECT json_agg(json_build_object(
+                    'id', i.id,
+                    'order', i.order_id,
+                    'user', i.user_id,
+                    'user_name', iu.username,
+                    'menu_item', i.menu_item_id,
+                    'custom_name', i.custom_name,
+                    'custom_price', i.custom_price::text,
+                    'quantity', i.quantity,
+                    'unit_price', i.unit_price::text,
+                    'total_price', i.total_price::text,
+                    'item_name', CASE WHEN i.menu_item_id IS NOT NULL THEN mi.name ELSE i.custom_name END,
+                    'note', i.note,
+                    'created_at', {_iso('i.created_at')},
+                    'existing_menu_item_id', NULL
+                ) ORDER BY i.created_at DESC)
+                FROM {OrderItem._meta.db_table} i
+                JOIN {User._meta.db_table} iu ON iu.id = i.user_id
+                LEFT JOIN {MenuItem._meta.db_table} mi ON mi.id = i.menu_item_id
+                WHERE i.order_id = o.id
+            ), '[]'),
+            'participants', COALESCE((
+                SELECT json_agg({_user('pu')} ORDER BY pu.id)
+                FROM {User._meta.db_table} pu
+                WHERE EXISTS (SELECT 1 FROM {OrderItem._meta.db_table} pi WHERE pi.order_id = o.id AND pi.user_id = pu.id)
+            ), '[]'),
+            'payments', COALESCE((
+                SELECT json_agg(json_build_object(
+                    'id', p.id,
+                    'user', p.user_id,
+                    'user_name', pu.username,
+                    'amount', p.amount::float8,
+                    'is_paid', p.is_paid,
+                    'paid_at', {_iso('p.paid_at', utc=True)}
+                ) ORDER BY p.created_at DESC)
+                FROM {Payment._meta.db_table} p JOIN {User._meta.db_table} pu ON pu.id = p.user_id
+                WHERE p.order_id = o.id
+            ), '[]'),
+            'total_items_cost', o.items_total::float8,
+            'total_cost', (o.items_total + o.delivery_fee + o.tip + o.service_fee)::float8,
+            'version', o.version
+        )::text,
+        o.code, r.name, o.cutoff_time, c.username, (
+            SELECT array_agg(u.username ORDER BY u.id)
+            FROM {AssignedUser._meta.db_table} a JOIN {User._meta.db_table} u ON u.id = a.user_id
+            WHERE a.collectionorder_id = o.id
+        )
+        FROM {CollectionOrder._meta.db_table} o
+        JOIN {Restaurant._meta.db_table} r ON r.id = o.restaurant_id
+        LEFT JOIN {Menu._meta.db_table} m ON m.id = o.menu_id
+        JOIN {User._meta.db_table} c ON c.id = o.collector_id
+        WHERE o.id = %(order_id)s
+    """
+
+
+DOCUMENT_SQL = _document_sql()
+
+
+def order_document(order_id):
+    """
+    Return the order's snapshot as JSON bytes, in one query.
+    Raises CollectionOrder.DoesNotExist if the order is gone.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DOCUMENT_SQL, {
+            'order_id': order_id,
+            'tz': timezone.get_current_timezone_name(),
+            'media_url': settings.MEDIA_URL,
+        })
+        row = cursor.fetchone()
+    if row is None:
+        raise CollectionOrder.DoesNotExist(f'CollectionOrder {order_id} does not exist')
+    
+    document, code, restaurant_name, cutoff_time, collector_name, assigned_names = row
+    # Request-independent, like the serializer without a request; see snapshots.apply_request_fields
+    join_url = build_join_url(code)
+    share_message = build_share_message(
+        restaurant_name=restaurant_name,
+        code=code,
+        cutoff_time=cutoff_time,
+        join_url=join_url,
+        collector_name=collector_name,
+        assigned_names=assigned_names or [],
+    )
+    extra = fastjson.dumps({'share_message': share_message, 'join_url': join_url})
+    return document[:-1].encode() + b', ' + extra[1:]
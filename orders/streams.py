@@ -0,0 +1,199 @@
+"""
+HTTP fallbacks for order updates, for clients whose network blocks WebSockets.
+
+- `GET /api/orders/{id}/events/` is a Server-Sent Events stream: the order on
+  connect, then an `order_update` event with the full order on every change.
+  Event ids are order versions, so a client reconnecting with Last-Event-ID
+  skips the first event if it already has that version.
+- `GET /api/orders/{id}/poll/?wait_for_version=N` returns the order as soon as
+  its version is at least N, or 204 after ORDER_LONG_POLL_TIMEOUT seconds.
+
+Both wait on the channel-layer groups snapshot WebSocket clients listen on, so
+a waiting client is an idle coroutine and payloads come from the broadcast the
+relay already serialized. When the order's access rules change the user's
+access is checked again: streams follow their new audience, or end.
+Authenticate with `Authorization: Bearer <jwt>` or `?token=<jwt>`
+(EventSource cannot set headers).
+"""
+import asyncio
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.exceptions import InvalidToken
+from . import fastjson, metrics
+from .access import aget_order_access
+from .async_db import aclose_old_connections
+from .middleware import user_from_token
+from .models import CollectionOrder
+from .projections import PARTICIPANT, VIEWER, audience_for, mentions_user, project_order
+from .snapshots import aget_order_snapshot, apply_request_fields
+from .websocket_utils import order_group_name
+
+
+class OrderListener:
+    """A channel in an order's snapshot group for one audience"""
+    
+    def __init__(self, order_id, audience):
+        self.order_id = order_id
+        self.audience = audience
+        self.channel_layer = get_channel_layer()
+    
+    async def __aenter__(self):
+        self.channel = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(order_group_name(self.order_id, self.audience), self.channel)
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.channel_layer.group_discard(order_group_name(self.order_id, self.audience), self.channel)
+    
+    async def switch(self, audience):
+        await self.channel_layer.group_discard(order_group_name(self.order_id, self.audience), self.channel)
+        self.audience = audience
+        await self.channel_layer.group_add(order_group_name(self.order_id, self.audience), self.channel)
+    
+    async def receive(self, timeout):
+        """The next order_update message, or None after `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.channel_layer.receive(self.channel), max(timeout, 0))
+        except asyncio.TimeoutError:
+            return None
+
+
+async def authorize(request, order_id):
+    """Return (user, OrderAccess), or an error response"""
+    header = request.headers.get('Authorization', '')
+    token = header[7:] if header.startswith('Bearer ') else request.GET.get('token')
+    if not token:
+        return None, JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    try:
+        user = await user_from_token(token)
+    except InvalidToken:
+        return None, JsonResponse({'detail': 'Given token not valid for any token type'}, status=401)
+    access = await aget_order_access(user, order_id)
+    if access is None or not access.can_view:
+        return None, JsonResponse({'detail': 'No CollectionOrder matches the given query.'}, status=404)
+    return user, access
+
+
+async def get_order_data(order_id):
+    try:
+        return await aget_order_snapshot(order_id)
+    except CollectionOrder.DoesNotExist:
+        return None
+
+
+async def joined_order_data(listener, user, message):
+    """
+    Order payload for a group message. A viewer the message shows joining the
+    order moves to the participant projection.
+    """
+    if listener.audience == VIEWER and mentions_user(message, user.id):
+        await listener.switch(PARTICIPANT)
+        order_data = await get_order_data(listener.order_id)
+        return project_order(order_data, PARTICIPANT) if order_data else None
+    return message['order']
+
+
+async def follow_access(listener, user):
+    """
+    After an order_access_changed message: move to the user's current audience.
+    Returns False if they can no longer see the order.
+    """
+    access = await aget_order_access(user, listener.order_id)
+    if access is None or not access.can_view:
+        metrics.incr('order_access_revoked')
+        return False
+    if audience_for(access) != listener.audience:
+        await listener.switch(audience_for(access))
+    return True
+
+
+@require_GET
+async def order_events(request, order_id):
+    user, access = await authorize(request, order_id)
+    if user is None:
+        return access
+    
+    response = StreamingHttpResponse(
+        event_stream(request, user, order_id, audience_for(access), request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def event_stream(request, user, order_id, audience, last_event_id):
+    metrics.incr('order_sse_opened')
+    async with OrderListener(order_id, audience) as listener:
+        # Subscribed before reading, so no change can fall in between
+        order_data = await get_order_data(order_id)
+        if order_data is None:
+            return
+        version = order_data['version']
+        if str(version) != last_event_id:
+            yield sse_event(request, project_order(order_data, audience))
+        
+        while True:
+            message = await listener.receive(settings.ORDER_SSE_KEEPALIVE)
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+            if message['type'] == 'order_access_changed':
+                if not await follow_access(listener, user):
+                    return
+                continue
+            order_data = await joined_order_data(listener, user, message)
+            # A broadcast already in flight when the stream opened may be older than what was sent
+            if order_data is None or order_data['version'] <= version:
+                continue
+            version = order_data['version']
+            yield sse_event(request, order_data)
+
+
+def sse_event(request, order_data):
+    data = fastjson.dumps(apply_request_fields(order_data, request)).decode()
+    return f"id: {order_data['version']}\nevent: order_update\ndata: {data}\n\n"
+
+
+@require_GET
+async def order_poll(request, order_id):
+    user, access = await authorize(request, order_id)
+    if user is None:
+        return access
+    try:
+        wait_for_version = int(request.GET.get('wait_for_version', 0))
+    except ValueError:
+        return JsonResponse({'wait_for_version': ['A valid integer is required.']}, status=400)
+    
+    audience = audience_for(access)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.ORDER_LONG_POLL_TIMEOUT
+    async with OrderListener(order_id, audience) as listener:
+        await aclose_old_connections()
+        version = await CollectionOrder.objects.filter(id=order_id).values_list('version', flat=True).afirst()
+        if version is None:
+            return JsonResponse({'detail': 'No CollectionOrder matches the given query.'}, status=404)
+        
+        if version >= wait_for_version:
+            order_data = await get_order_data(order_id)
+            if order_data is None:
+                return JsonResponse({'detail': 'No CollectionOrder matches the given query.'}, status=404)
+            order_data = project_order(order_data, audience)
+        else:
+            order_data = None
+            while order_data is None or order_data['version'] < wait_for_version:
+                message = await listener.receive(deadline - loop.time())
+                if message is None:
+                    metrics.incr('order_long_poll_timeout')
+                    return HttpResponse(status=204, headers={'X-Order-Version': version})
+                if message['type'] == 'order_access_changed':
+                    if not await follow_access(listener, user):
+                        return JsonResponse({'detail': 'No CollectionOrder matches the given query.'}, status=404)
+                    continue
+                order_data = await joined_order_data(listener, user, message)
+            metrics.incr('order_long_poll_woken')
+    
+    return JsonResponse(apply_request_fields(order_data, request))
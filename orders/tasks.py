@@ -1,5 +1,5 @@
 """
-Celery tasks for menu syncing.
+Celery tasks for menu syncing and order upkeep.
 """
 from celery import shared_task
 from django.core.management import call_command
@@ -32,3 +32,18 @@ def sync_talabat_menus_task(restaurant_name=None):
         logger.error(f'Talabat menu sync task failed: {e}', exc_info=True)
         return {'status': 'error', 'error': str(e), 'timestamp': timezone.now().isoformat()}
 
+
+@shared_task(name='verify_order_totals')
+def verify_order_totals_task(days=None):
+    """Recount orders whose running totals differ from their items."""
+    command_args = ['--days', str(days)] if days is not None else []
+    call_command('verify_order_totals', *command_args)
+    return {'status': 'success', 'timestamp': timezone.now().isoformat()}
+
+
+@shared_task(name='compact_menu_snapshots')
+def compact_menu_snapshots_task(days=None):
+    """Delete old menu snapshots that no order pins."""
+    command_args = ['--days', str(days)] if days is not None else []
+    call_command('compact_menu_snapshots', *command_args)
+    return {'status': 'success', 'timestamp': timezone.now().isoformat()}
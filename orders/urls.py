@@ -4,8 +4,10 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UserViewSet, LoginView, RegisterView, RestaurantViewSet, MenuViewSet,
     MenuItemViewSet, CollectionOrderViewSet, OrderItemViewSet,
-    PaymentViewSet, AuditLogViewSet, FeePresetViewSet, RecommendationViewSet
+    PaymentViewSet, AuditLogViewSet, FeePresetViewSet, RecommendationViewSet,
+    MetricsView, CatalogView
 )
+from .streams import order_events, order_poll
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -20,9 +22,13 @@ router.register(r'fee-presets', FeePresetViewSet, basename='feepreset')
 router.register(r'recommendations', RecommendationViewSet, basename='recommendation')
 
 urlpatterns = [
+    path('orders/<int:order_id>/events/', order_events, name='order-events'),
+    path('orders/<int:order_id>/poll/', order_poll, name='order-poll'),
     path('', include(router.urls)),
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', LoginView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('catalog/', CatalogView.as_view(), name='catalog'),
 ]
 
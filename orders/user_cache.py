@@ -0,0 +1,174 @@
+"""
+Cache of the users behind JWTs.
+
+REST requests and WebSocket connects resolve their token's user through
+`get_user` (`aget_user` in async code) instead of querying the database each time:
+
+- Each process keeps recently seen users in an LRU and trusts an entry for
+  AUTH_USER_CACHE_TTL seconds.
+- After that the entry is revalidated against the shared (Redis) cache, which
+  holds each user's current auth version (`auth_version:{user_id}`) and the
+  user's fields per version (`auth_user:{user_id}:{auth_version}`).
+- Only a miss in both reads the database.
+
+User.save() bumps auth_version when role, password or active status change
+and publishes it on commit; other saves drop the published version so the
+next miss re-reads the user. Either way other processes see the change
+within the TTL, and the process making the change immediately.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from . import metrics
+from .async_db import aclose_old_connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# user_id -> (expires_at, auth_version, field values)
+_local = OrderedDict()
+
+
+def version_key(user_id):
+    return f'auth_version:{user_id}'
+
+
+def user_key(user_id, auth_version):
+    return f'auth_user:{user_id}:{auth_version}'
+
+
+def _field_names():
+    return [f.attname for f in get_user_model()._meta.concrete_fields]
+
+
+def _build(values):
+    # A fresh instance per request; cached state is never shared or mutated
+    User = get_user_model()
+    return User.from_db(User.objects.db, _field_names(), values)
+
+
+def _local_get(user_id, now):
+    """The user's field values if the local entry is fresh, else None"""
+    with _lock:
+        entry = _local.get(user_id)
+        if entry is not None and entry[0] > now:
+            _local.move_to_end(user_id)
+            metrics.incr('auth_user_cache_hit')
+            return entry[2]
+    return None
+
+
+def _remember(user_id, now, auth_version, values):
+    with _lock:
+        _local[user_id] = (now + settings.AUTH_USER_CACHE_TTL, auth_version, values)
+        _local.move_to_end(user_id)
+        while len(_local) > settings.AUTH_USER_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get_user(user_id):
+    """Return the user with this id. Raises User.DoesNotExist."""
+    now = time.monotonic()
+    values = _local_get(user_id, now)
+    if values is not None:
+        return _build(values)
+    
+    values = auth_version = None
+    try:
+        auth_version = cache.get(version_key(user_id))
+        if auth_version is not None:
+            # Always re-read: profile edits refresh the fields without bumping auth_version
+            values = cache.get(user_key(user_id, auth_version))
+    except Exception:
+        logger.warning('User cache unavailable', exc_info=True)
+    
+    if values is not None:
+        metrics.incr('auth_user_cache_shared_hit')
+    else:
+        metrics.incr('auth_user_cache_miss')
+        user = get_user_model().objects.get(pk=user_id)
+        values = tuple(getattr(user, name) for name in _field_names())
+        _store_shared(user_id, auth_version, user.auth_version, values)
+        auth_version = user.auth_version
+    
+    _remember(user_id, now, auth_version, values)
+    return _build(values)
+
+
+async def aget_user(user_id):
+    """
+    Async get_user(), on Django's async cache and ORM APIs. A fresh local
+    entry is returned without leaving the event loop; a database read closes
+    stale connections first (see async_db).
+    """
+    now = time.monotonic()
+    values = _local_get(user_id, now)
+    if values is not None:
+        return _build(values)
+    
+    values = auth_version = None
+    try:
+        auth_version = await cache.aget(version_key(user_id))
+        if auth_version is not None:
+            values = await cache.aget(user_key(user_id, auth_version))
+    except Exception:
+        logger.warning('User cache unavailable', exc_info=True)
+    
+    if values is not None:
+        metrics.incr('auth_user_cache_shared_hit')
+    else:
+        metrics.incr('auth_user_cache_miss')
+        await aclose_old_connections()
+        user = await get_user_model().objects.aget(pk=user_id)
+        values = tuple(getattr(user, name) for name in _field_names())
+        await _astore_shared(user_id, auth_version, user.auth_version, values)
+        auth_version = user.auth_version
+    
+    _remember(user_id, now, auth_version, values)
+    return _build(values)
+
+
+def _store_shared(user_id, shared_version, loaded_version, values):
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    try:
+        if shared_version is None:
+            # add(), not set(): never overwrite a version published by a concurrent bump
+            cache.add(version_key(user_id), loaded_version, timeout)
+            shared_version = loaded_version
+        # A mismatch means a bump is in flight; its commit publishes the new version
+        if shared_version == loaded_version:
+            cache.set(user_key(user_id, loaded_version), values, timeout)
+    except Exception:
+        logger.warning('User cache unavailable', exc_info=True)
+
+
+async def _astore_shared(user_id, shared_version, loaded_version, values):
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    try:
+        if shared_version is None:
+            await cache.aadd(version_key(user_id), loaded_version, timeout)
+            shared_version = loaded_version
+        if shared_version == loaded_version:
+            await cache.aset(user_key(user_id, loaded_version), values, timeout)
+    except Exception:
+        logger.warning('User cache unavailable', exc_info=True)
+
+
+def invalidate_user(user_id, auth_version=None):
+    """
+    Drop cached state for a user after a committed change.
+    Pass the new auth_version after a bump; without it the user is re-read on next use.
+    """
+    with _lock:
+        _local.pop(user_id, None)
+    try:
+        if auth_version is not None:
+            cache.set(version_key(user_id), auth_version, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            cache.delete(version_key(user_id))
+    except Exception:
+        logger.warning('User cache unavailable', exc_info=True)
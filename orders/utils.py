@@ -18,3 +18,12 @@ def format_item_name(name):
     # Join with single space
     return ' '.join(formatted_words)
 
+
+def normalize_item_name(name):
+    """
+    Lookup key for an item name, stored as MenuItem.normalized_name.
+    Whitespace is collapsed as in format_item_name and the result case-folded,
+    so names that format alike have the same key. Case folding can make the
+    key up to three times longer than the name ('ß' becomes 'ss').
+    """
+    return ' '.join((name or '').split()).casefold()
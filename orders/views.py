@@ -14,11 +14,19 @@ from .models import (
 from .serializers import (
     UserSerializer, UserRegistrationSerializer, LoginSerializer, ChangePasswordSerializer,
     RestaurantSerializer, MenuSerializer, MenuItemSerializer, CollectionOrderSerializer,
-    OrderItemSerializer, PaymentSerializer, AuditLogSerializer, FeePresetSerializer,
+    CollectionOrderSummarySerializer, annotate_order_summary, sparse_fieldset, OrderItemSerializer, PaymentSerializer, AuditLogSerializer, FeePresetSerializer,
     RecommendationSerializer
 )
-from .utils import format_item_name
-from .websocket_utils import broadcast_order_update
+from .utils import format_item_name, normalize_item_name
+from .snapshots import get_order_snapshot, apply_request_fields
+from .access import annotate_access, filter_visible, get_order_access, OrderAccess
+from .backpressure import connection_lag
+from .projections import audience_for, project_order
+from . import catalog, menu_documents, menu_snapshots, metrics, search
+from .websocket_utils import (
+    broadcast_order_update, broadcast_order_patch, broadcast_order_removal, broadcast_related_change,
+    item_added_patch, item_updated_patch, item_removed_patch, payment_changed_patch, fee_changed_patch
+)
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
@@ -118,6 +126,27 @@ class LoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MetricsView(APIView):
+    """Internal counters (broadcasts, caches) and WebSocket send lag for managers and admins"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        if request.user.role not in ['manager', 'admin']:
+            return Response(
+                {'error': 'Only managers and administrators can view metrics'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response({**metrics.get_counters(), 'websocket_connections': connection_lag()})
+
+
+class CatalogView(APIView):
+    """Offline catalog bundle, full or changes `?since=<catalog_version>` (see orders/catalog.py)"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        return catalog.bundle_response(request)
+
+
 class RegisterView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
@@ -144,9 +173,13 @@ class RestaurantViewSet(viewsets.ModelViewSet):
     serializer_class = RestaurantSerializer
     permission_classes = [IsManagerOrReadOnly]
     
+    def get_queryset(self):
+        # RestaurantSerializer lists each restaurant's menus
+        return Restaurant.objects.prefetch_related('menus')
+    
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
-
+    
     @action(detail=False, methods=['post'])
     def add_from_talabat(self, request):
         """
@@ -247,7 +280,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                         
                         # Refresh menu to get updated data
                         menu.refresh_from_db()
-                        
+                    
                     except Exception as sync_error:
                         # If sync fails, still return the restaurant/menu but with a warning
                         return Response(
@@ -268,7 +301,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                     },
                     status=status.HTTP_201_CREATED
                 )
-                
+        
         except Exception as e:
             return Response(
                 {'error': f'Failed to create restaurant: {str(e)}'}, 
@@ -326,7 +359,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_200_OK
             )
-            
+        
         except Exception as e:
             return Response(
                 {'error': f'Failed to sync menu: {str(e)}'}, 
@@ -347,6 +380,30 @@ class MenuViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save()
+    
+    @action(detail=True, methods=['get'])
+    def document(self, request, pk=None):
+        """
+        The menu and its items grouped by section, pre-rendered and compressed.
+        Revalidate with If-None-Match; see orders/menu_documents.py.
+        """
+        # The published version answers revalidations and cache hits without the database
+        version = menu_documents.cached_version(int(pk)) if pk.isdigit() else None
+        if version is not None:
+            response = menu_documents.not_modified(request, int(pk), version)
+            if response is not None:
+                return response
+            document = menu_documents.cached_document(int(pk), version)
+            if document is not None:
+                return menu_documents.document_response(request, int(pk), version, document)
+        
+        menu = self.get_object()
+        version = (menu.menu_hash, menu.edit_version)
+        menu_documents.remember_version(menu.id, version)
+        response = menu_documents.not_modified(request, menu.id, version)
+        if response is not None:
+            return response
+        return menu_documents.document_response(request, menu.id, version, menu_documents.get_document(menu))
 
 
 class MenuItemViewSet(viewsets.ModelViewSet):
@@ -359,6 +416,8 @@ class MenuItemViewSet(viewsets.ModelViewSet):
         menu_id = self.request.query_params.get('menu')
         restaurant_id = self.request.query_params.get('restaurant')
         queryset = MenuItem.objects.all()
+        if 'menu_name' in sparse_fieldset(self.request, MenuItemSerializer.Meta.fields):
+            queryset = queryset.select_related('menu')
         
         if menu_id:
             queryset = queryset.filter(menu_id=menu_id)
@@ -369,6 +428,22 @@ class MenuItemViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save()
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Available items matching ?q= by word prefix or with typos, best first (see orders/search.py)"""
+        query = request.query_params.get('q', '')
+        restaurant_id = request.query_params.get('restaurant')
+        limit = request.query_params.get('limit', '')
+        return Response(search.search(
+            query,
+            restaurant_id=int(restaurant_id) if restaurant_id and restaurant_id.isdigit() else None,
+            limit=min(int(limit), 100) if limit.isdigit() else 20,
+        ))
+
+
+# Fields the order list can be sorted by with ?ordering=, prefixed with '-' for descending
+ORDER_LIST_ORDERINGS = ('created_at', 'items_total', 'item_count', 'participant_count')
 
 
 class CollectionOrderViewSet(viewsets.ModelViewSet):
@@ -384,23 +459,63 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
+        if self.action == 'list':
+            queryset = annotate_order_summary(
+                queryset, sparse_fieldset(self.request, CollectionOrderSummarySerializer.Meta.fields)
+            )
+            min_items = self.request.query_params.get('min_items')
+            if min_items and min_items.isdigit():
+                queryset = queryset.filter(item_count__gte=int(min_items))
+            ordering = self.request.query_params.get('ordering')
+            if ordering and ordering.lstrip('-') in ORDER_LIST_ORDERINGS:
+                queryset = queryset.order_by(ordering, '-created_at')
+        
         # Show public orders to everyone, private orders only to participants/managers
         # Also show orders where user is assigned
-        if user.role != 'manager':
-            queryset = queryset.filter(
-                Q(is_private=False) |  # Public orders
-                Q(collector=user) |    # Orders I collected
-                Q(items__user=user) |  # Orders I'm participating in
-                Q(assigned_users=user) # Orders I'm assigned to
-            ).distinct()
-        
-        return queryset
+        return filter_visible(queryset, user)
+    
+    def get_serializer_class(self):
+        # List rows are summaries; retrieve returns the full order snapshot
+        if self.action == 'list':
+            return CollectionOrderSummarySerializer
+        return CollectionOrderSerializer
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
     
+    def order_response(self, request, order, access=None):
+        """The order's cached snapshot as the requesting user may see it, trimmed by ?fields= / ?omit="""
+        data = apply_request_fields(get_order_snapshot(order.id, order.version), request)
+        if access is None:
+            access = get_order_access(request.user, order.id, request)
+        # Same projection the user's WebSocket receives
+        return Response(project_order(data, audience_for(access)))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.order_response(request, self.get_object())
+    
+    @action(detail=True, methods=['get'])
+    def menu(self, request, pk=None):
+        """
+        The menu as it was when the order was created or moved to it, pre-rendered and compressed.
+        Revalidate with If-None-Match; see orders/menu_snapshots.py.
+        """
+        order = self.get_object()
+        if order.menu_id and not order.menu_snapshot_id:
+            # Orders from before snapshots that pin_menu_snapshots has not reached yet
+            # pin the menu's current version on first read
+            with transaction.atomic():
+                order.save(update_fields=['menu_snapshot'])
+                # Cached order snapshots of the current version show no pinned menu
+                broadcast_related_change(CollectionOrder.objects.filter(id=order.id))
+        response = menu_snapshots.snapshot_response(request, order.menu_snapshot_id) if order.menu_snapshot_id else None
+        if response is None:
+            return Response({'error': 'This order has no menu'}, status=status.HTTP_404_NOT_FOUND)
+        return response
+    
+    @transaction.atomic
     def perform_create(self, serializer):
         assigned_users = serializer.validated_data.pop('assigned_users', [])
         order = serializer.save(collector=self.request.user)
@@ -420,7 +535,11 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             action='created',
             details={'restaurant': order.restaurant.name, 'assigned_users': [u.username for u in assigned_users] if assigned_users else None}
         )
+        
+        # Puts the new order on the live board
+        broadcast_order_update(order)
     
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         """Allow updating fees and assigned_users for open orders"""
         instance = self.get_object()
@@ -470,6 +589,8 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
                             order=instance,
                             user__in=assigned_users_data
                         ).delete()
+                        # The bulk delete skips OrderItem.delete(), which keeps the order totals
+                        instance.recount_totals()
                         
                         # Create items for each assigned user
                         for user_id in assigned_users_data:
@@ -501,16 +622,20 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             instance.save()
             # Return updated data with assigned_users
             serializer = self.get_serializer(instance, context={'request': request})
-            # Broadcast order update via WebSocket
-            broadcast_order_update(instance)
+            # Broadcast order update via WebSocket; connected clients re-check their access
+            broadcast_order_update(instance, access_changed=True)
             return Response(serializer.data)
         
         # Broadcast order update via WebSocket (for fee updates, etc.)
         instance.refresh_from_db()
-        broadcast_order_update(instance)
+        if has_fee_update:
+            broadcast_order_patch(instance, fee_changed_patch(instance))
+        else:
+            broadcast_order_update(instance, access_changed='is_private' in request.data)
         
         return response
     
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         order = self.get_object()
         # Only collector or manager can delete
@@ -534,9 +659,11 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             details={'restaurant': order.restaurant.name, 'code': order.code, 'status': order.status}
         )
         
+        broadcast_order_removal(order)
         return super().destroy(request, *args, **kwargs)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def lock(self, request, pk=None):
         order = self.get_object()
         if order.status != 'OPEN':
@@ -575,9 +702,10 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
         # Broadcast order update via WebSocket
         broadcast_order_update(order)
         
-        return Response(CollectionOrderSerializer(order).data)
+        return self.order_response(request, order)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def unlock(self, request, pk=None):
         order = self.get_object()
         if order.status != 'LOCKED':
@@ -610,9 +738,10 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
         # Broadcast order update via WebSocket
         broadcast_order_update(order)
         
-        return Response(CollectionOrderSerializer(order).data)
+        return self.order_response(request, order)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def mark_ordered(self, request, pk=None):
         order = self.get_object()
         if order.status != 'LOCKED':
@@ -641,9 +770,10 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
         # Broadcast order update via WebSocket
         broadcast_order_update(order)
         
-        return Response(CollectionOrderSerializer(order).data)
+        return self.order_response(request, order)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def close(self, request, pk=None):
         order = self.get_object()
         if order.status not in ['ORDERED', 'LOCKED']:
@@ -672,7 +802,7 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
         # Broadcast order update via WebSocket
         broadcast_order_update(order)
         
-        return Response(CollectionOrderSerializer(order).data)
+        return self.order_response(request, order)
     
     @action(detail=False, methods=['get'])
     def by_code(self, request):
@@ -684,18 +814,17 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            order = CollectionOrder.objects.get(code=code.upper())
+            order = annotate_access(CollectionOrder.objects, request.user).get(code=code.upper())
             
             # Check if order has assigned users - if so, only they can access it
-            if order.assigned_users.exists():
-                if request.user not in order.assigned_users.all() and request.user.role != 'manager' and order.collector != request.user:
-                    return Response(
-                        {'error': 'You are not assigned to this order'}, 
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            access = OrderAccess.for_order(request.user, order)
+            if not access.can_join:
+                return Response(
+                    {'error': 'You are not assigned to this order'}, 
+                    status=status.HTTP_403_FORBIDDEN
+                )
             
-            serializer = self.get_serializer(order, context={'request': request})
-            return Response(serializer.data)
+            return self.order_response(request, order, access)
         except CollectionOrder.DoesNotExist:
             return Response(
                 {'error': 'Order not found'}, 
@@ -703,6 +832,7 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def transfer_collector(self, request, pk=None):
         """Transfer collector role to another participant"""
         order = self.get_object()
@@ -754,7 +884,11 @@ class CollectionOrderViewSet(viewsets.ModelViewSet):
             details={'action': 'collector_transferred', 'old_collector': old_collector.username, 'new_collector': new_collector.username}
         )
         
-        return Response(CollectionOrderSerializer(order, context={'request': request}).data)
+        # Broadcast order update via WebSocket; connected clients re-check their access
+        broadcast_order_update(order, access_changed=True)
+        
+        # Read fresh: the requester may just have stopped being the collector
+        return self.order_response(request, order, get_order_access(request.user, order.id))
     
     @action(detail=False, methods=['get'])
     def pending_payments(self, request):
@@ -1008,6 +1142,12 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         order_id = self.request.query_params.get('order')
         user_id = self.request.query_params.get('user')
         queryset = OrderItem.objects.all()
+        fields = sparse_fieldset(self.request, OrderItemSerializer.Meta.fields)
+        related = [
+            relation for name, relation in (('user_name', 'user'), ('item_name', 'menu_item')) if name in fields
+        ]
+        if related:
+            queryset = queryset.select_related(*related)
         
         if order_id:
             queryset = queryset.filter(order_id=order_id)
@@ -1023,6 +1163,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         """Override create to add prompts for menu addition and price updates"""
         serializer = self.get_serializer(data=request.data)
@@ -1035,9 +1176,8 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             raise ValidationError("Cannot add items to a locked/closed order")
         
         # Check if order has assigned users - if so, only they can add items
-        if order.assigned_users.exists():
-            if request.user not in order.assigned_users.all() and request.user.role != 'manager' and order.collector != request.user:
-                raise ValidationError("You are not assigned to this order")
+        if not get_order_access(request.user, order.id, request).can_join:
+            raise ValidationError("You are not assigned to this order")
         
         # Set unit price
         if serializer.validated_data.get('menu_item'):
@@ -1067,7 +1207,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             # Check if a menu item with the same name exists in any menu for this restaurant
             existing_menu_item = MenuItem.objects.filter(
                 menu__restaurant=order.restaurant,
-                name__iexact=custom_name
+                normalized_name=normalize_item_name(custom_name)
             ).first()
             
             if existing_menu_item:
@@ -1105,7 +1245,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         
         # Broadcast order update via WebSocket
         order.refresh_from_db()
-        broadcast_order_update(order)
+        broadcast_order_patch(order, item_added_patch(item), include_participants=True)
         
         # Prepare response with prompts
         response_serializer = self.get_serializer(item)
@@ -1122,6 +1262,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         # The create method above handles everything
         pass
     
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         """Override update to handle price changes and prompts"""
         partial = kwargs.pop('partial', False)
@@ -1163,7 +1304,10 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         
         # Broadcast order update via WebSocket
         order.refresh_from_db()
-        broadcast_order_update(order)
+        broadcast_order_patch(
+            order, item_updated_patch(instance),
+            include_participants='user' in serializer.validated_data
+        )
         
         # Prepare response with prompts
         response_serializer = self.get_serializer(instance)
@@ -1177,6 +1321,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save()
     
+    @transaction.atomic
     def perform_destroy(self, instance):
         order = instance.order
         if order.status != 'OPEN':
@@ -1194,13 +1339,17 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             }
         )
         
+        item_id = instance.id
         instance.delete()
+        # A user's last item leaving may take away their access to a private order
+        left_order = not OrderItem.objects.filter(order=order, user_id=instance.user_id).exists()
         
         # Broadcast order update via WebSocket
         order.refresh_from_db()
-        broadcast_order_update(order)
+        broadcast_order_patch(order, item_removed_patch(item_id), include_participants=True, access_changed=left_order)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def add_to_menu(self, request, pk=None):
         """Add a custom item to the menu permanently"""
         item = self.get_object()
@@ -1237,7 +1386,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         # Check if item already exists in menu
         existing_item = MenuItem.objects.filter(
             menu=menu,
-            name__iexact=item.custom_name
+            normalized_name=normalize_item_name(item.custom_name)
         ).first()
         
         if existing_item:
@@ -1274,10 +1423,14 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             }
         )
         
+        # Broadcast order update via WebSocket
+        broadcast_order_patch(order, item_updated_patch(item))
+        
         serializer = self.get_serializer(item)
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def update_menu_item_price(self, request, pk=None):
         """Update the price of a menu item"""
         item = self.get_object()
@@ -1325,6 +1478,9 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             }
         )
         
+        # Broadcast order update via WebSocket
+        broadcast_order_patch(item.order, item_updated_patch(item))
+        
         serializer = self.get_serializer(item)
         return Response(serializer.data)
 
@@ -1353,7 +1509,30 @@ class PaymentViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    # Payments are part of the order snapshot, so every change bumps the order's version
+    @transaction.atomic
+    def perform_create(self, serializer):
+        payment = serializer.save()
+        broadcast_order_patch(payment.order, payment_changed_patch(payment))
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_order = serializer.instance.order
+        payment = serializer.save()
+        if payment.order_id != previous_order.id:
+            # Moved to another order: the previous one loses it
+            broadcast_order_update(previous_order)
+        broadcast_order_patch(payment.order, payment_changed_patch(payment))
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        order = instance.order
+        instance.delete()
+        # There is no patch for a removed payment
+        broadcast_order_update(order)
+    
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def mark_paid(self, request, pk=None):
         payment = self.get_object()
         
@@ -1369,7 +1548,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         payment.save()
         
         # Broadcast order update via WebSocket
-        broadcast_order_update(payment.order)
+        broadcast_order_patch(payment.order, payment_changed_patch(payment))
         
         return Response(PaymentSerializer(payment).data)
 
@@ -1,43 +1,206 @@
 """
 Utility functions for broadcasting order updates via WebSocket
+
+Two kinds of subscribers can listen to an order:
+- Snapshot clients (groups ``order_{id}_{audience}``) receive the full
+  serialized order on every change.
+- Delta clients (groups ``order_{id}_delta_{audience}``, opted in with
+  ``?protocol=delta``) keep the snapshot they received on connect and apply
+  small versioned patches to it. Delta frames are also kept in a per-order
+  replay buffer (see replay.py).
+
+Each kind has one group per audience, which gets its projection of every
+broadcast (see projections.py). Changes to who may see an order are preceded
+by an ``order_access_changed`` message, on which consumers re-check the
+user's access and switch audience or drop the order.
 """
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from django.db.models import Prefetch
-from .serializers import CollectionOrderSerializer
-from .models import OrderItem, Payment
+from channels.db import database_sync_to_async
+import logging
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from . import metrics, replay
+from .serializers import OrderItemSerializer, payment_summary
+from .board import publish_board_removal, publish_board_row
+from .projections import AUDIENCES, project_message
+from .snapshots import get_order_snapshot, snapshot_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def order_group_name(order_id, audience):
+    """Group for clients of an audience receiving full order snapshots"""
+    return f'order_{order_id}_{audience}'
+
 
+def order_delta_group_name(order_id, audience):
+    """Group for clients of an audience applying versioned delta patches"""
+    return f'order_{order_id}_delta_{audience}'
 
-def broadcast_order_update(order):
+
+def broadcast_order_update(order, access_changed=False):
     """
     Broadcast order update to all connected WebSocket clients for this order
-    Refreshes the order from database with all related data before serializing
+    The full snapshot is serialized by the outbox relay once the change commits.
+    Pass access_changed when the change can alter who may see the order or
+    in which audience (collector, assigned users, privacy).
     """
-    channel_layer = get_channel_layer()
-    if not channel_layer:
-        return  # Channels not configured
+    record_order_event(order, 'snapshot', access_changed=access_changed)
+
+
+def broadcast_order_patch(order, patch, include_participants=False, access_changed=False):
+    """
+    Broadcast a versioned delta patch for an order.
     
-    # Refresh order from database with all related data to ensure latest items/payments are included
-    from .models import CollectionOrder
-    refreshed_order = CollectionOrder.objects.prefetch_related(
-        Prefetch('items', queryset=OrderItem.objects.select_related('user', 'menu_item').order_by('-created_at')),
-        Prefetch('payments', queryset=Payment.objects.select_related('user').order_by('-created_at')),
-        'assigned_users'
-    ).select_related('restaurant', 'menu', 'collector').get(id=order.id)
+    Delta clients receive only the patches plus the recomputed totals; snapshot
+    clients still receive a full order payload so older apps keep working.
+    """
+    record_order_event(
+        order, 'patch', patch=patch, include_participants=include_participants, access_changed=access_changed
+    )
+
+
+def broadcast_order_removal(order):
+    """Take a deleted order off every board once the deletion commits"""
+    record_order_event(order, 'removed')
+
+
+def record_order_event(order, kind, patch=None, include_participants=False, access_changed=False):
+    """
+    Bump the order's version and write the change to the outbox in the caller's
+    transaction, waking the relay on commit. The version is bumped even without
+    a channel layer, since cached snapshots are keyed by it.
+    """
+    from .models import OrderEvent
+    from .outbox import relay
     
-    # Serialize order data with request context (if available)
-    # Note: We can't pass request context here, but serializer should work without it for most fields
-    serializer = CollectionOrderSerializer(refreshed_order)
-    order_data = serializer.data
+    with transaction.atomic():
+        version = order.bump_version()
+        if not get_channel_layer():
+            return  # Channels not configured: nothing to publish
+        OrderEvent.objects.create(
+            order=order,
+            version=version,
+            kind=kind,
+            patch=patch,
+            include_participants=include_participants,
+            access_changed=access_changed
+        )
+    metrics.incr('order_broadcast_requested')
+    transaction.on_commit(relay.wake)
+
+
+def broadcast_related_change(orders):
+    """
+    Refresh the orders (a queryset) whose snapshots show a user, restaurant,
+    menu or menu item that changed, in the caller's transaction.
+    Open orders get a new version and a snapshot broadcast, so neither clients
+    nor the snapshot cache keep the old names; closed orders drop their cached snapshot.
+    """
+    from .models import CollectionOrder, OrderEvent
+    from .outbox import relay
     
-    # Broadcast to the order's room group
-    room_group_name = f'order_{order.id}'
+    rows = list(orders.order_by().values_list('id', 'status', 'version'))
+    open_ids = [order_id for order_id, status, _ in rows if status != 'CLOSED']
+    closed_keys = [snapshot_cache_key(order_id, version) for order_id, status, version in rows if status == 'CLOSED']
+    if open_ids:
+        with transaction.atomic():
+            CollectionOrder.objects.filter(id__in=open_ids).update(version=F('version') + 1)
+            if get_channel_layer():
+                OrderEvent.objects.bulk_create([
+                    OrderEvent(order_id=order_id, version=version, kind='snapshot')
+                    for order_id, version in CollectionOrder.objects.filter(id__in=open_ids).values_list('id', 'version')
+                ])
+                transaction.on_commit(relay.wake)
+    if closed_keys:
+        transaction.on_commit(lambda: _drop_snapshots(closed_keys))
+    metrics.incr('order_snapshot_refreshed', len(rows))
+
+
+def _drop_snapshots(keys):
+    try:
+        cache.delete_many(keys)
+    except Exception:
+        logger.warning('Order snapshot cache unavailable', exc_info=True)
+
+
+async def publish_order_broadcast(order_id, pending):
+    """Serialize and fan out everything accumulated for one order"""
+    from .models import CollectionOrder
+    channel_layer = get_channel_layer()
+    if pending.removed:
+        await publish_board_removal(order_id)
+        return
+    try:
+        order_data = await database_sync_to_async(get_order_snapshot)(order_id)
+    except CollectionOrder.DoesNotExist:
+        return  # Order was deleted before the broadcast went out
+    snapshot_message = {
+        'type': 'order_update',
+        'order': order_data
+    }
     
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': 'order_update',
-            'order': order_data
+    delta_message = None
+    if pending.full_snapshot:
+        # A full snapshot supersedes any queued patches. Reconnecting clients
+        # only need to know it happened, so the buffer keeps a marker
+        await replay.append(order_id, pending.version, {'type': 'order_update', 'version': pending.version})
+        delta_message = snapshot_message
+    elif pending.patches:
+        message = {
+            'type': 'order_patch',
+            'order_id': order_id,
+            'version': pending.patches[-1]['version'],
+            'patches': pending.patches,
+            'totals': {
+                'total_items_cost': order_data['total_items_cost'],
+                'total_cost': order_data['total_cost'],
+            },
         }
-    )
+        if pending.include_participants:
+            message['participants'] = order_data['participants']
+        # Buffered unprojected; consumers project replayed messages for their audience
+        await replay.append(order_id, message['version'], message)
+        delta_message = message
+    
+    if pending.access_changed:
+        # Sent ahead of the change itself: connected users re-check their access and
+        # move to their new audience (or drop the order) before its frames arrive
+        for audience in AUDIENCES:
+            for group in (order_delta_group_name(order_id, audience), order_group_name(order_id, audience)):
+                await channel_layer.group_send(group, {'type': 'order_access_changed', 'order_id': order_id})
+    
+    for audience in AUDIENCES:
+        if delta_message is not None:
+            await channel_layer.group_send(order_delta_group_name(order_id, audience), project_message(delta_message, audience))
+        await channel_layer.group_send(order_group_name(order_id, audience), project_message(snapshot_message, audience))
+    await publish_board_row(order_data)
 
+
+def item_added_patch(item):
+    return {'op': 'item_added', 'item': OrderItemSerializer(item).data}
+
+
+def item_updated_patch(item):
+    return {'op': 'item_updated', 'item': OrderItemSerializer(item).data}
+
+
+def item_removed_patch(item_id):
+    return {'op': 'item_removed', 'item_id': item_id}
+
+
+def payment_changed_patch(payment):
+    return {'op': 'payment_changed', 'payment': payment_summary(payment)}
+
+
+def fee_changed_patch(order):
+    return {
+        'op': 'fee_changed',
+        'fees': {
+            'delivery_fee': f'{order.delivery_fee:.2f}',
+            'tip': f'{order.tip:.2f}',
+            'service_fee': f'{order.service_fee:.2f}',
+            'fee_split_rule': order.fee_split_rule,
+        }
+    }
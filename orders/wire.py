@@ -0,0 +1,140 @@
+"""
+Wire encodings for order WebSocket frames.
+
+JSON text frames are the default. Clients can negotiate msgpack binary frames
+with the `msgpack` subprotocol or `?encoding=msgpack`. In msgpack frames:
+
+- Users and menu items are interned per connection. A frame that mentions one
+  the client hasn't seen yet carries it in `tables`:
+  `{"users": [[id, username, email], ...], "menu_items": [[id, name], ...]}`.
+  Names are then left out of orders, items and payments (`collector_name`,
+  `user_name`, `item_name`, `participants` and `assigned_users_details` become
+  id lists or are dropped) and the client looks them up in its tables.
+  `email` is null when it hasn't been sent yet.
+- Timestamps are msgpack Timestamp values instead of ISO strings.
+- The live board's rows leave out `collector_name` the same way.
+
+Client messages may be sent as JSON text or msgpack in either mode.
+"""
+from datetime import datetime
+import msgpack
+from . import fastjson
+
+MSGPACK_SUBPROTOCOL = 'msgpack'
+
+TIMESTAMP_FIELDS = ('created_at', 'cutoff_time', 'locked_at', 'ordered_at', 'closed_at', 'paid_at')
+
+
+class JSONFrameEncoder:
+    binary = False
+    
+    def encode(self, frame):
+        return fastjson.dumps(frame).decode()
+
+
+class MsgpackFrameEncoder:
+    """msgpack frames with users and menu items interned per connection"""
+    binary = True
+    
+    def __init__(self):
+        # What this connection's client already has
+        self.users = {}
+        self.menu_items = {}
+    
+    def encode(self, frame):
+        # New entries for this frame: id -> [fields...]
+        tables = {'users': {}, 'menu_items': {}}
+        frame = self._frame(frame, tables)
+        tables = {
+            name: [[key, *value] for key, value in entries.items()]
+            for name, entries in tables.items() if entries
+        }
+        if tables:
+            frame['tables'] = tables
+        return msgpack.packb(frame, datetime=True)
+    
+    def _frame(self, frame, tables):
+        frame = dict(frame)
+        if frame.get('type') == 'board_update':
+            frame['order'] = self._row(frame['order'], tables)
+        elif 'order' in frame:
+            frame['order'] = self._order(frame['order'], tables)
+        if 'orders' in frame:
+            frame['orders'] = [self._row(row, tables) for row in frame['orders']]
+        if 'patches' in frame:
+            frame['patches'] = [self._patch(patch, tables) for patch in frame['patches']]
+        if 'participants' in frame:
+            frame['participants'] = [self._user(user, tables) for user in frame['participants']]
+        return frame
+    
+    def _order(self, order, tables):
+        order = _timestamps(order)
+        self._intern_user(tables, order['collector'], order.pop('collector_name'))
+        order['participants'] = [self._user(user, tables) for user in order['participants']]
+        for user in order.pop('assigned_users_details'):
+            self._user(user, tables)
+        order['items'] = [self._item(item, tables) for item in order['items']]
+        order['payments'] = [self._payment(payment, tables) for payment in order['payments']]
+        return order
+    
+    def _row(self, row, tables):
+        """A live board row (see board.py)"""
+        row = _timestamps(row)
+        self._intern_user(tables, row['collector'], row.pop('collector_name'))
+        return row
+    
+    def _patch(self, patch, tables):
+        if 'item' in patch:
+            return {**patch, 'item': self._item(patch['item'], tables)}
+        if 'payment' in patch:
+            return {**patch, 'payment': self._payment(patch['payment'], tables)}
+        return patch
+    
+    def _item(self, item, tables):
+        item = _timestamps(item)
+        self._intern_user(tables, item['user'], item.pop('user_name'))
+        if item['menu_item'] is not None:
+            name = item.pop('item_name')
+            if self.menu_items.get(item['menu_item']) != name:
+                self.menu_items[item['menu_item']] = name
+                tables['menu_items'][item['menu_item']] = [name]
+        return item
+    
+    def _payment(self, payment, tables):
+        payment = _timestamps(payment)
+        self._intern_user(tables, payment['user'], payment.pop('user_name'))
+        return payment
+    
+    def _user(self, user, tables):
+        self._intern_user(tables, user['id'], user['username'], user['email'])
+        return user['id']
+    
+    def _intern_user(self, tables, user_id, username, email=None):
+        known = self.users.get(user_id)
+        if known is not None and known[0] == username and (email is None or known[1] == email):
+            return
+        self.users[user_id] = tables['users'][user_id] = [username, email]
+
+
+def _timestamps(data):
+    data = dict(data)
+    for field in TIMESTAMP_FIELDS:
+        if isinstance(data.get(field), str):
+            data[field] = datetime.fromisoformat(data[field])
+    return data
+
+
+def select_encoder(scope):
+    """Pick the frame encoder a client asked for; returns (encoder, subprotocol to accept)"""
+    if MSGPACK_SUBPROTOCOL in scope.get('subprotocols', []):
+        return MsgpackFrameEncoder(), MSGPACK_SUBPROTOCOL
+    if b'encoding=msgpack' in scope.get('query_string', b'').split(b'&'):
+        return MsgpackFrameEncoder(), None
+    return JSONFrameEncoder(), None
+
+
+def decode_message(text_data=None, bytes_data=None):
+    """Parse a client message sent as JSON text or msgpack"""
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data)
+    return fastjson.loads(text_data)